@@ -10,6 +10,7 @@ from datapackage_pipelines.generators import (
 )
 
 from . import pipeline_steps
+from .config import settings
 
 import logging
 log = logging.getLogger(__name__)
@@ -41,6 +42,15 @@ class Generator(GeneratorBase):
 
         return available_steps
 
+    @staticmethod
+    def _use_bulk_dump(steps: list) -> list:
+        '''Replace `dump.to_sql` steps with `measure.dump_to_sql_bulk`, which
+        takes the same parameters.'''
+        return [('measure.dump_to_sql_bulk', step[1])
+                if isinstance(step, tuple) and step[0] == 'dump.to_sql'
+                else step
+                for step in steps]
+
     @classmethod
     def get_schema(cls):
         return json.load(open(SCHEMA_FILE))
@@ -68,6 +78,8 @@ class Generator(GeneratorBase):
                                               pipeline_id,
                                               project_id,
                                               config)
+                if settings.get('DB_BULK_DUMP', False):
+                    k_steps = cls._use_bulk_dump(k_steps)
                 _steps = steps(*k_steps)
             else:
                 log.warn('No {} pipeline generator available for {}'.format(
@@ -1,7 +1,5 @@
 import os
 
-from datapackage_pipelines.generators import slugify
-
 from datapackage_pipelines_measure.config import settings
 
 DOWNLOADS_PATH = os.path.join(os.path.dirname(__file__), '../../downloads')
@@ -11,16 +9,14 @@ label = 'code-hosting'
 
 def add_steps(steps: list, pipeline_id: str,
               project_id: str, config: dict) -> list:
-    for repo in config['github']['repositories']:
-        steps.append(('measure.add_github_resource', {
-            'name': slugify(repo).lower(),
-            'repo': repo.lower()
-        }))
+    steps.append(('measure.add_github_resource', {
+        'name': 'github',
+        'repositories': [repo.lower()
+                         for repo in config['github']['repositories']]
+    }))
 
     steps.append(('concatenate', {
-        'sources':
-            [slugify(repo).lower()
-             for repo in config['github']['repositories']],
+        'sources': ['github'],
         'target': {
             'name': 'code-hosting',
             'path': 'data/code-hosting.json'},
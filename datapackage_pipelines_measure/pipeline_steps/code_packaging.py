@@ -9,16 +9,9 @@ DOWNLOADS_PATH = os.path.join(os.path.dirname(__file__), '../../downloads')
 label = 'code-packaging'
 
 
-def add_steps(steps: list, pipeline_id: str,
-              project_id: str, config: dict) -> list:
-
-    steps.append(('measure.datastore_get_latest', {
-        'resource-name': 'latest-project-entries',
-        'table': 'codepackaging',
-        'engine': settings.get('DB_ENGINE'),
-        'distinct_on': ['project_id', 'package', 'source']
-    }))
-
+def _add_source_steps(steps, config):
+    '''Add one step for each package of each source (or for all packages
+    of a source, where they are requested together).'''
     if 'npm' in config:
         for package in config['npm']['packages']:
             steps.append(('measure.add_npm_resource', {
@@ -26,10 +19,10 @@ def add_steps(steps: list, pipeline_id: str,
             }))
 
     if 'pypi' in config:
-        for package in config['pypi']['packages']:
-            steps.append(('measure.add_pypi_resource', {
-                'package': slugify(package)
-            }))
+        # All pypi packages are requested with a single query
+        steps.append(('measure.add_pypi_resource', {
+            'packages': [slugify(p) for p in config['pypi']['packages']]
+        }))
 
     if 'rubygems' in config:
         for gem in config['rubygems']['gems']:
@@ -43,6 +36,28 @@ def add_steps(steps: list, pipeline_id: str,
                 'package': package
             }))
 
+
+def add_steps(steps: list, pipeline_id: str,
+              project_id: str, config: dict) -> list:
+
+    steps.append(('measure.datastore_get_latest', {
+        'resource-name': 'latest-project-entries',
+        'index': True,
+        'project_id': project_id,
+        'columns': ['downloads', 'total_downloads'],
+        'table': 'codepackaging',
+        'engine': settings.get('DB_ENGINE'),
+        'distinct_on': ['project_id', 'package', 'source']
+    }))
+
+    if config.get('single-process'):
+        # Collect all sources within a single processor
+        steps.append(('measure.collect', {
+            'config': config
+        }))
+    else:
+        _add_source_steps(steps, config)
+
     steps.append(('measure.remove_resource', {
         'name': 'latest-project-entries'
     }))
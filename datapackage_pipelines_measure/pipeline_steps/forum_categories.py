@@ -12,17 +12,20 @@ def add_steps(steps: list, pipeline_id: str,
 
     steps.append(('measure.datastore_get_latest', {
         'resource-name': 'latest-project-entries',
+        'index': True,
+        'project_id': project_id,
+        'columns': [],
         'table': 'forum_categories',
         'engine': settings.get('DB_ENGINE'),
         'distinct_on': ['project_id', 'domain', 'source', 'category']
     }))
 
     for domain_categories in config['discourse-categories']:
-        for category in domain_categories['categories']:
-            steps.append(('measure.add_discourse_category_resource', {
-                'category': category,
-                'domain': domain_categories['domain']
-            }))
+        # All categories of a domain are collected in one step
+        steps.append(('measure.add_discourse_category_resource', {
+            'categories': domain_categories['categories'],
+            'domain': domain_categories['domain']
+        }))
 
     steps.append(('measure.remove_resource', {
         'name': 'latest-project-entries'
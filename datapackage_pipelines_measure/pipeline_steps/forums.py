@@ -12,6 +12,9 @@ def add_steps(steps: str, pipeline_id: str,
 
     steps.append(('measure.datastore_get_latest', {
         'resource-name': 'latest-project-entries',
+        'index': True,
+        'project_id': project_id,
+        'columns': ['active_users'],
         'table': 'forums',
         'engine': settings.get('DB_ENGINE'),
         'distinct_on': ['project_id', 'domain', 'source']
@@ -19,9 +22,11 @@ def add_steps(steps: str, pipeline_id: str,
 
     if 'discourse' in config:
         for domain in config['discourse']['domains']:
-            steps.append(('measure.add_discourse_resource', {
-                'domain': domain
-            }))
+            step = {'domain': domain}
+            if 'active-users-report' in config['discourse']:
+                step['active-users-report'] = \
+                    config['discourse']['active-users-report']
+            steps.append(('measure.add_discourse_resource', step))
 
     steps.append(('measure.remove_resource', {
         'name': 'latest-project-entries'
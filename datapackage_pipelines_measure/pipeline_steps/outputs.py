@@ -15,6 +15,9 @@ def add_steps(steps: list, pipeline_id: str,
 
     steps.append(('measure.datastore_get_latest', {
         'resource-name': 'latest-project-entries',
+        'index': True,
+        'project_id': project_id,
+        'columns': [],
         'table': 'outputs',
         'engine': settings.get('DB_ENGINE'),
         'distinct_on': ['project_id', 'source', 'source_id'],
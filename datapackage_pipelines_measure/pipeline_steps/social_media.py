@@ -11,12 +11,25 @@ label = 'social-media'
 def add_steps(steps: list, pipeline_id: str,
               project_id: str, config: dict) -> list:
 
+    # Only a Twitter backfill needs the latest stored rows
+    backfill = config.get('twitter', {}).get('backfill', False)
+    if backfill:
+        steps.append(('measure.datastore_get_latest', {
+            'resource-name': 'latest-project-entries',
+            'index': True,
+            'project_id': project_id,
+            'columns': [],
+            'table': 'socialmedia',
+            'engine': settings.get('DB_ENGINE'),
+            'distinct_on': ['project_id', 'entity', 'entity_type', 'source']
+        }))
+
     if 'twitter' in config:
-        for entity in config['twitter']['entities']:
-            steps.append(('measure.add_twitter_resource', {
-                'entity': entity,
-                'project_id': project_id
-            }))
+        steps.append(('measure.add_twitter_resource', {
+            'entities': config['twitter']['entities'],
+            'project_id': project_id,
+            'backfill': backfill
+        }))
 
     if 'facebook' in config:
         for page in config['facebook']['pages']:
@@ -25,6 +38,11 @@ def add_steps(steps: list, pipeline_id: str,
                 'project_id': project_id
             }))
 
+    if backfill:
+        steps.append(('measure.remove_resource', {
+            'name': 'latest-project-entries'
+        }))
+
     steps.append(('concatenate', {
         'target': {
             'name': 'social-media',
@@ -12,16 +12,21 @@ def add_steps(steps: list, pipeline_id: str,
 
     steps.append(('measure.datastore_get_latest', {
         'resource-name': 'latest-project-entries',
+        'index': True,
+        'project_id': project_id,
+        'columns': [],
         'table': 'websiteanalytics',
         'engine': settings.get('DB_ENGINE'),
         'distinct_on': ['project_id', 'domain', 'source']
     }))
 
     if 'ga' in config:
-        for domain in config['ga']['domains']:
-            steps.append(('measure.add_ga_resource', {
-                'domain': domain
-            }))
+        # All domains are collected together, so views shared by several
+        # domains are only requested once
+        steps.append(('measure.add_ga_resource', {
+            'name': 'ga',
+            'domains': config['ga']['domains']
+        }))
 
     steps.append(('measure.remove_resource', {
         'name': 'latest-project-entries'
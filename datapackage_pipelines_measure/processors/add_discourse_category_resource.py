@@ -3,90 +3,88 @@ import collections
 from datapackage_pipelines.generators import slugify
 from datapackage_pipelines.wrapper import ingest, spew
 
+from datapackage_pipelines_measure.processors import http_utils
 from datapackage_pipelines_measure.processors.discourse_utils import (
-    request_report_from_discourse,
-    get_category_info_from_discourse
+    get_category,
+    run_with_client
 )
+from datapackage_pipelines_measure.processors.latest_utils import \
+    get_latest_lookup
 
 import logging
 log = logging.getLogger(__name__)
 
 
-def _get_category_id_from_category_name(domain, category):
-    category_map = get_category_info_from_discourse(domain)
-    return next(c['id'] for c in category_map if c['slug'] == category)
+async def _request_category_reports(client, category_id, latest_date):
+    '''Return the new topics and new posts reports for `category_id`.'''
+    return await client.gather(
+        client.report('topics', latest_date, category_id=category_id),
+        client.report('posts', latest_date, category_id=category_id))
+
+
+async def _collect_category_stats(client, parent, category,
+                                  child_treatment, latest_date):
+    '''Return a dict of category name to a defaultdict of date to its stats,
+    for `category` (whose category info is `parent`) and, depending on
+    `child_treatment`, its subcategories. The reports of the category and all
+    its subcategories are requested concurrently.'''
+    children = []
+    if child_treatment in ('aggregate', 'expand'):
+        children = parent['subcategories']
+    reports = await client.gather(*[
+        _request_category_reports(client, c['id'], latest_date)
+        for c in [parent] + children])
+
+    category_stats = collections.OrderedDict()
+    for c, (new_topics_by_date, new_posts_by_date) in \
+            zip([parent] + children, reports):
+        if c is parent or child_treatment == 'aggregate':
+            # Add child category data to parent data
+            name = category
+        else:
+            # Save child category data as separate rows
+            name = c['slug']
+        dd = category_stats.setdefault(
+            name, collections.defaultdict(lambda: {'new_topics': 0,
+                                                   'new_posts': 0}))
+        for date, topic_num in new_topics_by_date.items():
+            dd[date]['new_topics'] += topic_num
+        for date, post_num in new_posts_by_date.items():
+            dd[date]['new_posts'] += post_num
+    return category_stats
 
 
-def _get_category_child_ids(domain, category_id):
-    '''Given a `category_id` return a list of subcategory ids.'''
-    category_map = get_category_info_from_discourse(domain)
-    parent_category = next(c for c in category_map if c['id'] == category_id)
-    return parent_category['subcategories']
+def _latest_date(get_latest, domain, category):
+    latest_row = get_latest(source='discourse', domain=domain,
+                            category=category)
+    return latest_row['date'] if latest_row else None
 
 
-def discourse_collector(domain, category, child_treatment, latest_row):  # noqa (ignore mccabe for this function)
-    def _make_stats_dict_for_category_id(category_id, category_name):
-        '''Return a defaultdict where items have a date as a key, and category
-        stats for a value, for a given category_id and category_name'''
-        dd = collections.defaultdict(lambda: {'new_topics': 0,
-                                              'new_posts': 0,
-                                              'category': category_name})
-        new_topics_by_date = \
-            request_report_from_discourse(domain, 'topics', latest_date,
-                                          category_id=category_id)
-        new_posts_by_date = \
-            request_report_from_discourse(domain, 'posts', latest_date,
-                                          category_id=category_id)
+def discourse_collector(domain, categories, get_latest):
+    '''Return rows for each of the `categories` of `domain`, collected
+    since the date of their latest row, as returned by `get_latest`.'''
+    parents = [get_category(domain, slug=c['name']) for c in categories]
 
-        for date, topic_num in new_topics_by_date.items():
-            dd[date]['new_topics'] = topic_num
-
-        for date, post_num in new_posts_by_date.items():
-            dd[date]['new_posts'] = post_num
-
-        return dd
-
-    latest_date = latest_row['date'] if latest_row else None
-    category_id = _get_category_id_from_category_name(domain, category)
-
-    toplevel_dd = _make_stats_dict_for_category_id(category_id, category)
-
-    row_data_to_chain = [toplevel_dd]
-
-    if child_treatment == 'aggregate':
-        # Add child category data to parent data
-        child_categories = _get_category_child_ids(domain, category_id)
-        for child in child_categories:
-            child_new_topics_by_date = \
-                request_report_from_discourse(domain, 'topics', latest_date,
-                                              category_id=child['id'])
-            child_new_posts_by_date = \
-                request_report_from_discourse(domain, 'posts', latest_date,
-                                              category_id=child['id'])
-            for date, topic_num in child_new_topics_by_date.items():
-                toplevel_dd[date]['new_topics'] += topic_num
-            for date, post_num in child_new_posts_by_date.items():
-                toplevel_dd[date]['new_posts'] += post_num
-    elif child_treatment == 'expand':
-        # Save child category data as separate rows
-        child_categories = _get_category_child_ids(domain, category_id)
-        for child in child_categories:
-            child_dd = _make_stats_dict_for_category_id(child['id'],
-                                                        child['slug'])
-            row_data_to_chain.append(child_dd)
+    async def _collect(client):
+        return await client.gather(*[
+            _collect_category_stats(
+                client, parent, c['name'], c.get('children', None),
+                _latest_date(get_latest, domain, c['name']))
+            for c, parent in zip(categories, parents)])
 
     resource_content = []
-    for dd in row_data_to_chain:
-        for date, stats in dd.items():
-            res_row = {
-                'source': 'discourse',
-                'domain': domain,
-                'category': stats['category'],
-                'date': date,
-                'new_topics': stats['new_topics'],
-                'new_posts': stats['new_posts']
-            }
-            resource_content.append(res_row)
+    for category_stats in run_with_client(domain, _collect):
+        for category_name, dd in category_stats.items():
+            for date, stats in dd.items():
+                res_row = {
+                    'source': 'discourse',
+                    'domain': domain,
+                    'category': category_name,
+                    'date': date,
+                    'new_topics': stats['new_topics'],
+                    'new_posts': stats['new_posts']
+                }
+                resource_content.append(res_row)
 
     return resource_content
 
@@ -94,8 +92,8 @@ def discourse_collector(domain, category, child_treatment, latest_row):  # noqa
 parameters, datapackage, res_iter = ingest()
 
 domain = parameters['domain']
-category = parameters['category']['name']
-child_treatment = parameters['category'].get('children', None)
+# All categories of a domain are collected together
+categories = parameters.get('categories', [parameters.get('category')])
 
 resource = {
     'name': slugify(domain),
@@ -109,28 +107,14 @@ resource['schema'] = {'fields': [{'name': h, 'type': 'string'}
 datapackage['resources'].append(resource)
 
 
-def process_resources(res_iter, datapackage, domain,
-                      category, child_treatment):
-
-    def get_latest_row(first):
-        latest_row = None
-        my_rows = []
-        for row in first:
-            if row['domain'] == domain and row['category'] == category \
-               and row['source'] == 'discourse':
-                latest_row = row
-            my_rows.append(row)
-        return latest_row, iter(my_rows)
-
-    if len(datapackage['resources']):
-        if datapackage['resources'][0]['name'] == 'latest-project-entries':
-            latest_row, latest_iter = get_latest_row(next(res_iter))
-            yield latest_iter
-        else:
-            latest_row = None
+def process_resources(res_iter, datapackage, domain, categories):
+    get_latest, res_iter = get_latest_lookup(
+        datapackage, res_iter, ['category', 'domain', 'source'])
     yield from res_iter
-    yield discourse_collector(domain, category, child_treatment, latest_row)
+    yield discourse_collector(domain, categories, get_latest)
 
 
+# Rate limit waits are counted in the pipeline stats
 spew(datapackage, process_resources(res_iter, datapackage, domain,
-                                    category, child_treatment))
+                                    categories),
+     http_utils.stats)
@@ -4,54 +4,61 @@ import datetime
 from datapackage_pipelines.generators import slugify
 from datapackage_pipelines.wrapper import ingest, spew
 
-from datapackage_pipelines_measure.processors.discourse_utils import (
-    request_data_from_discourse,
-    request_report_from_discourse
-)
+from datapackage_pipelines_measure.processors import http_utils
+from datapackage_pipelines_measure.processors.discourse_utils import \
+    run_with_client
+from datapackage_pipelines_measure.processors.latest_utils import \
+    get_latest_row
 
 import logging
 log = logging.getLogger(__name__)
 
 
-def _request_users_from_discourse(domain, flag, page=1):
-    endpoint = "/admin/users/list/{}.json".format(flag)
-    return request_data_from_discourse(domain, endpoint, page=page)
+def _is_active_last_24_hrs(user):
+    return user['last_seen_age'] <= 24 * 60 * 60
 
 
-def _get_active_users_number_last_24_hrs(domain):
-    '''Return the number of active users within last 24hrs.'''
+async def _count_active_users(client, active_users_report):
+    '''Return the number of users active within the last 24hrs.
+
+    If `active_users_report` is given, its most recent value is used, unless
+    the forum can't provide the report. Otherwise, active users are counted
+    from the (bounded) paging of the active users list, which lists users
+    most recently seen first.
+    '''
+    if active_users_report:
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        try:
+            by_date = await client.report(active_users_report,
+                                          yesterday.strftime('%Y-%m-%d'))
+        except ValueError as e:
+            log.warning('Report {} is not available from {}, counting '
+                        'active users instead: {}'.format(
+                            active_users_report, client.domain, e))
+        else:
+            if by_date:
+                return by_date[max(by_date)]
+    return await client.count_users('active', _is_active_last_24_hrs)
 
-    def _page_active_users(domain):
-        '''Request active users by page until an empty array is return, or we
-        reach a user created after the last 24hr'''
-        current_page = 1  # /admin/users/list paging starts at one
-        day_in_seconds = 24 * 60 * 60
-        while True:
-            users = _request_users_from_discourse(domain, 'active',
-                                                  current_page)
-            if len(users) == 0:
-                raise StopIteration
-            current_page = current_page + 1
-            for user in users:
-                if user['last_seen_age'] > day_in_seconds:
-                    raise StopIteration
-                yield user
 
-    return len(list(_page_active_users(domain)))
+async def _collect_stats(client, latest_date, active_users_report=None):
+    '''Request the number of users active within the last 24hrs, and the
+    signups, topics, posts and visits reports, concurrently.'''
+    return await client.gather(
+        _count_active_users(client, active_users_report),
+        client.report('signups', latest_date),
+        client.report('topics', latest_date),
+        client.report('posts', latest_date),
+        client.report('visits', latest_date))
 
 
-def discourse_collector(domain, latest_row):
+def discourse_collector(domain, latest_row, active_users_report=None):
     today = datetime.date.today()
     latest_date = latest_row['date'] if latest_row else None
-    active_users_response = _get_active_users_number_last_24_hrs(domain)
-    new_users_by_date = \
-        request_report_from_discourse(domain, 'signups', latest_date)
-    new_topics_by_date = \
-        request_report_from_discourse(domain, 'topics', latest_date)
-    new_posts_by_date = \
-        request_report_from_discourse(domain, 'posts', latest_date)
-    visits_by_date = \
-        request_report_from_discourse(domain, 'visits', latest_date)
+    active_users_response, new_users_by_date, new_topics_by_date, \
+        new_posts_by_date, visits_by_date = run_with_client(
+            domain, lambda client: _collect_stats(client, latest_date,
+                                                  active_users_report))
 
     dd = collections.defaultdict(lambda: {'new_users': 0,
                                           'new_topics': 0,
@@ -98,6 +105,8 @@ def discourse_collector(domain, latest_row):
 parameters, datapackage, res_iter = ingest()
 
 domain = parameters['domain']
+# A report to read the number of active users from, if the forum has one
+active_users_report = parameters.get('active-users-report')
 resource = {
     'name': slugify(domain),
     'path': 'data/{}.csv'.format(slugify(domain))
@@ -111,25 +120,14 @@ resource['schema'] = {'fields': [{'name': h, 'type': 'string'}
 datapackage['resources'].append(resource)
 
 
-def process_resources(res_iter, datapackage, domain):
-
-    def get_latest_row(first):
-        latest_row = None
-        my_rows = []
-        for row in first:
-            if row['domain'] == domain and row['source'] == 'discourse':
-                latest_row = row
-            my_rows.append(row)
-        return latest_row, iter(my_rows)
-
-    if len(datapackage['resources']):
-        if datapackage['resources'][0]['name'] == 'latest-project-entries':
-            latest_row, latest_iter = get_latest_row(next(res_iter))
-            yield latest_iter
-        else:
-            latest_row = None
+def process_resources(res_iter, datapackage, domain, active_users_report):
+    latest_row, res_iter = get_latest_row(
+        datapackage, res_iter, source='discourse', domain=domain)
     yield from res_iter
-    yield discourse_collector(domain, latest_row)
+    yield discourse_collector(domain, latest_row, active_users_report)
 
 
-spew(datapackage, process_resources(res_iter, datapackage, domain))
+# Rate limit waits are counted in the pipeline stats
+spew(datapackage, process_resources(res_iter, datapackage, domain,
+                                    active_users_report),
+     http_utils.stats)
@@ -4,13 +4,15 @@ import datetime
 import dateutil
 
 import simplejson
-import requests
 from requests.auth import HTTPBasicAuth
 
 from datapackage_pipelines.generators import slugify
 from datapackage_pipelines.wrapper import ingest, spew
 
 from datapackage_pipelines_measure.config import settings
+from datapackage_pipelines_measure.processors import http_utils
+from datapackage_pipelines_measure.processors.latest_utils import \
+    get_latest_row
 
 import logging
 log = logging.getLogger(__name__)
@@ -23,9 +25,10 @@ def _request_data_from_mailchimp(endpoint):
     mailchimp_url = 'https://{dc}.api.mailchimp.com/3.0{endpoint}' \
         .format(dc=data_center, endpoint=endpoint)
 
-    mailchimp_response = requests.get(mailchimp_url,
-                                      auth=HTTPBasicAuth('username',
-                                                         api_token))
+    mailchimp_response = http_utils.get(mailchimp_url,
+                                        auth=HTTPBasicAuth('username',
+                                                           api_token),
+                                        cache_source='mailchimp')
 
     if (mailchimp_response.status_code != 200):
         log.error('An error occurred fetching MailChimp data: {}'
@@ -167,22 +170,8 @@ datapackage['resources'].append(resource)
 
 
 def process_resources(res_iter, datapackage, list_id):
-
-    def get_latest_row(first):
-        latest_row = None
-        my_rows = []
-        for row in first:
-            if row['list_id'] == list_id and row['source'] == 'mailchimp':
-                latest_row = row
-            my_rows.append(row)
-        return latest_row, iter(my_rows)
-
-    if len(datapackage['resources']):
-        if datapackage['resources'][0]['name'] == 'latest-project-entries':
-            latest_row, latest_iter = get_latest_row(next(res_iter))
-            yield latest_iter
-        else:
-            latest_row = None
+    latest_row, res_iter = get_latest_row(
+        datapackage, res_iter, source='mailchimp', list_id=list_id)
     yield from res_iter
     yield mailchimp_collector(list_id, latest_row)
 
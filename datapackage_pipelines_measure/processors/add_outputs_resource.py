@@ -7,6 +7,8 @@ from datapackage_pipelines.generators import slugify
 from datapackage_pipelines.wrapper import ingest, spew
 
 from datapackage_pipelines_measure.processors import google_utils
+from datapackage_pipelines_measure.processors.latest_utils import \
+    get_latest_row
 
 import logging
 log = logging.getLogger(__name__)
@@ -97,23 +99,10 @@ def form_collector(source_id, source_type, latest_date):
 
 
 def process_resources(res_iter, datapackage, source_id, source_type):
-
-    def get_latest_date(first):
-        latest_date = None
-        my_rows = []
-        for row in first:
-            if row['source_id'] == source_id and row['source'] == 'gsheets':
-                latest_date = row['source_timestamp']
-            my_rows.append(row)
-        return latest_date, iter(my_rows)
-
-    if len(datapackage['resources']):
-        if datapackage['resources'][0]['name'] == 'latest-project-entries':
-            latest_date, latest_iter = get_latest_date(next(res_iter))
-            yield latest_iter
-        else:
-            latest_date = None
+    latest_row, res_iter = get_latest_row(
+        datapackage, res_iter, source='gsheets', source_id=source_id)
     yield from res_iter
+    latest_date = latest_row['source_timestamp'] if latest_row else None
     yield form_collector(source_id, source_type, latest_date)
 
 
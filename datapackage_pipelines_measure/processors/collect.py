@@ -0,0 +1,130 @@
+'''Collect all `code-packaging` sources of a project in a single processor.
+
+Rather than one `measure.add_*_resource` step (and so one process) per
+package, the whole `code-packaging` config section is passed as the `config`
+parameter, and each package is collected over a bounded worker pool. Source
+modules are only imported for sources that are configured.
+'''
+
+import importlib
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from datapackage_pipelines.generators import slugify
+from datapackage_pipelines.wrapper import ingest, spew
+
+from datapackage_pipelines_measure.config import settings
+from datapackage_pipelines_measure.processors.latest_utils import \
+    get_latest_lookup
+
+import logging
+log = logging.getLogger(__name__)
+
+MAX_WORKERS = int(settings.get('COLLECT_MAX_WORKERS', 4))
+RESOURCE_NAME = 'code-packaging-collected'
+HEADERS = ['package', 'source', 'date', 'downloads', 'total_downloads']
+
+
+def _import_utils(source):
+    return importlib.import_module(
+        'datapackage_pipelines_measure.processors.{}_utils'.format(source))
+
+
+def _latest_date(get_latest, source, package):
+    latest_row = get_latest(source=source, package=package)
+    return latest_row['date'] if latest_row else None
+
+
+def _get_tasks(config, get_latest):
+    '''Return a list of argument-less callables, each returning a list of
+    rows, for every package in the `code-packaging` `config`. `get_latest`
+    looks up the latest row for a source and package.'''
+    tasks = []
+
+    if 'npm' in config:
+        npm_utils = _import_utils('npm')
+        packages = [slugify(p) for p in config['npm']['packages']]
+        latest_dates = {p: _latest_date(get_latest, 'npm', p)
+                        for p in packages}
+        scoped_packages = {slugify(p) for p in config['npm']['packages']
+                           if p.startswith('@')}
+
+        # npm packages are requested together, with bulk queries where
+        # possible
+        def npm_task():
+            collected = npm_utils.npm_bulk_collector(latest_dates,
+                                                     scoped_packages)
+            return list(itertools.chain.from_iterable(
+                collected[p] for p in packages))
+        tasks.append(npm_task)
+
+    if 'pypi' in config:
+        pypi_utils = _import_utils('pypi')
+        pypi_packages = [slugify(p) for p in config['pypi']['packages']]
+        pypi_latest_dates = {p: _latest_date(get_latest, 'pypi', p)
+                             for p in pypi_packages}
+
+        # pypi packages are requested together, with a single query
+        def pypi_task():
+            collected = pypi_utils.pypi_bulk_collector(pypi_latest_dates)
+            return list(itertools.chain.from_iterable(
+                collected[p] for p in pypi_packages))
+        tasks.append(pypi_task)
+
+    if 'rubygems' in config:
+        rubygems_utils = _import_utils('rubygems')
+        for gem_id in config['rubygems']['gems']:
+            tasks.append(
+                lambda gem_id=gem_id: rubygems_utils.rubygems_collector(
+                    gem_id, get_latest(source='rubygems', package=gem_id)))
+
+    if 'packagist' in config:
+        packagist_utils = _import_utils('packagist')
+        for package in config['packagist']['packages']:
+            # Packagist rows are stored without the owner organization
+            package_name = package.split('/')[-1]
+            tasks.append(
+                lambda package=package, package_name=package_name:
+                    packagist_utils.packagist_collector(
+                        package,
+                        get_latest(source='packagist',
+                                   package=package_name)))
+
+    return tasks
+
+
+def collect(config, get_latest):
+    '''Run the tasks for `config` over a worker pool, returning all rows in
+    the order the sources and packages are configured.'''
+    tasks = _get_tasks(config, get_latest)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = list(executor.map(lambda task: task(), tasks))
+    return [{h: row.get(h) for h in HEADERS}
+            for row in itertools.chain.from_iterable(results)]
+
+
+parameters, datapackage, res_iter = ingest()
+
+config = parameters['config']
+
+resource = {
+    'name': RESOURCE_NAME,
+    'path': 'data/{}.csv'.format(RESOURCE_NAME)
+}
+
+# Temporarily set all types to string, will use `set_types` processor in
+# pipeline to assign correct types
+resource['schema'] = {'fields': [{'name': h, 'type': 'string'}
+                                 for h in HEADERS]}
+
+datapackage['resources'].append(resource)
+
+
+def process_resources(res_iter, datapackage, config):
+    get_latest, res_iter = get_latest_lookup(datapackage, res_iter,
+                                             ['package', 'source'])
+    yield from res_iter
+    yield collect(config, get_latest)
+
+
+spew(datapackage, process_resources(res_iter, datapackage, config))
@@ -2,9 +2,11 @@ import itertools
 
 from datapackage_pipelines.wrapper import ingest, spew
 
-from sqlalchemy.ext.automap import automap_base
-from sqlalchemy.orm import Session
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, func, select, Index, MetaData, Table
+from sqlalchemy.exc import NoSuchTableError
+
+from datapackage_pipelines_measure.processors.latest_utils import \
+    write_latest_index
 
 import logging
 log = logging.getLogger(__name__)
@@ -15,53 +17,119 @@ parameters, datapackage, res_iter = ingest()
 table = parameters['table']
 engine = parameters['engine']
 resource_name = parameters['resource-name']
-distinct_on = ', '.join(parameters['distinct_on'])
+distinct_on = parameters['distinct_on']
 sort_date_key = parameters.get('sort_date_key', 'date')
+# Only select these columns, in addition to the `distinct_on` and
+# `sort_date_key` columns. All columns are selected by default.
+columns = parameters.get('columns')
+# Only select rows for this project, if given
+project_id = parameters.get('project_id')
+# Create the index the query needs, if it doesn't exist
+create_index = parameters.get('create-index', False)
+# Write the latest rows to an index file, rather than streaming them as a
+# resource
+as_index = parameters.get('index', False)
+
+
+def _ensure_index(engine, table_obj, index_columns):
+    '''Create an index on `index_columns` if `create_index` is set, otherwise
+    recommend it if no existing index starts with those columns.'''
+    index_column_names = [c.name for c in index_columns]
+    if any(list(index.columns.keys())[:len(index_column_names)] ==
+           index_column_names for index in table_obj.indexes):
+        return
+
+    index = Index('ix_{}_latest'.format(table_obj.name), *index_columns)
+    if create_index:
+        log.info('Creating index {} on {}({})'.format(
+            index.name, table_obj.name, ', '.join(index_column_names)))
+        index.create(engine, checkfirst=True)
+    else:
+        log.warning('No index for latest entries of {0}. Consider creating '
+                    'one with "CREATE INDEX {1} ON {0} ({2})", or setting '
+                    '`create-index`.'.format(table_obj.name, index.name,
+                                             ', '.join(index_column_names)))
+
+
+def _build_query(engine, table_obj):
+    '''Return a query for the latest row of each `distinct_on` group.'''
+    key_columns = [table_obj.c[c] for c in distinct_on]
+    sort_column = table_obj.c[sort_date_key]
+    if columns is None:
+        selected = list(table_obj.c)
+    else:
+        selected_names = list(distinct_on) + \
+            [c for c in [sort_date_key] + columns if c not in distinct_on]
+        selected = [table_obj.c[c] for c in selected_names]
+
+    if engine.dialect.name == 'postgresql':
+        query = select(selected) \
+            .distinct(*key_columns) \
+            .order_by(*key_columns, sort_column.desc())
+        if project_id is not None:
+            query = query.where(table_obj.c.project_id == project_id)
+        return query
+
+    # Other databases don't support DISTINCT ON, so rank rows by date within
+    # each group instead.
+    rank = func.row_number().over(partition_by=key_columns,
+                                  order_by=sort_column.desc()).label('rank')
+    ranked = select(selected + [rank])
+    if project_id is not None:
+        ranked = ranked.where(table_obj.c.project_id == project_id)
+    ranked = ranked.subquery()
+    return select([ranked.c[c.name] for c in selected]) \
+        .where(ranked.c.rank == 1)
+
+
+def _get_latest_rows(engine, table_obj):
+    query = _build_query(engine, table_obj)
+    with engine.connect() as connection:
+        # Stream rows with a server-side cursor, where supported, rather than
+        # loading the whole result first
+        result = connection.execution_options(stream_results=True) \
+            .execute(query)
+        keys = list(result.keys())
+        for row in result:
+            yield dict(zip(keys, row))
+
 
-Base = automap_base()
 engine = create_engine(engine)
-# Reflect the tables
-Base.prepare(engine, reflect=True)
 
 try:
-    Table = Base.classes[table]
-except KeyError:
+    # Only reflect the table we need
+    table_obj = Table(table, MetaData(), autoload_with=engine)
+except NoSuchTableError:
     # No table in database, spew nothing extra
     spew(datapackage, res_iter)
 else:
-    session = Session(engine)
-
-    s = text(
-        "SELECT DISTINCT ON ({0}) *"
-        "FROM {1} "
-        "ORDER BY {0}, {2} DESC"
-        .format(distinct_on, table, sort_date_key)
-    )
-
-    results = session.query(Table).from_statement(s).all()
-
-    resource_content = []
-
-    for result in results:
-        row = dict((col, getattr(result, col))
-                   for col in result.__table__.columns.keys())
-        resource_content.append(row)
-
-    resource = {
-        'name': resource_name,
-        'path': 'data/{}.csv'.format(resource_name)
-    }
-
-    # Temporarily set all types to string.
-    if len(resource_content):
-        resource['schema'] = {
-            'fields': [{'name': h, 'type': 'string'}
-                       for h in resource_content[0].keys()]}
+    _ensure_index(engine, table_obj,
+                  [table_obj.c[c] for c in distinct_on] +
+                  [table_obj.c[sort_date_key]])
+
+    if as_index:
+        key_fields = [f for f in distinct_on if f != 'project_id']
+        write_latest_index(datapackage, resource_name,
+                           _get_latest_rows(engine, table_obj), key_fields)
+        spew(datapackage, res_iter)
     else:
-        resource['schema'] = {
-            'fields': [{'name': 'empty', 'type': 'string'}]
+        resource_content = list(_get_latest_rows(engine, table_obj))
+
+        resource = {
+            'name': resource_name,
+            'path': 'data/{}.csv'.format(resource_name)
         }
 
-    datapackage['resources'].append(resource)
+        # Temporarily set all types to string.
+        if len(resource_content):
+            resource['schema'] = {
+                'fields': [{'name': h, 'type': 'string'}
+                           for h in resource_content[0].keys()]}
+        else:
+            resource['schema'] = {
+                'fields': [{'name': 'empty', 'type': 'string'}]
+            }
+
+        datapackage['resources'].append(resource)
 
-    spew(datapackage, itertools.chain(res_iter, [resource_content]))
+        spew(datapackage, itertools.chain(res_iter, [resource_content]))
@@ -1,21 +1,40 @@
+import asyncio
 import datetime
 import dateutil
-import urllib
-import functools
+import hashlib
+import os
+import threading
 import time
+import urllib.parse
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
 import simplejson
 
 from datapackage_pipelines_measure.config import settings
+from datapackage_pipelines_measure.processors import http_cache, http_utils
 
 import logging
 log = logging.getLogger(__name__)
 
 DEFAULT_REPORT_START_DATE = '2014-01-01'
+# Maximum number of requests made to a forum at once
+MAX_CONCURRENCY = int(settings.get('DISCOURSE_MAX_CONCURRENCY', 4))
+# Seconds a forum's categories are cached on disk (0 disables the cache)
+CATEGORY_CACHE_TTL = float(settings.get('DISCOURSE_CATEGORY_CACHE_TTL',
+                                        24 * 60 * 60))
+CATEGORY_CACHE_PATH = settings.get(
+    'DISCOURSE_CATEGORY_CACHE_PATH',
+    os.path.join(os.path.dirname(__file__), '../../.cache/discourse'))
+
+_category_cache = None
+_category_cache_lock = threading.Lock()
+# Domains whose categories have been requested again in this process, after
+# a category was missing from them
+_refreshed_domains = set()
 
 
-def request_data_from_discourse(domain, endpoint, **kwargs):
+def request_data_from_discourse(domain, endpoint, cache_ttl=None, **kwargs):
     api_token = settings['DISCOURSE_API_TOKEN']
     qs_dict = {'api_key': api_token}
     qs_dict.update(kwargs)
@@ -23,12 +42,10 @@ def request_data_from_discourse(domain, endpoint, **kwargs):
     url = urllib.parse.urlunparse(
         ('https', domain, endpoint, None, qs, None)
     )
-    response = requests.get(url)
-    if response.status_code == 429:
-        # Too Many Requests
-        time.sleep(30)
-        return request_data_from_discourse(domain, endpoint, **kwargs)
-    elif response.status_code != 200:
+    response = http_utils.get(url, cache_source='discourse',
+                              cache_ttl=cache_ttl,
+                              retry_policy=http_utils.RETRY_POLICY)
+    if response.status_code != 200:
         raise ValueError(
             'Error raised for domain:{}, '
             'Status code:{}. '
@@ -54,29 +71,232 @@ def request_report_from_discourse(domain, report, start_date,
     if start_date is None:
         start_date = DEFAULT_REPORT_START_DATE
     endpoint = "/admin/reports/{}.json".format(report)
+    # Reports for periods that have ended won't change, so can be cached
+    # indefinitely.
+    cache_ttl = None
+    if end_date < datetime.date.today().strftime("%Y-%m-%d"):
+        cache_ttl = http_utils.CACHE_FOREVER
     data = request_data_from_discourse(
-        domain, endpoint,
+        domain, endpoint, cache_ttl=cache_ttl,
         start_date=start_date,
         end_date=end_date,
         category_id=category_id)['report']['data']
     return {dateutil.parser.parse(d['x']).date(): d['y'] for d in data}
 
 
-@functools.lru_cache(maxsize=64)
-def get_category_info_from_discourse(domain):
-    '''Return a list of top-level category names and ids, and their
-    subcategories, where appropriate. '''
+def _request_category_info_from_discourse(domain):
+    '''Request the categories of `domain`, and return a list of top-level
+    category names and ids, and their subcategories.'''
     endpoint = "/site.json"
     site_data = request_data_from_discourse(domain, endpoint)
     top_level = [{'id': c['id'], 'name': c['name'],
                   'slug': c['slug'], 'subcategories': []}
                  for c in site_data['categories']
                  if 'parent_category_id' not in c]
+    top_level_by_id = {c['id']: c for c in top_level}
     for c in site_data['categories']:
         if 'parent_category_id' in c:
-            parent = next(pc for pc in top_level
-                          if pc['id'] == c['parent_category_id'])
+            parent = top_level_by_id[c['parent_category_id']]
             parent['subcategories'].append({'id': c['id'], 'slug': c['slug'],
                                             'name': c['name'],
                                             'subcategories': None})
     return top_level
+
+
+def _get_category_cache():
+    global _category_cache
+    with _category_cache_lock:
+        if _category_cache is None:
+            _category_cache = http_cache.SQLiteCache(CATEGORY_CACHE_PATH)
+    return _category_cache
+
+
+def get_category_info_from_discourse(domain, refresh=False):
+    '''Return a list of top-level category names and ids, and their
+    subcategories, where appropriate.
+
+    `/site.json` is large, so the categories are cached on disk, across
+    pipeline runs, for `CATEGORY_CACHE_TTL` seconds. With `refresh`, the
+    cached categories are replaced with newly requested ones.
+    '''
+    if not CATEGORY_CACHE_TTL:
+        return _request_category_info_from_discourse(domain)
+
+    cache = _get_category_cache()
+    key = hashlib.sha256(domain.encode('utf-8')).hexdigest()
+    entry = None if refresh else cache.get(key)
+    if entry is not None and \
+       time.time() - entry['stored_at'] < CATEGORY_CACHE_TTL:
+        return entry['categories']
+
+    categories = _request_category_info_from_discourse(domain)
+    cache.set(key, {'stored_at': time.time(), 'categories': categories})
+    return categories
+
+
+class CategoryMap(object):
+    '''The categories of a forum, with all categories indexed by `id`, and
+    top-level categories by `slug`.'''
+
+    def __init__(self, categories):
+        self.categories = categories
+        self.by_slug = {c['slug']: c for c in categories}
+        self.by_id = {}
+        for c in categories:
+            self.by_id[c['id']] = c
+            for subcategory in c['subcategories']:
+                self.by_id[subcategory['id']] = subcategory
+
+
+@functools.lru_cache(maxsize=64)
+def get_category_map(domain):
+    '''Return the `CategoryMap` for `domain`.'''
+    return CategoryMap(get_category_info_from_discourse(domain))
+
+
+def get_category(domain, slug=None, category_id=None):
+    '''Return the top-level category of `domain` with `slug`, or the
+    category with `category_id`.
+
+    Cached categories may be outdated, so if the category is missing, they
+    are requested again, once per domain. A ValueError is raised if it is
+    still missing.
+    '''
+    def find(category_map):
+        if slug is not None:
+            return category_map.by_slug.get(slug)
+        return category_map.by_id.get(category_id)
+
+    category = find(get_category_map(domain))
+    if category is None and domain not in _refreshed_domains:
+        log.info('Category "{}" not found in cached categories of {}, '
+                 'requesting them again'.format(slug or category_id, domain))
+        _refreshed_domains.add(domain)
+        get_category_info_from_discourse(domain, refresh=True)
+        get_category_map.cache_clear()
+        category = find(get_category_map(domain))
+    if category is None:
+        raise ValueError('Category "{}" was not found on {}. Check your '
+                         'configuration'.format(slug or category_id, domain))
+    return category
+
+
+class AsyncDiscourseClient(object):
+    '''Make requests to a Discourse forum from asyncio coroutines.
+
+    Requests are made with the shared HTTP client from a thread pool, so they
+    still use its connection pool and response cache. At most
+    `max_concurrency` requests are in flight at once.
+    '''
+
+    def __init__(self, domain, loop, max_concurrency=MAX_CONCURRENCY):
+        self.domain = domain
+        self.loop = loop
+        self.max_concurrency = max_concurrency
+        # Created in the running loop, on first use, as asyncio primitives
+        # no longer take a `loop`
+        self._semaphore = None
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    async def _run(self, func, *args, **kwargs):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            return await self.loop.run_in_executor(
+                self._executor, functools.partial(func, *args, **kwargs))
+
+    async def request(self, endpoint, cache_ttl=None, **kwargs):
+        '''As `request_data_from_discourse`.'''
+        return await self._run(request_data_from_discourse, self.domain,
+                               endpoint, cache_ttl, **kwargs)
+
+    async def report(self, report, start_date, category_id='all',
+                     end_date=None):
+        '''As `request_report_from_discourse`.'''
+        return await self._run(request_report_from_discourse, self.domain,
+                               report, start_date, category_id=category_id,
+                               end_date=end_date)
+
+    async def gather(self, *coros):
+        '''Run `coros` concurrently and return their results. If any fail,
+        raise the exception of the first failed one, in the order given.'''
+        results = await asyncio.gather(*coros, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    async def count_users(self, flag, keep_counting):
+        '''Count users listed by `/admin/users/list/<flag>.json` until an
+        empty page, or a user for which `keep_counting(user)` is false. The
+        list must be ordered so that all counted users come first.
+
+        Rather than requesting every page, the last page with counted users
+        is found with an exponential search, then a binary search, so only a
+        logarithmic number of pages is requested. Every page before it is
+        full, so only its own users need counting. Exponential search pages
+        are requested `max_concurrency` at a time.
+        '''
+        endpoint = "/admin/users/list/{}.json".format(flag)
+        pages = {}
+
+        async def get_pages(page_numbers):
+            missing = [p for p in page_numbers if p not in pages]
+            results = await self.gather(*[self.request(endpoint, page=p)
+                                          for p in missing])
+            pages.update(zip(missing, results))
+
+        # /admin/users/list paging starts at one
+        await get_pages([1])
+        page_size = len(pages[1])
+
+        def is_full(page):
+            '''Whether all users of `page` are counted, and more may
+            follow.'''
+            users = pages[page]
+            return page_size > 0 and len(users) == page_size and \
+                keep_counting(users[-1])
+
+        # `full` is the last page known to be full, `last` the first page
+        # known not to be
+        full, last = 0, 1
+        while is_full(last):
+            full = last
+            probes = [last * 2 ** i
+                      for i in range(1, self.max_concurrency + 1)]
+            await get_pages(probes)
+            for last in probes:
+                if not is_full(last):
+                    break
+                full = last
+        while last - full > 1:
+            middle = (full + last) // 2
+            await get_pages([middle])
+            if is_full(middle):
+                full = middle
+            else:
+                last = middle
+
+        count = full * page_size
+        for user in pages[last]:
+            if not keep_counting(user):
+                break
+            count += 1
+        log.debug('Counted {} {} users of {} in {} requests'.format(
+            count, flag, self.domain, len(pages)))
+        return count
+
+
+def run_with_client(domain, main, max_concurrency=MAX_CONCURRENCY):
+    '''Run the coroutine function `main` with an `AsyncDiscourseClient` for
+    `domain` as its argument, on a new event loop, and return its result.'''
+    loop = asyncio.new_event_loop()
+    client = AsyncDiscourseClient(domain, loop, max_concurrency)
+    try:
+        return loop.run_until_complete(main(client))
+    finally:
+        client.close()
+        loop.close()
@@ -0,0 +1,188 @@
+'''Write resources to SQL tables in batches, as a faster `dump.to_sql`.
+
+Takes the same `engine` and `tables` parameters as `dump.to_sql`. Rather than
+checking for and writing each row in turn, rows are staged in a temporary
+table, with `COPY` on Postgres and `executemany` elsewhere, and then merged
+into the target table with a single `INSERT ... ON CONFLICT` statement per
+batch of `batch-size` rows.
+
+The `update` mode requires a unique index on the `update_keys`, which is
+created if missing. Object and array values are written as JSON.
+'''
+
+import io
+import json
+
+from sqlalchemy import create_engine, text, Index, MetaData, Table
+from jsontableschema_sql import Storage
+
+from datapackage_pipelines.lib.dump.dumper_base import DumperBase
+
+import logging
+log = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+def _serialize_value(value):
+    '''Return `value` as the DB driver can take it, with objects and arrays
+    as JSON.'''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return value
+
+
+def _csv_value(value):
+    '''Return `value` as a field of a CSV for Postgres' `COPY`. All values
+    but None are quoted, as only unquoted empty fields are read as NULL.'''
+    if value is None:
+        return ''
+    return '"{}"'.format(str(_serialize_value(value)).replace('"', '""'))
+
+
+class BulkSQLDumper(DumperBase):
+
+    def initialize(self, parameters):
+        super(BulkSQLDumper, self).initialize(parameters)
+        self.engine = create_engine(parameters['engine'])
+        self.batch_size = int(parameters.get('batch-size',
+                                             DEFAULT_BATCH_SIZE))
+
+        for k, v in parameters['tables'].items():
+            v['table-name'] = k
+        self.converted_resources = \
+            dict((v['resource-name'], v)
+                 for v in parameters['tables'].values())
+
+    def _quote(self, name):
+        return self.engine.dialect.identifier_preparer.quote(name)
+
+    def _prepare_table(self, table_name, schema, mode, update_keys):
+        '''Create (or recreate) the table as `dump.to_sql` would, and the
+        unique index upserts need. Return the reflected table.'''
+        storage = Storage(self.engine, prefix=table_name)
+        if mode == 'rewrite' and '' in storage.buckets:
+            storage.delete('')
+        if '' not in storage.buckets:
+            log.info('Creating DB table %s', table_name)
+            storage.create('', schema)
+
+        table = Table(table_name, MetaData(), autoload_with=self.engine)
+        if update_keys and not any(
+                index.unique and
+                sorted(index.columns.keys()) == sorted(update_keys)
+                for index in table.indexes):
+            index = Index('ux_{}_update_keys'.format(table_name),
+                          *[table.c[k] for k in update_keys], unique=True)
+            log.info('Creating unique index %s on %s(%s)', index.name,
+                     table_name, ', '.join(update_keys))
+            index.create(self.engine)
+        return table
+
+    def _stage_rows(self, connection, staging_name, columns, rows):
+        quoted_columns = ', '.join(self._quote(c) for c in columns)
+        if self.engine.dialect.name == 'postgresql':
+            buf = io.StringIO()
+            for row in rows:
+                buf.write(','.join(_csv_value(row.get(c)) for c in columns))
+                buf.write('\n')
+            buf.seek(0)
+            cursor = connection.connection.cursor()
+            cursor.copy_expert(
+                'COPY {} ({}) FROM STDIN WITH CSV'.format(
+                    self._quote(staging_name), quoted_columns), buf)
+        else:
+            connection.execute(
+                text('INSERT INTO {} ({}) VALUES ({})'.format(
+                    self._quote(staging_name), quoted_columns,
+                    ', '.join(':c{}'.format(i)
+                              for i in range(len(columns))))),
+                [{'c{}'.format(i): _serialize_value(row.get(c))
+                  for i, c in enumerate(columns)}
+                 for row in rows])
+
+    def _write_batch(self, table, columns, rows, update_keys):
+        '''Stage `rows` and merge them into `table` in a single
+        transaction.'''
+        if update_keys:
+            # Only the last row for each key can be merged in one statement
+            rows = list({tuple(row.get(k) for k in update_keys): row
+                         for row in rows}.values())
+
+        staging_name = 'staging_{}'.format(table.name)
+        quoted_columns = ', '.join(self._quote(c) for c in columns)
+        with self.engine.begin() as connection:
+            connection.execute(text(
+                'CREATE TEMPORARY TABLE {} AS SELECT {} FROM {} WHERE 1 = 0'
+                .format(self._quote(staging_name), quoted_columns,
+                        self._quote(table.name))))
+            try:
+                self._stage_rows(connection, staging_name, columns, rows)
+
+                merge = 'INSERT INTO {0} ({1}) SELECT {1} FROM {2} ' \
+                    'WHERE 1 = 1'.format(self._quote(table.name),
+                                         quoted_columns,
+                                         self._quote(staging_name))
+                if update_keys:
+                    update_columns = [c for c in columns
+                                      if c not in update_keys]
+                    merge += ' ON CONFLICT ({}) DO '.format(
+                        ', '.join(self._quote(k) for k in update_keys))
+                    if update_columns:
+                        merge += 'UPDATE SET {}'.format(', '.join(
+                            '{0} = excluded.{0}'.format(self._quote(c))
+                            for c in update_columns))
+                    else:
+                        merge += 'NOTHING'
+                connection.execute(text(merge))
+            finally:
+                connection.execute(text(
+                    'DROP TABLE {}'.format(self._quote(staging_name))))
+        return len(rows)
+
+    def _write_rows(self, resource, table, columns, update_keys):
+        rows_written = 0
+        batches = 0
+        batch = []
+        for row in resource:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                rows_written += self._write_batch(table, columns, batch,
+                                                  update_keys)
+                batches += 1
+                batch = []
+            yield row
+        if batch:
+            rows_written += self._write_batch(table, columns, batch,
+                                              update_keys)
+            batches += 1
+
+        self.stats['{}: rows written'.format(table.name)] = rows_written
+        self.stats['{}: batches'.format(table.name)] = batches
+        log.info('Wrote %d rows to %s in %d batches', rows_written,
+                 table.name, batches)
+
+    def handle_resource(self, resource, spec, parameters, datapackage):
+        resource_name = spec['name']
+        if resource_name not in self.converted_resources:
+            return resource
+
+        converted_resource = self.converted_resources[resource_name]
+        mode = converted_resource.get('mode', 'rewrite')
+        table_name = converted_resource['table-name']
+        update_keys = None
+        if mode == 'update':
+            update_keys = converted_resource.get('update_keys')
+            if update_keys is None:
+                update_keys = spec['schema'].get('primaryKey', [])
+
+        table = self._prepare_table(table_name, spec['schema'], mode,
+                                    update_keys)
+        columns = [field['name'] for field in spec['schema']['fields']]
+        log.info('Writing to DB %s -> %s (mode=%s, keys=%s, batch size=%d)',
+                 resource_name, table_name, mode, update_keys,
+                 self.batch_size)
+        return self._write_rows(resource, table, columns, update_keys)
+
+
+BulkSQLDumper()()
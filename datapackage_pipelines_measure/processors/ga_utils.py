@@ -0,0 +1,186 @@
+import collections
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import dateutil
+
+from datapackage_pipelines_measure.config import settings
+from datapackage_pipelines_measure.processors import google_utils
+
+import logging
+log = logging.getLogger(__name__)
+
+GOOGLE_API_GA_TABLE_DATE_RANGE_FORMAT = '%Y-%m-%d'
+GOOGLE_API_GA_TABLE_DEFAULT_FROM_DATE = '2005-01-01'
+# Rows requested per page of a report (the api allows up to 100,000)
+GOOGLE_API_GA_PAGE_SIZE = 10000
+# Number of monthly shards requested concurrently. The api allows up to 10
+# concurrent requests per view.
+MAX_WORKERS = int(settings.get('GA_MAX_WORKERS', 4))
+
+# Services aren't thread-safe, so each worker thread builds its own
+_local = threading.local()
+
+
+def _get_service():
+    '''Return the GA reporting service for the current thread.'''
+    if getattr(_local, 'service', None) is None:
+        _local.service = google_utils.get_google_api_service(
+            google_utils.GOOGLE_API_GA_SERVICE_NAME,
+            google_utils.GOOGLE_API_GA_VERSION,
+            google_utils.GOOGLE_API_GA_SCOPES
+        )
+    return _local.service
+
+
+def _build_report_request(view_id, start_date, end_date, page_token=None):
+    report_request = {
+        "viewId": view_id,
+        "dateRanges": [
+            {
+                "startDate": start_date.strftime(
+                    GOOGLE_API_GA_TABLE_DATE_RANGE_FORMAT),
+                "endDate": end_date.strftime(
+                    GOOGLE_API_GA_TABLE_DATE_RANGE_FORMAT)
+            }
+        ],
+        "dimensions": [
+            {
+                "name": "ga:date"
+            },
+            {
+                "name": "ga:hostname"
+            },
+            {
+                "name": "ga:pagePath"
+            }
+        ],
+        "metrics": [
+            {
+                "expression": "ga:sessions"
+            },
+            {
+                "expression": "ga:users"
+            },
+            {
+                "expression": "ga:avgSessionDuration"
+            }
+        ],
+        "pageSize": str(GOOGLE_API_GA_PAGE_SIZE)
+    }
+    if page_token:
+        report_request['pageToken'] = page_token
+    return report_request
+
+
+def _request_shard_from_ga(view_id, start_date, end_date):
+    '''Request all pages of the report for `view_id` from `start_date` to
+    `end_date` (both inclusive), and return its rows.'''
+    rows = []
+    page_token = None
+    while True:
+        body = {
+            "reportRequests": [
+                _build_report_request(view_id, start_date, end_date,
+                                      page_token)
+            ]
+        }
+        response = _get_service().reports().batchGet(body=body).execute()
+        report = response['reports'][0]
+        rows.extend(report['data'].get('rows', []))
+        page_token = report.get('nextPageToken')
+        if not page_token:
+            return rows
+
+
+def _get_monthly_shards(start_date, end_date):
+    '''Return a list of (start_date, end_date) tuples, splitting the period
+    from `start_date` to `end_date` (both inclusive) by calendar month.'''
+    shards = []
+    shard_start = start_date
+    while shard_start <= end_date:
+        next_month = (shard_start.replace(day=1) +
+                      datetime.timedelta(days=32)).replace(day=1)
+        shard_end = min(next_month - datetime.timedelta(days=1), end_date)
+        shards.append((shard_start, shard_end))
+        shard_start = next_month
+    return shards
+
+
+def map_in_order(func, items, max_workers=MAX_WORKERS):
+    '''Yield `func(item)` for each of `items`, in order, computed over a pool
+    of `max_workers` threads. Only `max_workers` results are pending at a
+    time, so results are streamed rather than all held in memory.'''
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = collections.deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _get_start_date(latest_date=None):
+    '''Determine when data collection should start.
+
+    :latest_date: the most recent date data was collected for this domain, if
+        it exists
+    '''
+    default_start = \
+        dateutil.parser.parse(GOOGLE_API_GA_TABLE_DEFAULT_FROM_DATE).date()
+    if latest_date:
+        return max(latest_date, default_start)
+    else:
+        return default_start
+
+
+def _get_requested_period_date_range(latest_date=None):
+    '''Determine and return the required start_date and end_date'''
+    start_date = _get_start_date(latest_date)
+    end_date = datetime.date.today() - datetime.timedelta(days=1)
+    return start_date, end_date
+
+
+def _make_row(row):
+    metrics = row['metrics'][0]['values']
+    return {
+        'source': 'ga',
+        'domain': row['dimensions'][1],
+        'date': dateutil.parser.parse(row['dimensions'][0]).date(),
+        'page_path': row['dimensions'][2],
+        'visitors': int(metrics[0]),
+        'unique_visitors': int(metrics[1]),
+        'avg_time_spent': round(float(metrics[2]))
+    }
+
+
+def ga_collector(domains, latest_dates):
+    '''Yield rows for each of the `domains` (dicts with a `url` and
+    `viewid`) since their date in `latest_dates`, requesting the period in
+    monthly shards.
+
+    Reports can only be batched for the same view and date range, so domains
+    are grouped by view, and each view is requested once, from the earliest
+    start date of its domains. Shards of all views share one worker pool.
+    '''
+    start_dates = collections.OrderedDict()
+    end_date = datetime.date.today() - datetime.timedelta(days=1)
+    for domain in domains:
+        start_date, _ = \
+            _get_requested_period_date_range(latest_dates.get(domain['url']))
+        view_id = domain['viewid']
+        start_dates[view_id] = min(start_dates.get(view_id, start_date),
+                                   start_date)
+
+    view_shards = [(view_id, shard)
+                   for view_id, start_date in start_dates.items()
+                   for shard in _get_monthly_shards(start_date, end_date)]
+
+    for shard_rows in map_in_order(
+            lambda view_shard: _request_shard_from_ga(view_shard[0],
+                                                      *view_shard[1]),
+            view_shards):
+        for row in shard_rows:
+            yield _make_row(row)
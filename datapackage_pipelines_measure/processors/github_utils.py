@@ -0,0 +1,243 @@
+import datetime
+import threading
+import time
+
+import simplejson
+
+from datapackage_pipelines_measure.config import settings
+from datapackage_pipelines_measure.processors import http_utils
+
+import logging
+log = logging.getLogger(__name__)
+
+# 30 authenticated search requests per minute, so pace search requests at one
+# every 3 secs (or GITHUB_REQUEST_WAIT_INTERVAL env var) until Github tells us
+# what is actually remaining
+# (https://developer.github.com/v3/search/#rate-limit)
+REQUEST_WAIT_INTERVAL = int(settings.get('GITHUB_REQUEST_WAIT_INTERVAL', 3))
+MAX_WORKERS = int(settings.get('GITHUB_MAX_WORKERS', 4))
+# 'rest' or 'graphql'
+API_BACKEND = settings.get('GITHUB_API_BACKEND', 'rest')
+GRAPHQL_REPOSITORIES_PER_QUERY = 50
+GRAPHQL_REPOSITORY_FRAGMENT = '''
+fragment repositoryStats on Repository {
+  name
+  watchers { totalCount }
+  stargazers { totalCount }
+  forkCount
+  openPrs: pullRequests(states: OPEN) { totalCount }
+  closedPrs: pullRequests(states: [CLOSED, MERGED]) { totalCount }
+  openIssues: issues(states: OPEN) { totalCount }
+  closedIssues: issues(states: CLOSED) { totalCount }
+}
+'''
+
+
+class RateLimiter(object):
+    '''A thread-safe token bucket for pacing requests to one Github rate limit
+    resource (e.g. `core` or `search`).
+
+    Until a response has been seen, tokens refill at one per
+    `wait_interval` seconds (never, if `wait_interval` is 0, which disables
+    pacing). Once Github reports `X-RateLimit-Remaining` and
+    `X-RateLimit-Reset`, the bucket holds what is remaining (less requests
+    still in flight), and is refilled to `X-RateLimit-Limit` at the reset
+    time.
+    '''
+
+    def __init__(self, wait_interval):
+        self.wait_interval = wait_interval
+        self.tokens = 1
+        self.limit = None
+        self.reset_at = None
+        self.in_flight = 0
+        self.updated_at = time.time()
+        self.lock = threading.Lock()
+
+    def _wait_time(self, now):
+        '''Return seconds to wait before a token is available, refilling the
+        bucket as appropriate. Must be called with the lock held.'''
+        if self.reset_at is not None and now >= self.reset_at:
+            self.tokens = max(self.limit - self.in_flight, 0)
+            self.reset_at = None
+        elif self.reset_at is None and self.wait_interval:
+            self.tokens = min(
+                self.tokens + max(now - self.updated_at, 0) /
+                self.wait_interval, 1)
+        self.updated_at = now
+
+        if self.tokens >= 1 or \
+           (self.reset_at is None and not self.wait_interval):
+            return 0
+        if self.reset_at is not None:
+            return self.reset_at - now
+        return (1 - self.tokens) * self.wait_interval
+
+    def acquire(self):
+        '''Block until a request may be made.'''
+        while True:
+            with self.lock:
+                wait = self._wait_time(time.time())
+                if wait <= 0:
+                    self.tokens = self.tokens - 1
+                    self.in_flight = self.in_flight + 1
+                    return
+            log.debug('Github rate limit reached, waiting {:.1f} secs'
+                      .format(wait))
+            time.sleep(wait)
+
+    def release(self, headers=None):
+        '''Mark a request as complete, updating the bucket from its
+        X-RateLimit-* `headers`, if present.'''
+        with self.lock:
+            self.in_flight = max(self.in_flight - 1, 0)
+            if headers is None or 'X-RateLimit-Remaining' not in headers \
+               or 'X-RateLimit-Reset' not in headers:
+                return
+            remaining = int(headers['X-RateLimit-Remaining'])
+            self.tokens = remaining - self.in_flight
+            self.reset_at = float(headers['X-RateLimit-Reset'])
+            self.limit = int(headers.get('X-RateLimit-Limit', remaining))
+
+
+core_rate_limiter = RateLimiter(0)
+search_rate_limiter = RateLimiter(REQUEST_WAIT_INTERVAL)
+graphql_rate_limiter = RateLimiter(0)
+
+
+def _request_github(url, rate_limiter, json=None):
+    '''Make a request to the Github api, paced by `rate_limiter`.'''
+    rate_limiter.acquire()
+    response = None
+    try:
+        headers = {
+            'Authorization': 'token {}'.format(settings['GITHUB_API_TOKEN'])
+        }
+        if json is None:
+            response = http_utils.get(url, headers=headers,
+                                      cache_source='github')
+        else:
+            response = http_utils.post(url, headers=headers, json=json)
+    finally:
+        # A response cached by another thread meanwhile has stale rate limit
+        # headers
+        rate_limiter.release(response.headers if response is not None and
+                             not response.from_cache else None)
+    return response
+
+
+def make_github_request(url, rate_limiter=core_rate_limiter, json=None):
+    '''Make a request to the Github api, and return its JSON response. If
+    `json` is given, it is POSTed as the request body.
+
+    Fresh cached responses are returned without waiting for `rate_limiter`.
+    '''
+    response = None
+    if json is None:
+        response = http_utils.get_cached(url, 'github')
+    if response is None:
+        response = _request_github(url, rate_limiter, json)
+    try:
+        json_response = response.json()
+    except simplejson.scanner.JSONDecodeError:
+        log.error('Expected JSON in response from: {}'.format(url))
+        raise
+
+    if response.status_code != 200:
+        log.error('Response from Github not successful')
+        raise RuntimeError(json_response)
+
+    return json_response
+
+
+def _get_issue_count_for_request(url):
+    issue_json = make_github_request(url, rate_limiter=search_rate_limiter)
+    return issue_json['total_count']
+
+
+def get_repository_stats(repo):
+    '''Return a `code-hosting` row of stats for the `repo` full name.'''
+    base_url = settings['GITHUB_API_BASE_URL'].rstrip('/')
+
+    # BASE REPO INFO
+    base_repo_url = '{}/repos/{}'.format(base_url, repo)
+    # resource schema to api property names
+    map_fields = {
+        'repository': 'name',
+        'watchers': 'subscribers_count',
+        'stars': 'stargazers_count',
+        'forks': 'forks_count'
+    }
+
+    repo_content = make_github_request(base_repo_url)
+    # Search queries require the current full name, rather than old names
+    # that redirect
+    current_repo_name = repo_content['full_name']
+
+    row = {t_key: repo_content[s_key] for t_key, s_key in map_fields.items()}
+    row['source'] = 'github'
+    row['date'] = datetime.date.today()
+
+    # ISSUES & PR COUNTS
+    base_issue_url = '{}/search/issues?q=repo:{}'.format(
+        base_url, current_repo_name)
+
+    row['open_prs'] = _get_issue_count_for_request(
+        '{}%20state:open%20is:pr'.format(base_issue_url))
+    row['closed_prs'] = _get_issue_count_for_request(
+        '{}%20state:closed%20is:pr'.format(base_issue_url))
+    row['open_issues'] = _get_issue_count_for_request(
+        '{}%20state:open%20is:issue'.format(base_issue_url))
+    row['closed_issues'] = _get_issue_count_for_request(
+        '{}%20state:closed%20is:issue'.format(base_issue_url))
+
+    return row
+
+
+def get_repositories_stats_from_graphql(repositories):
+    '''Return a list of `code-hosting` rows for each of the `repositories`
+    full names, fetched with a single aliased GraphQL query.
+
+    Rows have the same shape as those from `get_repository_stats`.
+    '''
+    base_url = settings['GITHUB_API_BASE_URL'].rstrip('/')
+
+    variables = {}
+    selections = []
+    for i, repo in enumerate(repositories):
+        owner, name = repo.split('/', 1)
+        variables['owner{}'.format(i)] = owner
+        variables['name{}'.format(i)] = name
+        selections.append(
+            'repo{0}: repository(owner: $owner{0}, name: $name{0}) '
+            '{{ ...repositoryStats }}'.format(i))
+    query = 'query({}) {{\n{}\n}}\n{}'.format(
+        ', '.join('${}: String!'.format(v) for v in sorted(variables)),
+        '\n'.join(selections),
+        GRAPHQL_REPOSITORY_FRAGMENT)
+
+    json_response = make_github_request(
+        '{}/graphql'.format(base_url),
+        rate_limiter=graphql_rate_limiter,
+        json={'query': query, 'variables': variables})
+    if json_response.get('errors'):
+        log.error('GraphQL query to Github not successful')
+        raise RuntimeError(json_response['errors'])
+
+    resource_content = []
+    for i, repo in enumerate(repositories):
+        repo_content = json_response['data']['repo{}'.format(i)]
+        resource_content.append({
+            'repository': repo_content['name'],
+            'watchers': repo_content['watchers']['totalCount'],
+            'stars': repo_content['stargazers']['totalCount'],
+            'forks': repo_content['forkCount'],
+            'source': 'github',
+            'date': datetime.date.today(),
+            'open_prs': repo_content['openPrs']['totalCount'],
+            'closed_prs': repo_content['closedPrs']['totalCount'],
+            'open_issues': repo_content['openIssues']['totalCount'],
+            'closed_issues': repo_content['closedIssues']['totalCount']
+        })
+
+    return resource_content
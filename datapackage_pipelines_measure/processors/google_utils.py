@@ -1,15 +1,20 @@
+import os
+import threading
+import time
+
 import httplib2
 
 # google api client
 from apiclient import discovery
+from apiclient.discovery import DISCOVERY_URI, V2_DISCOVERY_URI
 from oauth2client.service_account import ServiceAccountCredentials
 
 from datapackage_pipelines_measure.config import settings
+from datapackage_pipelines_measure.processors import http_cache, http_utils
 
 GOOGLE_API_BIGQUERY_SERVICE_NAME = 'bigquery'
 GOOGLE_API_BIGQUERY_VERSION = 'v2'
 GOOGLE_API_BIGQUERY_SCOPES = 'https://www.googleapis.com/auth/bigquery'
-GOOGLE_API_BIGQUERY_DEFAULT_TIMEOUT_MILLISECONDS = 60000
 
 GOOGLE_API_GA_SERVICE_NAME = 'analyticsreporting'
 GOOGLE_API_GA_VERSION = 'v4'
@@ -21,6 +26,46 @@ GOOGLE_API_DRIVE_SCOPES = 'https://www.googleapis.com/auth/drive.readonly'
 
 JWT_NAMESPACE = 'GOOGLE_API_JWT_'
 
+# Seconds a discovery document is cached on disk, across pipeline runs, before
+# it is requested again (0 disables the cache)
+DISCOVERY_DOCUMENT_TTL = float(settings.get('GOOGLE_DISCOVERY_CACHE_TTL',
+                                            24 * 60 * 60))
+DISCOVERY_CACHE_PATH = settings.get(
+    'GOOGLE_DISCOVERY_CACHE_PATH',
+    os.path.join(os.path.dirname(__file__), '../../.cache/google'))
+
+# Discovery documents by (service_name, service_version), and credentials by
+# scopes, reused by every service built in this process
+_discovery_documents = {}
+_credentials = {}
+_cache_lock = threading.Lock()
+_discovery_cache = None
+
+
+def _build_jwt_dict():
+    jwt_dict = {key.replace(JWT_NAMESPACE, '').lower(): settings[key]
+                for key in settings
+                if key.startswith(JWT_NAMESPACE)}
+    # Handle newlines in private key
+    if 'private_key' in jwt_dict:
+        jwt_dict['private_key'] = \
+            jwt_dict['private_key'].replace('\\n', '\n')
+    jwt_dict['PROJECT_ID'] = settings['GOOGLE_API_PROJECT_ID']
+    return jwt_dict
+
+
+def get_credentials(scopes):
+    '''Return the service account credentials for `scopes`. Credentials are
+    created once per process, so their access token is reused until it
+    expires.'''
+    with _cache_lock:
+        credentials = _credentials.get(scopes)
+        if credentials is None:
+            credentials = ServiceAccountCredentials.from_json_keyfile_dict(
+                _build_jwt_dict(), scopes=scopes)
+            _credentials[scopes] = credentials
+    return credentials
+
 
 def get_authorized_http_object(scopes):
     '''JWT credentials authorization.
@@ -28,21 +73,62 @@ def get_authorized_http_object(scopes):
     :param scopes: the authorization scope to be requested
     :return: httplib2.Http object, with authorized credentials
     '''
+    # Http objects aren't thread-safe, so each caller gets a new one, sharing
+    # the cached credentials.
+    return get_credentials(scopes).authorize(httplib2.Http())
+
 
-    def _build_jwt_dict():
-        jwt_dict = {key.replace(JWT_NAMESPACE, '').lower(): settings[key]
-                    for key in settings
-                    if key.startswith(JWT_NAMESPACE)}
-        # Handle newlines in private key
-        if 'private_key' in jwt_dict:
-            jwt_dict['private_key'] = \
-                jwt_dict['private_key'].replace('\\n', '\n')
-        jwt_dict['PROJECT_ID'] = settings['GOOGLE_API_PROJECT_ID']
-        return jwt_dict
+def _get_discovery_cache():
+    global _discovery_cache
+    with _cache_lock:
+        if _discovery_cache is None:
+            _discovery_cache = http_cache.SQLiteCache(DISCOVERY_CACHE_PATH)
+    return _discovery_cache
 
-    credentials = ServiceAccountCredentials.from_json_keyfile_dict(
-        _build_jwt_dict(), scopes=scopes)
-    return credentials.authorize(httplib2.Http())
+
+def get_discovery_document(service_name, service_version):
+    '''Return the discovery document for a Google API service, from the
+    in-process cache if possible.
+
+    Each processor runs in its own process, so documents are also cached on
+    disk, across processes and pipeline runs, for `DISCOVERY_DOCUMENT_TTL`
+    seconds.
+    '''
+    key = (service_name, service_version)
+    with _cache_lock:
+        document = _discovery_documents.get(key)
+    if document is not None:
+        return document
+
+    if DISCOVERY_DOCUMENT_TTL:
+        cache_key = '{}-{}'.format(service_name, service_version)
+        entry = _get_discovery_cache().get(cache_key)
+        if entry is not None and \
+           time.time() - entry['stored_at'] < DISCOVERY_DOCUMENT_TTL:
+            document = entry['document']
+    if document is None:
+        document = _request_discovery_document(service_name,
+                                               service_version)
+        if DISCOVERY_DOCUMENT_TTL:
+            _get_discovery_cache().set(cache_key, {
+                'stored_at': time.time(), 'document': document})
+
+    with _cache_lock:
+        _discovery_documents[key] = document
+    return document
+
+
+def _request_discovery_document(service_name, service_version):
+    for discovery_url in (DISCOVERY_URI, V2_DISCOVERY_URI):
+        response = http_utils.get(
+            discovery_url.format(api=service_name,
+                                 apiVersion=service_version))
+        if response.status_code == 404:
+            continue
+        response.raise_for_status()
+        return response.text
+    raise ValueError('No discovery document for Google API {} {}'
+                     .format(service_name, service_version))
 
 
 def get_google_api_service(service_name, service_version, scopes):
@@ -57,9 +143,8 @@ def get_google_api_service(service_name, service_version, scopes):
     '''
 
     try:
-        return discovery.build(
-            service_name,
-            service_version,
+        return discovery.build_from_document(
+            get_discovery_document(service_name, service_version),
             http=get_authorized_http_object(scopes)
         )
     except AttributeError:  # config variables are missing
@@ -0,0 +1,75 @@
+'''Backends for the on-disk HTTP response cache used by `http_utils`.
+
+Each backend stores cache entries (dicts of response data) by key, and
+implements `get(key)` and `set(key, entry)`.
+'''
+
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class SQLiteCache(object):
+    '''Store cache entries in a single SQLite database file, `cache.db`,
+    within `path`.'''
+
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.db_path = os.path.join(path, 'cache.db')
+        self.lock = threading.Lock()
+        self._execute('CREATE TABLE IF NOT EXISTS responses '
+                      '(key TEXT PRIMARY KEY, entry BLOB)')
+
+    def _execute(self, sql, params=()):
+        '''Execute `sql` in its own transaction, returning the first result
+        row, if any.'''
+        with self.lock:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                with conn:
+                    return conn.execute(sql, params).fetchone()
+            finally:
+                conn.close()
+
+    def get(self, key):
+        result = self._execute('SELECT entry FROM responses WHERE key = ?',
+                               (key,))
+        return pickle.loads(result[0]) if result else None
+
+    def set(self, key, entry):
+        self._execute('INSERT OR REPLACE INTO responses VALUES (?, ?)',
+                      (key, pickle.dumps(entry)))
+
+
+class DirectoryCache(object):
+    '''Store each cache entry as a file, named by its key, within `path`.'''
+
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+
+    def get(self, key):
+        try:
+            with open(os.path.join(self.path, key), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, entry):
+        # Write to a temporary file first, so concurrent readers never see a
+        # partially written entry.
+        fd, tmp_path = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(entry, f)
+        os.replace(tmp_path, os.path.join(self.path, key))
+
+
+BACKENDS = {
+    'sqlite': SQLiteCache,
+    'directory': DirectoryCache
+}
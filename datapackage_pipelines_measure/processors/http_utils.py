@@ -0,0 +1,299 @@
+'''Shared HTTP client for the REST collectors.
+
+Requests are made through one `requests.Session` per host, so connections
+(and their DNS lookups and TLS handshakes) are kept alive and reused across
+calls, and across the threads of a collector's worker pool.
+
+GET requests made with a `cache_source` can be served from an on-disk
+response cache, when one is configured with `MEASURE_HTTP_CACHE`. Responses
+served without a request have a true `from_cache` attribute.
+
+Requests made with a `retry_policy` are retried when rate limited. A rate
+limited host is paused for all requests to it, and the time spent waiting
+is counted in `stats`, which processors can pass to `spew`.
+'''
+
+import datetime
+import email.utils
+import hashlib
+import os
+import random
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from datapackage_pipelines_measure.config import settings
+from datapackage_pipelines_measure.processors import http_cache
+
+import logging
+log = logging.getLogger(__name__)
+
+# Maximum number of connections kept open to each host
+HTTP_POOL_SIZE = int(settings.get('HTTP_POOL_SIZE', 10))
+# Seconds to wait for a server to respond
+HTTP_TIMEOUT = float(settings.get('HTTP_TIMEOUT', 60))
+
+# Response cache backend, one of `http_cache.BACKENDS`. Development runs are
+# cached by default.
+HTTP_CACHE = settings.get('HTTP_CACHE',
+                          'sqlite' if settings.get('DEVELOPMENT', False)
+                          else None)
+HTTP_CACHE_PATH = settings.get(
+    'HTTP_CACHE_PATH',
+    os.path.join(os.path.dirname(__file__), '../../.cache/http'))
+# Seconds a cached response is used without revalidating it with the server.
+# Can be set per source, with e.g. `MEASURE_HTTP_CACHE_TTL_NPM`. Development
+# reruns are served from the cache for an hour, without any requests.
+HTTP_CACHE_DEFAULT_TTL = float(settings.get(
+    'HTTP_CACHE_TTL',
+    60 * 60 if settings.get('DEVELOPMENT', False) else 0))
+# `cache_ttl` for responses that will never change, e.g. stats for past days.
+CACHE_FOREVER = float('inf')
+# Retrying rate limited requests
+HTTP_RETRY_MAX_ATTEMPTS = int(settings.get('HTTP_RETRY_MAX_ATTEMPTS', 5))
+HTTP_RETRY_BASE_DELAY = float(settings.get('HTTP_RETRY_BASE_DELAY', 1))
+HTTP_RETRY_MAX_DELAY = float(settings.get('HTTP_RETRY_MAX_DELAY', 300))
+
+# Headers of a response describing its body, which a 304 response's headers
+# don't replace in the cached response
+BODY_HEADERS = ('content-length', 'content-encoding', 'transfer-encoding')
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_cache = None
+_cache_lock = threading.Lock()
+# Time until which requests to a rate limited host wait, by host
+_paused_until = {}
+_paused_lock = threading.Lock()
+# Rate limiting stats, by host
+stats = {}
+_stats_lock = threading.Lock()
+
+
+class RetryPolicy(object):
+    '''How requests rate limited with a 429 response are retried.
+
+    A request is made at most `max_attempts` times. Before each retry, the
+    host is paused for the time its `Retry-After` header asks for or, without
+    one, an exponential backoff from `base_delay` with random jitter. Waits
+    are never longer than `max_delay`.
+    '''
+
+    def __init__(self, max_attempts=HTTP_RETRY_MAX_ATTEMPTS,
+                 base_delay=HTTP_RETRY_BASE_DELAY,
+                 max_delay=HTTP_RETRY_MAX_DELAY):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def _retry_after(self, response):
+        '''Return the seconds `response`'s `Retry-After` header asks to wait
+        for, or None if it has none.'''
+        value = response.headers.get('Retry-After')
+        if value is None:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return max((retry_at - now).total_seconds(), 0)
+
+    def get_delay(self, attempt, response):
+        '''Return the seconds to wait before retrying after `attempt` (from
+        one) was rate limited with `response`.'''
+        delay = self._retry_after(response)
+        if delay is None:
+            backoff = self.base_delay * 2 ** (attempt - 1)
+            delay = backoff / 2 + random.uniform(0, backoff / 2)
+        return min(delay, self.max_delay)
+
+
+RETRY_POLICY = RetryPolicy()
+
+
+def _add_stat(host, name, value):
+    key = '{}: {}'.format(host, name)
+    with _stats_lock:
+        stats[key] = stats.get(key, 0) + value
+
+
+def _pause_host(host, delay):
+    '''Make all requests to `host` wait for at least `delay` seconds.'''
+    with _paused_lock:
+        _paused_until[host] = max(_paused_until.get(host, 0),
+                                  time.time() + delay)
+
+
+def _wait_for_host(host):
+    '''Wait until `host` is no longer paused.'''
+    with _paused_lock:
+        wait = _paused_until.get(host, 0) - time.time()
+    if wait > 0:
+        log.info('Waiting {:.1f} secs for rate limited host {}'
+                 .format(wait, host))
+        _add_stat(host, 'rate limit waits', 1)
+        _add_stat(host, 'rate limit wait seconds', wait)
+        time.sleep(wait)
+
+
+def get_session(url):
+    '''Return the shared session for the host of `url`, creating it if
+    necessary.'''
+    host = urllib.parse.urlsplit(url).netloc
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=HTTP_POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers['Accept-Encoding'] = 'gzip, deflate'
+            _sessions[host] = session
+    return session
+
+
+def request(method, url, retry_policy=None, **kwargs):
+    '''Make a request with the shared session for `url`'s host. Takes the
+    same arguments as `requests.request`, with a default `timeout`.
+
+    If the host is rate limited, the request waits until it is resumed. If
+    `retry_policy` is given, a rate limited request pauses the host and is
+    retried as the `RetryPolicy` allows, after which the last 429 response is
+    returned.
+    '''
+    kwargs.setdefault('timeout', HTTP_TIMEOUT)
+    host = urllib.parse.urlsplit(url).netloc
+    attempt = 1
+    while True:
+        _wait_for_host(host)
+        response = get_session(url).request(method, url, **kwargs)
+        response.from_cache = False
+        if retry_policy is None or response.status_code != 429 or \
+           attempt >= retry_policy.max_attempts:
+            return response
+        delay = retry_policy.get_delay(attempt, response)
+        log.warning('Rate limited by {}, retrying in {:.1f} secs (attempt {} '
+                    'of {})'.format(host, delay, attempt,
+                                    retry_policy.max_attempts))
+        _add_stat(host, 'rate limited requests', 1)
+        _pause_host(host, delay)
+        attempt = attempt + 1
+
+
+def get_cache():
+    '''Return the configured response cache, or None if caching is
+    disabled.'''
+    global _cache
+    with _cache_lock:
+        if _cache is None and HTTP_CACHE:
+            _cache = http_cache.BACKENDS[HTTP_CACHE](HTTP_CACHE_PATH)
+    return _cache
+
+
+def _get_cache_ttl(cache_source):
+    ttl_key = 'HTTP_CACHE_TTL_{}'.format(cache_source.upper())
+    return float(settings.get(ttl_key, HTTP_CACHE_DEFAULT_TTL))
+
+
+def _get_cache_entry(cache, url, params=None):
+    '''Return the full url of a GET request, and its cache key and entry (or
+    None).'''
+    full_url = requests.Request('GET', url, params=params).prepare().url
+    key = hashlib.sha256(full_url.encode('utf-8')).hexdigest()
+    return full_url, key, cache.get(key)
+
+
+def _response_from_cache_entry(entry, url, from_cache=True):
+    response = requests.Response()
+    response.url = url
+    response.status_code = entry['status_code']
+    response.headers = CaseInsensitiveDict(entry['headers'])
+    response.encoding = entry['encoding']
+    response._content = entry['content']
+    response.from_cache = from_cache
+    return response
+
+
+def get_cached(url, cache_source, cache_ttl=None, params=None):
+    '''Return the cached response of a GET request if it is fresh, as `get`
+    would return it without a request, or None.
+
+    Lets callers skip accounting only needed for requests, e.g. for rate
+    limits.
+    '''
+    cache = get_cache()
+    if cache is None:
+        return None
+    if cache_ttl is None:
+        cache_ttl = _get_cache_ttl(cache_source)
+    full_url, _, entry = _get_cache_entry(cache, url, params)
+    if entry is None or time.time() - entry['stored_at'] >= cache_ttl:
+        return None
+    return _response_from_cache_entry(entry, full_url)
+
+
+def get(url, cache_source=None, cache_ttl=None, **kwargs):
+    '''Make a GET request with the shared session for `url`'s host.
+
+    If a response cache is configured and `cache_source` (e.g. 'npm') is
+    given, successful responses are cached. A cached response younger than
+    `cache_ttl` seconds (by default, the source's configured ttl) is returned
+    without a request. Older responses are revalidated with a conditional
+    request, if the server provided an `ETag` or `Last-Modified` header.
+    '''
+    cache = get_cache()
+    if cache is None or cache_source is None:
+        return request('GET', url, **kwargs)
+
+    if cache_ttl is None:
+        cache_ttl = _get_cache_ttl(cache_source)
+    full_url, key, entry = _get_cache_entry(cache, url, kwargs.get('params'))
+    if entry is not None:
+        if time.time() - entry['stored_at'] < cache_ttl:
+            return _response_from_cache_entry(entry, full_url)
+        cached_headers = CaseInsensitiveDict(entry['headers'])
+        headers = dict(kwargs.pop('headers', None) or {})
+        if 'ETag' in cached_headers:
+            headers['If-None-Match'] = cached_headers['ETag']
+        if 'Last-Modified' in cached_headers:
+            headers['If-Modified-Since'] = cached_headers['Last-Modified']
+        kwargs['headers'] = headers
+
+    response = request('GET', url, **kwargs)
+
+    if entry is not None and response.status_code == 304:
+        log.debug('Revalidated cached response for {}'.format(url))
+        # The 304 carries current headers (e.g. rate limits), but none that
+        # describe the cached body
+        headers = CaseInsensitiveDict(entry['headers'])
+        headers.update((k, v) for k, v in response.headers.items()
+                       if k.lower() not in BODY_HEADERS)
+        entry['headers'] = dict(headers)
+        entry['stored_at'] = time.time()
+        cache.set(key, entry)
+        return _response_from_cache_entry(entry, full_url, from_cache=False)
+    if response.status_code == 200:
+        # The url isn't stored, as it can carry credentials (e.g. Discourse's
+        # `api_key`)
+        cache.set(key, {
+            'stored_at': time.time(),
+            'status_code': response.status_code,
+            'headers': dict(response.headers),
+            'encoding': response.encoding,
+            'content': response.content
+        })
+    return response
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
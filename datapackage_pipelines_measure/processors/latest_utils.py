@@ -0,0 +1,150 @@
+'''Lookup of the latest rows already collected for each entity.
+
+`datastore_get_latest` can either stream the latest rows as a resource, or,
+with its `index` parameter, write them to a keyed index file referenced from
+the datapackage descriptor. The index isn't streamed through the pipeline, so
+each collector looks up only the rows it needs, rather than reading and
+re-yielding every latest row.
+'''
+
+import itertools
+import json
+import os
+import pickle
+import sqlite3
+import tempfile
+import time
+
+from datapackage_pipelines_measure.config import settings
+
+import logging
+log = logging.getLogger(__name__)
+
+LATEST_RESOURCE_NAME = 'latest-project-entries'
+LATEST_INDEX_PROPERTY = 'latest-index'
+# Index files are written here. They are removed by `remove_resource`, and
+# any left by failed pipelines are removed by a later run once older than
+# `LATEST_INDEX_MAX_AGE` seconds.
+LATEST_INDEX_PATH = settings.get(
+    'LATEST_INDEX_PATH',
+    os.path.join(os.path.dirname(__file__), '../../.cache/latest'))
+LATEST_INDEX_MAX_AGE = float(settings.get('LATEST_INDEX_MAX_AGE',
+                                          24 * 60 * 60))
+
+
+def _make_key(values):
+    return json.dumps([str(v) for v in values])
+
+
+class LatestIndex(object):
+    '''A read-only index of rows, stored in an SQLite file at `path` and
+    keyed by the values of their `key_fields`.'''
+
+    def __init__(self, path, key_fields):
+        self.path = path
+        self.key_fields = key_fields
+
+    def get(self, **key):
+        '''Return the row with the given values for the index's key fields,
+        or None.'''
+        conn = sqlite3.connect(self.path)
+        try:
+            result = conn.execute(
+                'SELECT row FROM latest WHERE key = ?',
+                (_make_key(key[f] for f in self.key_fields),)).fetchone()
+        finally:
+            conn.close()
+        return pickle.loads(result[0]) if result else None
+
+
+def _remove_stale_indexes():
+    '''Remove index files left by pipelines that failed before removing
+    them.'''
+    stale_before = time.time() - LATEST_INDEX_MAX_AGE
+    for filename in os.listdir(LATEST_INDEX_PATH):
+        path = os.path.join(LATEST_INDEX_PATH, filename)
+        try:
+            if filename.startswith('measure-') and \
+               filename.endswith('.db') and \
+               os.path.getmtime(path) < stale_before:
+                log.info('Removing stale latest index {}'.format(path))
+                os.remove(path)
+        except FileNotFoundError:
+            # Removed by another pipeline in the meantime
+            pass
+
+
+def write_latest_index(datapackage, name, rows, key_fields):
+    '''Write `rows` to a new index file in `LATEST_INDEX_PATH`, keyed by
+    `key_fields`, and reference it from `datapackage` as `name`.'''
+    os.makedirs(LATEST_INDEX_PATH, exist_ok=True)
+    _remove_stale_indexes()
+    fd, path = tempfile.mkstemp(prefix='measure-{}-'.format(name),
+                                suffix='.db', dir=LATEST_INDEX_PATH)
+    os.close(fd)
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            conn.execute(
+                'CREATE TABLE latest (key TEXT PRIMARY KEY, row BLOB)')
+            conn.executemany(
+                'INSERT OR REPLACE INTO latest VALUES (?, ?)',
+                ((_make_key(row[f] for f in key_fields), pickle.dumps(row))
+                 for row in rows))
+    finally:
+        conn.close()
+
+    datapackage[LATEST_INDEX_PROPERTY] = {
+        'name': name,
+        'path': path,
+        'key': key_fields
+    }
+
+
+def remove_latest_index(datapackage, resources_matcher):
+    '''Delete the index referenced from `datapackage`, if its name is matched
+    by `resources_matcher`.'''
+    index_info = datapackage.get(LATEST_INDEX_PROPERTY)
+    if index_info is None or not resources_matcher.match(index_info['name']):
+        return
+    try:
+        os.remove(index_info['path'])
+    except FileNotFoundError:
+        log.warning('Latest index {} was already removed'
+                    .format(index_info['path']))
+    del datapackage[LATEST_INDEX_PROPERTY]
+
+
+def get_latest_lookup(datapackage, res_iter, key_fields):
+    '''Return a `lookup(**key)` function, which returns the latest row for
+    the given `key_fields` values (or None), and the `res_iter` to continue
+    processing with.
+
+    The lookup uses the index referenced from `datapackage` if there is one.
+    Otherwise the latest rows are read from the `latest-project-entries`
+    resource, if present, which is yielded again at the start of the returned
+    `res_iter`.
+    '''
+    index_info = datapackage.get(LATEST_INDEX_PROPERTY)
+    if index_info is not None:
+        index = LatestIndex(index_info['path'], index_info['key'])
+        return index.get, res_iter
+
+    if len(datapackage['resources']) and \
+       datapackage['resources'][0]['name'] == LATEST_RESOURCE_NAME:
+        rows = list(next(res_iter))
+        rows_by_key = {tuple(row[f] for f in key_fields): row for row in rows}
+
+        def lookup(**key):
+            return rows_by_key.get(tuple(key[f] for f in key_fields))
+        return lookup, itertools.chain([iter(rows)], res_iter)
+
+    return (lambda **key: None), res_iter
+
+
+def get_latest_row(datapackage, res_iter, **key):
+    '''Return the latest row for `key` (e.g. `source='npm', package='foo'`),
+    or None, and the `res_iter` to continue processing with. See
+    `get_latest_lookup`.'''
+    lookup, res_iter = get_latest_lookup(datapackage, res_iter, sorted(key))
+    return lookup(**key), res_iter
@@ -0,0 +1,236 @@
+import datetime
+import dateutil
+
+from datapackage_pipelines_measure.processors import http_utils
+
+import logging
+log = logging.getLogger(__name__)
+
+NPM_REGISTRY_BASE_URL = "https://registry.npmjs.org/"
+NPM_STATS_BASE_URL = "https://api.npmjs.org/downloads/range/"
+NPM_STATS_DATE_RANGE_FORMAT = "%Y-%m-%d"
+# Range queries are limited to 18 months of data
+# (https://github.com/npm/registry/blob/master/docs/download-counts.md)
+NPM_STATS_MAX_DAYS_IN_RANGE = 540
+# Bulk queries are limited to 128 unscoped packages, and 365 days of data
+NPM_STATS_BULK_MAX_PACKAGES = 128
+NPM_STATS_BULK_MAX_DAYS_IN_RANGE = 365
+NPM_NO_DATA_ERROR_MSG = "no stats for this package for this period (0002)"
+
+
+def _get_package_creation_date(package):
+    '''Return for a given package the date at which it was created, from npm's
+    registry api.
+
+    :param package: the package name
+    :return: a date object, representing the date of the given package's
+        creation.
+    '''
+    response = http_utils.get(
+        NPM_REGISTRY_BASE_URL.rstrip('/') + '/' + package, cache_source='npm')
+    if not response.json():
+        raise ValueError('Package "{}" returned no data from '
+                         'npm registry. Check that the package '
+                         'is published.'.format(package))
+    time_created = response.json()['time']['created']
+    return dateutil.parser.parse(time_created).date()
+
+
+def _get_start_date(package, latest_date=None):
+    '''Determine when data collection should start from.
+
+    :param: package: the package name
+    :latest_date: the most recent date data was collected for this package, if
+        it exists
+    '''
+    creation_date = _get_package_creation_date(package)
+    if latest_date:
+        return max(latest_date, creation_date)
+    else:
+        return creation_date
+
+
+def _get_requested_period_date_range(package, latest_date=None):
+    '''Determine and return the required start_date and end_date for given
+    package'''
+    start_date = _get_start_date(package, latest_date)
+    end_date = datetime.date.today()
+    return start_date, end_date
+
+
+def _split_downloads_by_day(downloads, start_date, end_date):
+    '''Return a list of {'day': date, 'downloads': int} dicts, one for each
+    day from `start_date` to `end_date` (both inclusive), from the
+    `downloads` list of a range api response. Days missing from `downloads`
+    are counted as zero downloads.'''
+    downloads_by_day = {d['day']: d['downloads'] for d in downloads}
+
+    collected_days = []
+    day = start_date
+    while day <= end_date:
+        collected_days.append({
+            'day': day,
+            'downloads': downloads_by_day.get(
+                day.strftime(NPM_STATS_DATE_RANGE_FORMAT), 0)
+        })
+        day = day + datetime.timedelta(days=1)
+    return collected_days
+
+
+def _add_metrics_collected_from_source(package, start_date_of_requested_period,
+                                       end_date_of_requested_period):
+    '''Add required metrics data from npm registry.
+
+    The requested period is split into the largest date frames the range api
+    allows, and each frame's response is split back into per-day entries
+    locally. Days missing from a response are counted as zero downloads.
+
+    :return: a list of {'day': date, 'downloads': int} dicts, one for each day
+        from start_date (inclusive) to end_date (exclusive).
+    '''
+
+    start_date_of_window = start_date_of_requested_period
+
+    collected_days = []
+    while start_date_of_window < end_date_of_requested_period:
+        end_date_of_window = min(
+            start_date_of_window +
+            datetime.timedelta(days=NPM_STATS_MAX_DAYS_IN_RANGE - 1),
+            end_date_of_requested_period - datetime.timedelta(days=1))
+
+        # Counts for days before yesterday are final, so can be cached
+        # indefinitely.
+        window_is_final = end_date_of_window < \
+            datetime.date.today() - datetime.timedelta(days=1)
+        frame_response = _get_metrics_from_data_source(
+            package,
+            start_date=start_date_of_window.strftime(
+                NPM_STATS_DATE_RANGE_FORMAT),
+            end_date=end_date_of_window.strftime(NPM_STATS_DATE_RANGE_FORMAT),
+            cache_ttl=http_utils.CACHE_FOREVER if window_is_final else None
+        )
+        collected_days.extend(_split_downloads_by_day(
+            frame_response['downloads'], start_date_of_window,
+            end_date_of_window))
+
+        start_date_of_window = end_date_of_window + datetime.timedelta(days=1)
+
+    return collected_days
+
+
+def _get_metrics_from_data_source(package, start_date, end_date,
+                                  cache_ttl=None):
+    '''Get daily data from npm registry API for a given package, within a
+    given date range.
+
+    :param package: the package name
+    :param start_date: start date of collection, as a correctly formatted
+        string.
+    :param end_date: end date of range, as a correctly formatted string.
+    :param cache_ttl: seconds a cached response may be used for, if not the
+        default for npm.
+    :return a json response.'''
+    url_path = "{from_date}:{to_date}/{package}".format(
+        from_date=start_date,
+        to_date=end_date,
+        package=package)
+    response = http_utils.get(NPM_STATS_BASE_URL.rstrip('/') + '/' + url_path,
+                              cache_source='npm', cache_ttl=cache_ttl)
+    if 'error' in response.json():
+        if NPM_NO_DATA_ERROR_MSG in response.json()['error']:
+            return {'package': package,
+                    'start': start_date,
+                    'end': end_date,
+                    'downloads': []}
+        raise ValueError('package {} raised error:{}'
+                         .format(package, response.json()['error']))
+    return response.json()
+
+
+def _get_bulk_metrics_from_data_source(packages, start_date, end_date):
+    '''Get daily data from npm registry API for several unscoped packages,
+    within a given date range, with a single bulk query.
+
+    :param packages: a list of at least two package names.
+    :return: a dict of {package: downloads list}.'''
+    url_path = "{from_date}:{to_date}/{packages}".format(
+        from_date=start_date.strftime(NPM_STATS_DATE_RANGE_FORMAT),
+        to_date=end_date.strftime(NPM_STATS_DATE_RANGE_FORMAT),
+        packages=','.join(packages))
+    window_is_final = \
+        end_date < datetime.date.today() - datetime.timedelta(days=1)
+    response = http_utils.get(
+        NPM_STATS_BASE_URL.rstrip('/') + '/' + url_path, cache_source='npm',
+        cache_ttl=http_utils.CACHE_FOREVER if window_is_final else None)
+    json_response = response.json()
+    if 'error' in json_response:
+        raise ValueError('packages {} raised error:{}'
+                         .format(packages, json_response['error']))
+    # Packages without any data for the period are returned as null
+    return {package: (json_response.get(package) or {}).get('downloads', [])
+            for package in packages}
+
+
+def _make_rows(package, collected_days):
+    return [{
+        'package': package,
+        'source': 'npm',
+        'date': day['day'],
+        'downloads': day['downloads']
+    } for day in collected_days]
+
+
+def npm_collector(package, latest_date):
+    start_date_of_requested_period, end_date_of_requested_period = \
+        _get_requested_period_date_range(package, latest_date)
+
+    collected_days = \
+        _add_metrics_collected_from_source(package,
+                                           start_date_of_requested_period,
+                                           end_date_of_requested_period)
+
+    return _make_rows(package, collected_days)
+
+
+def npm_bulk_collector(latest_dates, scoped_packages=()):
+    '''Collect rows for several packages, using bulk queries where npm
+    supports them.
+
+    Unscoped packages whose requested periods fit within a single bulk query
+    are requested together, up to `NPM_STATS_BULK_MAX_PACKAGES` at a time.
+    Others are collected individually, as with `npm_collector`.
+
+    :param latest_dates: a dict of {package: latest_date}.
+    :param scoped_packages: the packages of `latest_dates` that are scoped
+        (`@scope/name`), which can't be bulk queried. Package names are
+        slugified, so this can't be told from the names themselves.
+    :return: a dict of {package: list of rows}.
+    '''
+    periods = {package: _get_requested_period_date_range(package, latest_date)
+               for package, latest_date in latest_dates.items()}
+    bulk_packages = sorted(
+        package for package, (start_date, end_date) in periods.items()
+        if package not in scoped_packages and start_date < end_date and
+        (end_date - start_date).days <= NPM_STATS_BULK_MAX_DAYS_IN_RANGE)
+
+    collected = {}
+    for i in range(0, len(bulk_packages), NPM_STATS_BULK_MAX_PACKAGES):
+        chunk = bulk_packages[i:i + NPM_STATS_BULK_MAX_PACKAGES]
+        if len(chunk) < 2:
+            # A bulk query for a single package isn't a bulk query
+            break
+        start_date = min(periods[package][0] for package in chunk)
+        end_date = periods[chunk[0]][1] - datetime.timedelta(days=1)
+        downloads = _get_bulk_metrics_from_data_source(chunk, start_date,
+                                                       end_date)
+        for package in chunk:
+            collected[package] = _make_rows(package, _split_downloads_by_day(
+                downloads[package], periods[package][0], end_date))
+
+    for package in latest_dates:
+        if package not in collected:
+            collected[package] = _make_rows(
+                package, _add_metrics_collected_from_source(
+                    package, *periods[package]))
+
+    return collected
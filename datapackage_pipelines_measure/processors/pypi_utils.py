@@ -0,0 +1,234 @@
+import collections
+import datetime
+import time
+
+import dateutil
+
+from datapackage_pipelines_measure.processors import google_utils
+from datapackage_pipelines_measure.config import settings
+
+import logging
+log = logging.getLogger(__name__)
+
+PYPI_DEFAULT_START_DATE = '2016-01-22'
+PYPI_DOWNLOADS_TABLE = 'bigquery-public-data.pypi.file_downloads'
+# Only report the bytes the query would process, without collecting data
+DRY_RUN = settings.get('PYPI_DRY_RUN', False)
+# Seconds between polls of a running query job, doubling up to the maximum
+JOB_POLL_INTERVAL = 1
+JOB_POLL_MAX_INTERVAL = 30
+# Seconds to wait for a query job to complete
+JOB_TIMEOUT = int(settings.get('PYPI_JOB_TIMEOUT', 1800))
+# Rows requested per page of query results
+RESULTS_PAGE_SIZE = 10000
+
+
+def _build_bigquery_query(start_dates, end_date):
+    '''Render the standard SQL BigQuery query for all packages in
+    `start_dates`.
+
+    The downloads table is partitioned by `timestamp`, so only the partitions
+    from the earliest start date to `end_date` are scanned, and only the
+    `project` and `timestamp` columns are read. Each package is only counted
+    from its own start date.
+
+    :param: start_dates: dict of package name to the date to start from
+    :param: end_date: the last date requested, for all packages
+    :returns: bigquery query as string'''
+
+    package_conditions = '\n            OR '.join(
+        "(project = '{package}' AND "
+        "timestamp >= TIMESTAMP('{start_date}'))".format(
+            package=package, start_date=start_date)
+        for package, start_date in sorted(start_dates.items()))
+
+    query = '''
+        SELECT
+          project,
+          FORMAT_TIMESTAMP('%Y-%m-%d', timestamp) AS yyyymmdd,
+          COUNT(*) AS total_downloads
+        FROM
+          `{table}`
+        WHERE
+          timestamp >= TIMESTAMP('{start_date}')
+          AND timestamp < TIMESTAMP('{before_date}')
+          AND project IN ({packages})
+          AND ({package_conditions})
+        GROUP BY
+          project,
+          yyyymmdd
+        ORDER BY
+          yyyymmdd DESC
+        '''.format(table=PYPI_DOWNLOADS_TABLE,
+                   packages=', '.join("'{}'".format(package)
+                                      for package in sorted(start_dates)),
+                   package_conditions=package_conditions,
+                   start_date=min(start_dates.values()),
+                   before_date=end_date + datetime.timedelta(days=1))
+    return query
+
+
+def _get_bigquery_service():
+    return google_utils.get_google_api_service(
+        google_utils.GOOGLE_API_BIGQUERY_SERVICE_NAME,
+        google_utils.GOOGLE_API_BIGQUERY_VERSION,
+        google_utils.GOOGLE_API_BIGQUERY_SCOPES
+    )
+
+
+def _build_bigquery_queries(start_dates, end_date):
+    '''Return a query for each group of packages in `start_dates` sharing a
+    start date, so each query only scans the days its packages need.'''
+    groups = collections.OrderedDict()
+    for package, start_date in sorted(start_dates.items(),
+                                      key=lambda item: item[1]):
+        groups.setdefault(start_date, {})[package] = start_date
+    return [_build_bigquery_query(group, end_date)
+            for group in groups.values()]
+
+
+def _job_kwargs(job):
+    '''Return the arguments identifying `job` in jobs api requests.'''
+    reference = job['jobReference']
+    kwargs = {
+        'projectId': reference['projectId'],
+        'jobId': reference['jobId']
+    }
+    if 'location' in reference:
+        kwargs['location'] = reference['location']
+    return kwargs
+
+
+def _insert_bigquery_job(service, query, dry_run=False):
+    '''Submit a query job, returning without waiting for it to complete.'''
+    body = {
+        'configuration': {
+            'query': {
+                'query': query,
+                'useLegacySql': False
+            },
+            'dryRun': dry_run
+        }
+    }
+    return service.jobs().insert(
+        projectId=settings['GOOGLE_API_PROJECT_ID'], body=body).execute()
+
+
+def _wait_for_bigquery_job(service, job):
+    '''Poll `job` until it is done, doubling the interval between polls up
+    to `JOB_POLL_MAX_INTERVAL`. Return the completed job, or raise if it
+    failed or didn't complete within `JOB_TIMEOUT` seconds.'''
+    interval = JOB_POLL_INTERVAL
+    waited = 0
+    while job['status']['state'] != 'DONE':
+        if waited >= JOB_TIMEOUT:
+            raise Exception('BigQuery job {} did not complete within {} '
+                            'seconds.'.format(job['jobReference']['jobId'],
+                                              JOB_TIMEOUT))
+        time.sleep(interval)
+        waited += interval
+        interval = min(interval * 2, JOB_POLL_MAX_INTERVAL)
+        job = service.jobs().get(**_job_kwargs(job)).execute()
+
+    if 'errorResult' in job['status']:
+        raise Exception('BigQuery job {} failed: {}'.format(
+            job['jobReference']['jobId'], job['status']['errorResult']))
+    return job
+
+
+def _get_bigquery_job_rows(service, job):
+    '''Yield the result rows of the completed `job`, a page at a time.'''
+    page_token = None
+    while True:
+        kwargs = _job_kwargs(job)
+        kwargs['maxResults'] = RESULTS_PAGE_SIZE
+        if page_token:
+            kwargs['pageToken'] = page_token
+        response = service.jobs().getQueryResults(**kwargs).execute()
+        yield from response.get('rows', [])
+        page_token = response.get('pageToken')
+        if not page_token:
+            return
+
+
+def estimate_bigquery_bytes(start_dates, end_date):
+    '''Dry run the queries for all packages in `start_dates`, and return the
+    number of bytes they would process (and be billed for).'''
+    service = _get_bigquery_service()
+    return sum(
+        int(_insert_bigquery_job(service, query, dry_run=True)
+            ['statistics']['totalBytesProcessed'])
+        for query in _build_bigquery_queries(start_dates, end_date))
+
+
+def _request_data_from_bigquery(start_dates, end_date):
+    '''Yield the result rows for all packages in `start_dates`.
+
+    All query jobs are submitted first, so they run concurrently, then each
+    is waited for and its results streamed page by page.
+    '''
+    service = _get_bigquery_service()
+    jobs = [_insert_bigquery_job(service, query)
+            for query in _build_bigquery_queries(start_dates, end_date)]
+    for job in jobs:
+        job = _wait_for_bigquery_job(service, job)
+        yield from _get_bigquery_job_rows(service, job)
+
+
+def _get_start_date(package, latest_date=None):
+    '''Determine when data collection should start.
+
+    :param: package: the package name
+    :latest_date: the most recent date data was collected for this package, if
+        it exists
+    '''
+    default_start = dateutil.parser.parse(PYPI_DEFAULT_START_DATE).date()
+    if latest_date:
+        return max(latest_date, default_start)
+    else:
+        return default_start
+
+
+def _get_requested_period_date_range(package, latest_date=None):
+    '''Determine and return the required start_date and end_date for given
+    package'''
+    start_date = _get_start_date(package, latest_date)
+    end_date = datetime.date.today() - datetime.timedelta(days=1)
+    return start_date, end_date
+
+
+def pypi_bulk_collector(latest_dates):
+    '''Collect rows for all packages in `latest_dates`, a dict of package
+    name to the most recent date collected for it (or None), with a single
+    BigQuery query for each distinct start date. Return a dict of package
+    name to its list of rows.'''
+    start_dates = {}
+    end_date = None
+    for package, latest_date in latest_dates.items():
+        start_dates[package], end_date = \
+            _get_requested_period_date_range(package, latest_date)
+
+    collected = {package: [] for package in latest_dates}
+    if not start_dates:
+        return collected
+
+    if DRY_RUN:
+        log.info('PyPI query for %s would process %d bytes (dry run, no data '
+                 'collected)', ', '.join(sorted(start_dates)),
+                 estimate_bigquery_bytes(start_dates, end_date))
+        return collected
+
+    for row in _request_data_from_bigquery(start_dates, end_date):
+        res_row = {
+            'source': 'pypi',
+            'package': row['f'][0]['v'],  # read: row, fields, column 0, value
+            'date': dateutil.parser.parse(row['f'][1]['v']).date(),
+            'downloads': int(row['f'][2]['v'])
+        }
+        collected.setdefault(res_row['package'], []).append(res_row)
+
+    return collected
+
+
+def pypi_collector(package, latest_date):
+    return pypi_bulk_collector({package: latest_date})[package]
@@ -3,6 +3,9 @@ import collections
 from datapackage_pipelines.wrapper import spew, ingest
 from datapackage_pipelines.utilities.resource_matcher import ResourceMatcher
 
+from datapackage_pipelines_measure.processors.latest_utils import \
+    remove_latest_index
+
 import logging
 log = logging.getLogger(__name__)
 
@@ -14,6 +17,8 @@ resources_matcher = ResourceMatcher(resource_name)
 
 datapackage['resources'] = [res for res in datapackage['resources']
                             if not resources_matcher.match(res['name'])]
+# The resource may have been written as an index by `datastore_get_latest`
+remove_latest_index(datapackage, resources_matcher)
 
 
 def process_resources(res_iter_):
@@ -0,0 +1,323 @@
+import collections
+import datetime
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import tweepy
+
+from datapackage_pipelines.generators import slugify
+
+from datapackage_pipelines_measure.config import settings
+
+import logging
+log = logging.getLogger(__name__)
+
+ENTITY_VALUE_ERROR_MSG = 'Entity, "{}", must be an @account, #hashtag, ' \
+                         'or url:url-search'
+TWITTER_API_USER_NOT_FOUND_ERROR_CODE = "50"
+# Returned by users/lookup when none of the requested users exist
+TWITTER_API_NO_USER_MATCHES_ERROR_CODE = "17"
+TWITTER_API_DATE_RANGE_FORMAT = '%Y-%m-%d'
+TWITTER_API_PER_PAGE_LIMIT = 100
+# Users per users/lookup request (the api allows up to 100)
+TWITTER_API_USERS_LOOKUP_LIMIT = 100
+TWITTER_API_SEARCH_INDEX_LIMIT_IN_DAYS = 3
+TWITTER_API_RATE_LIMIT_PERIOD = 900  # 15 mins
+# Tweet ids are "snowflakes", the milliseconds since this epoch shifted left
+# by 22 bits
+TWITTER_SNOWFLAKE_EPOCH_MS = 1288834974657
+TWITTER_SNOWFLAKE_TIMESTAMP_SHIFT = 22
+# Times in a row a request is retried after its rate limit resets
+TWITTER_API_RATE_LIMIT_MAX_RETRIES = \
+    int(settings.get('TWITTER_API_RATE_LIMIT_MAX_RETRIES', 3))
+# Number of entities collected concurrently
+MAX_WORKERS = int(settings.get('TWITTER_MAX_WORKERS', 4))
+
+# Time until which requests to a rate limited endpoint wait, by endpoint
+_resumes_at = {}
+_resumes_at_lock = threading.Lock()
+# Time spent waiting for rate limits, for the pipeline stats
+stats = {}
+_stats_lock = threading.Lock()
+
+
+def get_entity_type(entity):
+    '''Get the entity type, based on the starting character.'''
+    if entity.startswith('@'):
+        return 'account'
+    elif entity.startswith('#'):
+        return 'hashtag'
+    elif entity.startswith('url:'):
+        return 'url'
+    else:
+        raise ValueError(ENTITY_VALUE_ERROR_MSG.format(entity))
+
+
+def get_safe_entity(entity):
+    '''Get a url safe version of the entity, base on starting character.'''
+    if entity.startswith('@'):
+        return 'at-{}'.format(slugify(entity))
+    elif entity.startswith('#'):
+        return 'hash-{}'.format(slugify(entity))
+    elif entity.startswith('url:'):
+        return slugify(entity)
+    else:
+        raise ValueError(ENTITY_VALUE_ERROR_MSG.format(entity))
+
+
+@functools.lru_cache(maxsize=1)
+def _get_twitter_api_handler():
+    '''Initialize a twitter API handler with an App access token. The handler
+    is shared by all requests, so the app is only authenticated once.'''
+    auth = tweepy.auth.AppAuthHandler(settings['TWITTER_API_CONSUMER_KEY'],
+                                      settings['TWITTER_API_CONSUMER_SECRET'])
+    return tweepy.API(auth)
+
+
+def _get_rate_limit_wait(error):
+    '''Return the seconds to wait before the rate limit that raised the
+    `tweepy.RateLimitError` `error` resets. This is read from the response's
+    `x-rate-limit-reset` header, or is a whole rate limit period if the
+    response doesn't say.'''
+    headers = getattr(error.response, 'headers', None) or {}
+    reset = headers.get('x-rate-limit-reset')
+    remaining = headers.get('x-rate-limit-remaining')
+    if reset is None or (remaining is not None and int(remaining) > 0):
+        return TWITTER_API_RATE_LIMIT_PERIOD
+    # Allow a second for clock differences
+    return max(int(reset) - time.time(), 0) + 1
+
+
+def _add_stat(name, value):
+    with _stats_lock:
+        stats[name] = stats.get(name, 0) + value
+
+
+def _pause_endpoint(endpoint, wait):
+    '''Make requests to the rate limited `endpoint` wait `wait` secs.'''
+    with _resumes_at_lock:
+        _resumes_at[endpoint] = max(_resumes_at.get(endpoint, 0),
+                                    time.time() + wait)
+
+
+def _wait_for_endpoint(endpoint):
+    '''Wait until the rate limit for `endpoint` has reset, if reached.'''
+    with _resumes_at_lock:
+        wait = _resumes_at.get(endpoint, 0) - time.time()
+    if wait > 0:
+        log.info('Twitter API rate limit reached for {}. Sleeping for {:.0f} '
+                 'secs.'.format(endpoint, wait))
+        _add_stat('twitter: rate limit waits', 1)
+        _add_stat('twitter: rate limited seconds', wait)
+        time.sleep(wait)
+
+
+def _call_with_rate_limit(endpoint, func, *args, **kwargs):
+    '''Call `func` with `args` and `kwargs`. If the rate limit for `endpoint`
+    is reached, it is called again once it resets, at most
+    `TWITTER_API_RATE_LIMIT_MAX_RETRIES` times in a row.'''
+    retries = 0
+    while True:
+        _wait_for_endpoint(endpoint)
+        try:
+            return func(*args, **kwargs)
+        except tweepy.RateLimitError as e:
+            retries += 1
+            if retries > TWITTER_API_RATE_LIMIT_MAX_RETRIES:
+                raise
+            _pause_endpoint(endpoint, _get_rate_limit_wait(e))
+
+
+def _handle_twitter_rate_limit(cursor, endpoint):
+    '''Yield the items of `cursor`, handling the rate limits of `endpoint`
+    (see `_call_with_rate_limit`).'''
+    while True:
+        try:
+            item = _call_with_rate_limit(endpoint, cursor.next)
+        except StopIteration:
+            return
+        except tweepy.TweepError as e:
+            if str(e.api_code) == TWITTER_API_USER_NOT_FOUND_ERROR_CODE:
+                raise ValueError(
+                    'Requested user was not found. Check your configuration')
+            raise e
+        yield item
+
+
+def _get_followers_counts(accounts):
+    '''Return a dict of the current followers count of each of the `accounts`
+    (@account entities), requesting up to `TWITTER_API_USERS_LOOKUP_LIMIT`
+    users at a time, and raise an informative error message if any are not
+    found.'''
+    api = _get_twitter_api_handler()
+    screen_names = [account.lstrip('@') for account in accounts]
+    users = {}
+    for i in range(0, len(screen_names), TWITTER_API_USERS_LOOKUP_LIMIT):
+        chunk = screen_names[i:i + TWITTER_API_USERS_LOOKUP_LIMIT]
+        try:
+            found = _call_with_rate_limit('users_lookup', api.lookup_users,
+                                          screen_names=chunk)
+        except tweepy.TweepError as e:
+            if str(e.api_code) != TWITTER_API_NO_USER_MATCHES_ERROR_CODE:
+                raise e
+            found = []
+        users.update((user.screen_name.lower(), user) for user in found)
+
+    followers_counts = {}
+    for account, screen_name in zip(accounts, screen_names):
+        user = users.get(screen_name.lower())
+        if user is None:
+            raise ValueError('User with name, "{}", was not found. '
+                             'Check your configuration'.format(account))
+        followers_counts[account] = user.followers_count
+    return followers_counts
+
+
+def _get_twitter_search_results(entity, formatted_start_date,
+                                formatted_end_date):
+    '''This method calls for search in twitter's API, and yields the tweets
+    that matched the search within given time frame, including retweets.
+
+    :param entity: the searched term.
+    :param formatted_start_date: the starting date of period (inclusive).
+    :param formatted_end_date: the end date of period (exclusive).
+    :return an iterator of tweets'''
+
+    query_args = {
+        'q': entity, 'count': TWITTER_API_PER_PAGE_LIMIT,
+        'result_type': 'recent', 'include_entities': False,
+        'since': formatted_start_date, 'until': formatted_end_date
+    }
+    api = _get_twitter_api_handler()
+
+    yield from _handle_twitter_rate_limit(tweepy.Cursor(api.search,
+                                                        **query_args)
+                                          .items(), 'search')
+
+
+def _get_snowflake_id(date):
+    '''Return the lowest id a tweet created at the start of `date` (UTC) can
+    have.'''
+    start = datetime.datetime(date.year, date.month, date.day,
+                              tzinfo=datetime.timezone.utc)
+    timestamp_ms = int(start.timestamp() * 1000)
+    return (timestamp_ms - TWITTER_SNOWFLAKE_EPOCH_MS) << \
+        TWITTER_SNOWFLAKE_TIMESTAMP_SHIFT
+
+
+def _get_account_tweets(entity, start_date, end_date):
+    '''This method iterates over the tweets written by the given user, and
+    yields the tweets in given time period.
+
+    There's no built-in option for time filtering, but tweet ids increase
+    with the time they were created, so the timeline is bounded to the
+    period with `since_id` and `max_id` ids derived from its dates. Tweets
+    are still iterated from latest to oldest, excluding too-new, and stopping
+    once too-old tweets are reached.
+
+    :param entity: the user who's timeline is iterated over.
+    :param start_date: the earliest date of the period (inclusive).
+    :param end_date: the end date of the period (exclusive).
+    '''
+    start_date = datetime. \
+        datetime.strptime(start_date, TWITTER_API_DATE_RANGE_FORMAT).date()
+    end_date = datetime. \
+        datetime.strptime(end_date, TWITTER_API_DATE_RANGE_FORMAT).date()
+    # `since_id` is exclusive, and `max_id` inclusive
+    user_tweets_args = {'screen_name': entity, 'count': 200,
+                        'include_rts': False, 'exclude_replies': False,
+                        'since_id': _get_snowflake_id(start_date) - 1,
+                        'max_id': _get_snowflake_id(end_date) - 1}
+    api = _get_twitter_api_handler()
+
+    for tweet in _handle_twitter_rate_limit(tweepy.Cursor(
+            api.user_timeline, **user_tweets_args).items(), 'user_timeline'):
+        if tweet.created_at.date() >= end_date:
+            continue
+        if tweet.created_at.date() < start_date:
+            break
+        yield tweet
+
+
+def _count_tweets(tweets):
+    '''Make a single pass over `tweets`, keeping only counters, and return a
+    dict of two-tuples of the number of tweets, and their total count of
+    favorites and retweets, by the date they were created. Interactions
+    aren't double-counted, so tweets that are themselves retweets are
+    skipped, and only original tweets are counted.'''
+    counts = collections.defaultdict(lambda: (0, 0))
+    for tweet in tweets:
+        tweet_count, interaction_count = counts[tweet.created_at.date()]
+        tweet_count += 1
+        if not getattr(tweet, 'retweeted_status', None):
+            interaction_count += tweet.favorite_count + tweet.retweet_count
+        counts[tweet.created_at.date()] = (tweet_count, interaction_count)
+    return counts
+
+
+def _get_mentions_and_interactions(entity, start_date, end_date):
+    '''Return a dict of two-tuples of the mentions and interactions metrics
+    for entity, by date, from `start_date` to `end_date` (both inclusive).
+
+    Mentions are the number of tweets found by searching for the entity
+    between the given date range. Interactions are the favorites and
+    retweets of the entity's own tweets during the date range for an account,
+    or of the tweets found by the same search for a hashtag or url, counted
+    in the same pass. All dates are collected with a single search (and
+    timeline) pass, bucketing tweets by the date they were created.
+    '''
+    since = start_date.strftime(TWITTER_API_DATE_RANGE_FORMAT)
+    until = (end_date + datetime.timedelta(days=1)) \
+        .strftime(TWITTER_API_DATE_RANGE_FORMAT)
+    mentions = _count_tweets(_get_twitter_search_results(entity, since,
+                                                         until))
+    interactions = mentions
+    if get_entity_type(entity) == 'account':
+        interactions = _count_tweets(_get_account_tweets(entity, since,
+                                                         until))
+
+    metrics = collections.OrderedDict()
+    date = start_date
+    while date <= end_date:
+        metrics[date] = (mentions[date][0], interactions[date][1])
+        date += datetime.timedelta(days=1)
+    return metrics
+
+
+def twitter_collector(entities, start_dates, end_date):
+    '''Return a dict of rows for each of `entities`, one for each date from
+    its date in `start_dates` to `end_date` (both inclusive), with its
+    mentions and interactions, and the current followers of accounts for
+    `end_date`.
+
+    Followers of all accounts are requested together in batches, and the
+    searches and timelines of entities are requested over a bounded worker
+    pool. All requests share one authenticated API handler.
+    '''
+    entity_types = [get_entity_type(entity) for entity in entities]
+    followers_counts = _get_followers_counts(
+        [entity for entity, entity_type in zip(entities, entity_types)
+         if entity_type == 'account'])
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        metrics = list(executor.map(
+            lambda entity: _get_mentions_and_interactions(
+                entity, start_dates[entity], end_date),
+            entities))
+
+    return collections.OrderedDict(
+        (entity, [{
+            'entity': entity,
+            'entity_type': entity_type,
+            'source': 'twitter',
+            'date': date,
+            'mentions': mentions,
+            'interactions': interactions,
+            # Followers can only be requested for today
+            'followers': followers_counts.get(entity)
+            if date == end_date else None
+        } for date, (mentions, interactions) in entity_metrics.items()])
+        for entity, entity_type, entity_metrics
+        in zip(entities, entity_types, metrics))
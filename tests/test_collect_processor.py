@@ -0,0 +1,131 @@
+import os
+import datetime
+import unittest
+
+import requests_mock
+
+from datapackage_pipelines.utilities.lib_test_helpers import (
+    mock_processor_test
+)
+
+import datapackage_pipelines_measure.processors
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class TestMeasureCollectProcessor(unittest.TestCase):
+
+    @requests_mock.mock()
+    def test_collect_processor(self, mock_request):
+        '''Collect unscoped npm packages with a bulk query, a scoped npm
+        package, and a gem, in one resource.'''
+        today = datetime.date.today()
+        two_days_ago = today - datetime.timedelta(days=2)
+        yesterday = today - datetime.timedelta(days=1)
+
+        bulk_url = 'https://api.npmjs.org/downloads/range/{}:{}/{}'.format(
+            two_days_ago.strftime('%Y-%m-%d'),
+            yesterday.strftime('%Y-%m-%d'),
+            'my-package,other-package')
+        mock_request.get(bulk_url, json={
+            'my-package': {
+                'downloads': [
+                    {'day': two_days_ago.strftime('%Y-%m-%d'),
+                     'downloads': 3},
+                    {'day': yesterday.strftime('%Y-%m-%d'),
+                     'downloads': 5}
+                ]
+            },
+            'other-package': None
+        })
+        mock_request.get(
+            'https://api.npmjs.org/downloads/range/{}:{}/{}'.format(
+                two_days_ago.strftime('%Y-%m-%d'),
+                yesterday.strftime('%Y-%m-%d'), 'my-scope-scoped-package'),
+            json={'downloads': [{'day': yesterday.strftime('%Y-%m-%d'),
+                                 'downloads': 2}]})
+        for package in ['my-package', 'other-package',
+                        'my-scope-scoped-package']:
+            mock_request.get('https://registry.npmjs.org/{}'.format(package),
+                             json={'time': {
+                                 'created': '2017-01-01T00:00:00.000Z'}})
+        mock_request.get('https://rubygems.org/api/v1/gems/mygem.json',
+                         json={'name': 'mygem', 'downloads': 271})
+
+        # input arguments used by our mock `ingest`
+        datapackage = {
+            'name': 'my-datapackage',
+            'project': 'my-project',
+            'resources': [{
+                'name': 'latest-project-entries',
+                'schema': {
+                    'fields': []
+                }
+            }]
+        }
+        params = {
+            'config': {
+                'single-process': True,
+                'npm': {'packages': ['my-package', 'other-package',
+                                     '@my-scope/scoped-package']},
+                'rubygems': {'gems': ['mygem']}
+            }
+        }
+        latest_rows = [
+            {'package': 'my-package', 'source': 'npm',
+             'date': two_days_ago},
+            {'package': 'other-package', 'source': 'npm',
+             'date': two_days_ago},
+            {'package': 'my-scope-scoped-package', 'source': 'npm',
+             'date': two_days_ago}
+        ]
+
+        # Path to the processor we want to test
+        processor_dir = \
+            os.path.dirname(datapackage_pipelines_measure.processors.__file__)
+        processor_path = os.path.join(processor_dir, 'collect.py')
+
+        # Trigger the processor with our mock `ingest` and capture what it will
+        # returned to `spew`.
+        spew_args, _ = \
+            mock_processor_test(processor_path,
+                                (params, datapackage, iter([latest_rows])))
+
+        spew_dp = spew_args[0]
+        spew_res_iter = spew_args[1]
+
+        # Asserts for the datapackage
+        dp_resources = spew_dp['resources']
+        assert len(dp_resources) == 2
+        assert dp_resources[1]['name'] == 'code-packaging-collected'
+        field_names = \
+            [field['name'] for field in dp_resources[1]['schema']['fields']]
+        assert field_names == ['package', 'source', 'date', 'downloads',
+                               'total_downloads']
+
+        # Asserts for the res_iter
+        spew_res_iter_contents = list(spew_res_iter)
+        assert len(spew_res_iter_contents) == 2
+        assert list(spew_res_iter_contents[0]) == latest_rows
+        rows = list(spew_res_iter_contents[1])
+        assert rows == [
+            {'package': 'my-package', 'source': 'npm', 'date': two_days_ago,
+             'downloads': 3, 'total_downloads': None},
+            {'package': 'my-package', 'source': 'npm', 'date': yesterday,
+             'downloads': 5, 'total_downloads': None},
+            {'package': 'other-package', 'source': 'npm',
+             'date': two_days_ago, 'downloads': 0, 'total_downloads': None},
+            {'package': 'other-package', 'source': 'npm', 'date': yesterday,
+             'downloads': 0, 'total_downloads': None},
+            {'package': 'my-scope-scoped-package', 'source': 'npm',
+             'date': two_days_ago, 'downloads': 0, 'total_downloads': None},
+            {'package': 'my-scope-scoped-package', 'source': 'npm',
+             'date': yesterday, 'downloads': 2, 'total_downloads': None},
+            {'package': 'mygem', 'source': 'rubygems', 'date': today,
+             'downloads': None, 'total_downloads': 271}
+        ]
+        # One bulk request for both unscoped npm packages, one for the
+        # scoped package, one registry request for each package's creation
+        # date, and one for the gem
+        assert mock_request.call_count == 6
@@ -0,0 +1,114 @@
+import os
+import datetime
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine, inspect
+
+from datapackage_pipelines.utilities.lib_test_helpers import (
+    mock_processor_test
+)
+
+import datapackage_pipelines_measure.processors
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class TestMeasureDatastoreGetLatestProcessor(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.engine = 'sqlite:///{}'.format(self.db_path)
+        engine = create_engine(self.engine)
+        with engine.begin() as connection:
+            connection.execute(
+                'CREATE TABLE codepackaging (project_id TEXT, package TEXT, '
+                'source TEXT, date DATE, downloads INTEGER, '
+                'total_downloads INTEGER, timestamp TEXT)')
+            connection.execute(
+                'INSERT INTO codepackaging VALUES '
+                '("my-project", "my-package", "npm", "2017-05-14", 1, NULL, '
+                '"t1"), '
+                '("my-project", "my-package", "npm", "2017-05-15", 2, NULL, '
+                '"t2"), '
+                '("my-project", "my-package", "pypi", "2017-05-13", 3, NULL, '
+                '"t3"), '
+                '("other-project", "my-package", "npm", "2017-05-16", 4, '
+                'NULL, "t4")')
+
+    def tearDown(self):
+        os.remove(self.db_path)
+
+    def _run_processor(self, params):
+        processor_dir = \
+            os.path.dirname(datapackage_pipelines_measure.processors.__file__)
+        processor_path = os.path.join(processor_dir,
+                                      'datastore_get_latest.py')
+        datapackage = {
+            'name': 'my-datapackage',
+            'project': 'my-project',
+            'resources': []
+        }
+        spew_args, _ = mock_processor_test(processor_path,
+                                           (params, datapackage, iter([])))
+        return spew_args[0], list(spew_args[1])
+
+    def test_datastore_get_latest_processor(self):
+        '''Latest row of each package and source for the project, with only
+        the requested columns.'''
+        spew_dp, spew_res_iter_contents = self._run_processor({
+            'resource-name': 'latest-project-entries',
+            'table': 'codepackaging',
+            'engine': self.engine,
+            'distinct_on': ['project_id', 'package', 'source'],
+            'project_id': 'my-project',
+            'columns': ['downloads']
+        })
+
+        dp_resources = spew_dp['resources']
+        assert len(dp_resources) == 1
+        assert dp_resources[0]['name'] == 'latest-project-entries'
+        field_names = \
+            [field['name'] for field in dp_resources[0]['schema']['fields']]
+        assert field_names == ['project_id', 'package', 'source', 'date',
+                               'downloads']
+
+        rows = sorted(spew_res_iter_contents[0], key=lambda r: r['source'])
+        assert rows == [
+            {'project_id': 'my-project', 'package': 'my-package',
+             'source': 'npm', 'date': datetime.date(2017, 5, 15),
+             'downloads': 2},
+            {'project_id': 'my-project', 'package': 'my-package',
+             'source': 'pypi', 'date': datetime.date(2017, 5, 13),
+             'downloads': 3}
+        ]
+
+    def test_datastore_get_latest_processor_create_index(self):
+        '''The index for the query is created when requested.'''
+        self._run_processor({
+            'resource-name': 'latest-project-entries',
+            'table': 'codepackaging',
+            'engine': self.engine,
+            'distinct_on': ['project_id', 'package', 'source'],
+            'create-index': True
+        })
+
+        indexes = inspect(create_engine(self.engine)) \
+            .get_indexes('codepackaging')
+        assert [(i['name'], i['column_names']) for i in indexes] == \
+            [('ix_codepackaging_latest',
+              ['project_id', 'package', 'source', 'date'])]
+
+    def test_datastore_get_latest_processor_no_table(self):
+        '''Nothing is added when the table doesn't exist yet.'''
+        spew_dp, spew_res_iter_contents = self._run_processor({
+            'resource-name': 'latest-project-entries',
+            'table': 'email',
+            'engine': self.engine,
+            'distinct_on': ['project_id', 'source', 'list_id']
+        })
+
+        assert spew_dp['resources'] == []
+        assert spew_res_iter_contents == []
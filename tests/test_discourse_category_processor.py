@@ -1,7 +1,10 @@
 import dateutil
 import os
+import shutil
+import tempfile
 import unittest
 
+import mock
 import requests_mock
 
 from datapackage_pipelines.utilities.lib_test_helpers import (
@@ -80,6 +83,30 @@ SITE_RESPONSE = {
     ]
 }
 
+_patchers = []
+
+
+def setup_module():
+    # Cache categories in a temporary directory, rather than the project's
+    # cache
+    cache_path = tempfile.mkdtemp()
+    _patchers.extend([
+        mock.patch('datapackage_pipelines_measure.processors.discourse_utils.'
+                   'CATEGORY_CACHE_PATH', cache_path),
+        mock.patch('datapackage_pipelines_measure.processors.discourse_utils.'
+                   '_category_cache', None)
+    ])
+    for patcher in _patchers:
+        patcher.start()
+
+
+def teardown_module():
+    from datapackage_pipelines_measure.processors import discourse_utils
+    cache_path = discourse_utils.CATEGORY_CACHE_PATH
+    for patcher in _patchers:
+        patcher.stop()
+    shutil.rmtree(cache_path)
+
 
 class TestDiscourseCategoriesProcessor_NoChildren(unittest.TestCase):
 
@@ -580,3 +607,92 @@ class TestDiscourseCategoriesProcessor_ChildrenExpand(unittest.TestCase):
             assert categories[i + 3] == ('child-one', i + 4)
         for i in range(0, 3):
             assert categories[i + 6] == ('child-two', i + 4)
+
+
+class TestDiscourseCategoriesProcessor_Categories(unittest.TestCase):
+
+    '''Tests for Discourse Category processor when several categories of a
+    domain are collected together.'''
+
+    @requests_mock.Mocker()
+    def test_add_discourse_category_resource_categories(self, m):
+        '''Each category is collected since its own latest date, in a single
+        resource.'''
+
+        # Mock API responses
+        m.get('https://discourse.example.com/site.json', json=SITE_RESPONSE)
+        for category_id in [1, 4, 5]:
+            m.get('https://discourse.example.com/admin/reports/topics.json?category_id={}'.format(category_id),  # noqa
+                  json=REPORT_RESPONSE)
+            m.get('https://discourse.example.com/admin/reports/posts.json?category_id={}'.format(category_id),  # noqa
+                  json=REPORT_RESPONSE)
+        m.get('https://discourse.example.com/admin/reports/topics.json?category_id=3',  # noqa
+              json=RESTRICTED_REPORT_RESPONSE)
+        m.get('https://discourse.example.com/admin/reports/posts.json?category_id=3',  # noqa
+              json=RESTRICTED_REPORT_RESPONSE)
+
+        # input arguments used by our mock `ingest`
+        datapackage = {
+            'name': 'my-datapackage',
+            'project': 'my-project',
+            'resources': [{
+                'name': 'latest-project-entries',
+                'schema': {
+                    'fields': []
+                }
+            }]
+        }
+        params = {
+            'domain': 'discourse.example.com',
+            'categories': [
+                {'name': 'top-one', 'children': 'aggregate'},
+                {'name': 'top-three'}
+            ]
+        }
+
+        def latest_entries_res():
+            yield {
+                    'category': 'top-three',
+                    'domain': 'discourse.example.com',
+                    'new_posts': 1,
+                    'new_topics': 1,
+                    'date': dateutil.parser.parse('2017-07-09').date(),
+                    'source': 'discourse'
+                }
+
+        # Path to the processor we want to test
+        processor_dir = \
+            os.path.dirname(datapackage_pipelines_measure.processors.__file__)
+        processor_path = os.path.join(processor_dir,
+                                      'add_discourse_category_resource.py')
+
+        # Trigger the processor with our mock `ingest` and capture what it will
+        # returned to `spew`.
+        spew_args, _ = mock_processor_test(processor_path,
+                                           (params, datapackage,
+                                            iter([latest_entries_res()])))
+
+        spew_dp = spew_args[0]
+        spew_res_iter = spew_args[1]
+
+        # Asserts for the datapackage
+        dp_resources = spew_dp['resources']
+        assert len(dp_resources) == 2
+        assert dp_resources[1]['name'] == 'discourse-example-com'
+
+        # Asserts for the res_iter
+        spew_res_iter_contents = list(spew_res_iter)
+        assert len(list(spew_res_iter_contents)) == 2
+        rows = list(spew_res_iter_contents)[1]
+        # six days for top-one, with its children aggregated, then three
+        # days for top-three
+        assert [(r['category'], r['new_posts']) for r in rows] == \
+            [('top-one', i * 3) for i in range(1, 7)] + \
+            [('top-three', i) for i in range(4, 7)]
+
+        # top-three is requested since its latest date
+        top_three_requests = [r for r in m.request_history
+                              if r.qs.get('category_id') == ['3']]
+        assert len(top_three_requests) == 2
+        assert all(r.qs['start_date'] == ['2017-07-09']
+                   for r in top_three_requests)
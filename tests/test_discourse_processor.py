@@ -49,6 +49,16 @@ ACTIVE_USERS_RESPONSE = [
 ]
 
 
+def _mock_active_users(m):
+    '''Mock each page of ACTIVE_USERS_RESPONSE, as pages may be requested
+    in any order. Later pages are empty.'''
+    m.get('https://discourse.example.com/admin/users/list/active.json',
+          json=[])
+    for page, response in enumerate(ACTIVE_USERS_RESPONSE, start=1):
+        m.get('https://discourse.example.com/admin/users/list/active.json'
+              '?page={}'.format(page), **response)
+
+
 class TestDiscourseProcessor(unittest.TestCase):
 
     @requests_mock.Mocker()
@@ -59,8 +69,7 @@ class TestDiscourseProcessor(unittest.TestCase):
         # Mock API responses
         m.get('https://discourse.example.com/admin/reports/signups.json',
               json=REPORT_RESPONSE)
-        m.get('https://discourse.example.com/admin/users/list/active.json',
-              ACTIVE_USERS_RESPONSE)
+        _mock_active_users(m)
         m.get('https://discourse.example.com/admin/reports/topics.json',
               json=REPORT_RESPONSE)
         m.get('https://discourse.example.com/admin/reports/visits.json',
@@ -137,8 +146,7 @@ class TestDiscourseProcessor(unittest.TestCase):
         # Mock API responses
         m.get('https://discourse.example.com/admin/reports/signups.json',
               json=RESTRICTED_REPORT_RESPONSE)
-        m.get('https://discourse.example.com/admin/users/list/active.json',
-              ACTIVE_USERS_RESPONSE)
+        _mock_active_users(m)
         m.get('https://discourse.example.com/admin/reports/topics.json',
               json=RESTRICTED_REPORT_RESPONSE)
         m.get('https://discourse.example.com/admin/reports/visits.json',
@@ -306,3 +314,51 @@ class TestDiscourseProcessor(unittest.TestCase):
             list(spew_res_iter)
         error_msg = "Expected JSON in response from: https://discourse.example.com/admin/users/list/active.json?api_key=myfakediscoursetoken&page=1"  # noqa
         self.assertEqual(str(cm.exception), error_msg)
+
+    def _run_with_active_users_report(self, m):
+        for report in ['signups', 'topics', 'visits', 'posts']:
+            m.get('https://discourse.example.com/admin/reports/{}.json'
+                  .format(report), json=REPORT_RESPONSE)
+        datapackage = {
+            'name': 'my-datapackage',
+            'project': 'my-project',
+            'resources': []  # nothing here
+        }
+        params = {
+            'domain': 'discourse.example.com',
+            'active-users-report': 'active_users'
+        }
+        processor_dir = \
+            os.path.dirname(datapackage_pipelines_measure.processors.__file__)
+        processor_path = os.path.join(processor_dir,
+                                      'add_discourse_resource.py')
+        spew_args, _ = mock_processor_test(processor_path,
+                                           (params, datapackage, iter([])))
+        rows = list(spew_args[1])[0]
+        return [r for r in rows if r['date'] == datetime.date.today()][0]
+
+    @requests_mock.Mocker()
+    def test_add_discourse_resource_active_users_report(self, m):
+        '''Active users are read from the report, without paging users.'''
+        _mock_active_users(m)
+        m.get('https://discourse.example.com/admin/reports/active_users.json',
+              json={'report': {'data': [{'x': '2017-07-10', 'y': 40},
+                                        {'x': '2017-07-11', 'y': 42}]}})
+
+        today_row = self._run_with_active_users_report(m)
+
+        assert today_row['active_users'] == 42
+        assert not any('/admin/users/list/' in r.url
+                       for r in m.request_history)
+
+    @requests_mock.Mocker()
+    def test_add_discourse_resource_active_users_report_missing(self, m):
+        '''Active users are counted from the users list, if the report isn't
+        available.'''
+        _mock_active_users(m)
+        m.get('https://discourse.example.com/admin/reports/active_users.json',
+              status_code=404, text='not found')
+
+        today_row = self._run_with_active_users_report(m)
+
+        assert today_row['active_users'] == 4
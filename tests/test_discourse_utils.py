@@ -1,7 +1,12 @@
+import asyncio
+import threading
+import time
+
 import mock
 import pytest
 import datapackage_pipelines_measure.processors.discourse_utils as discourse_utils
 from datapackage_pipelines_measure.config import settings
+from datapackage_pipelines_measure.processors import http_utils
 
 
 class TestDiscourseUtilsRequestDataFromDiscourse(object):
@@ -44,13 +49,178 @@ class TestDiscourseUtilsRequestDataFromDiscourse(object):
             ],
         )
 
-        with mock.patch('time.sleep', return_value=None) as sleep_mock:
+        with mock.patch('time.sleep', return_value=None) as sleep_mock, \
+                mock.patch.dict(http_utils._paused_until, clear=True):
             response = discourse_utils.request_data_from_discourse(domain, endpoint)
 
         assert response == expected_json_response
         sleep_mock.assert_called()
 
 
+class TestDiscourseUtilsAsyncDiscourseClient(object):
+    def test_count_users_requests_bounded_pages(self):
+        in_flight = []
+        max_in_flight = []
+        lock = threading.Lock()
+
+        def request_page(domain, endpoint, cache_ttl=None, page=1):
+            with lock:
+                in_flight.append(page)
+                max_in_flight.append(len(in_flight))
+            time.sleep(0.001)
+            with lock:
+                in_flight.remove(page)
+            # 1399 active users, then inactive users up to page 1000
+            if page < 700:
+                return [{'age': 1}, {'age': 1}]
+            if page == 700:
+                return [{'age': 1}, {'age': 2}]
+            if page <= 1000:
+                return [{'age': 2}, {'age': 2}]
+            return []
+
+        with mock.patch.object(discourse_utils, 'request_data_from_discourse',
+                               side_effect=request_page) as request_mock:
+            count = discourse_utils.run_with_client(
+                'example.com',
+                lambda client: client.count_users(
+                    'active', lambda user: user['age'] < 2),
+                max_concurrency=2)
+
+        assert count == 1399
+        assert max(max_in_flight) <= 2
+        requested_pages = [c[1]['page'] for c in request_mock.call_args_list]
+        assert len(requested_pages) == len(set(requested_pages))
+        assert len(requested_pages) < 25
+
+    def test_count_users_single_page(self):
+        with mock.patch.object(discourse_utils, 'request_data_from_discourse',
+                               return_value=[{'age': 1}, {'age': 2}]) \
+                as request_mock:
+            count = discourse_utils.run_with_client(
+                'example.com',
+                lambda client: client.count_users(
+                    'active', lambda user: user['age'] < 2))
+
+        assert count == 1
+        assert request_mock.call_count == 1
+
+    def test_gather_raises_first_failure_in_order(self):
+        async def fail(client, message, delay):
+            await asyncio.sleep(delay)
+            raise ValueError(message)
+
+        async def main(client):
+            return await client.gather(fail(client, 'first', 0.02),
+                                       fail(client, 'second', 0))
+
+        with pytest.raises(ValueError) as e:
+            discourse_utils.run_with_client('example.com', main)
+
+        assert str(e.value) == 'first'
+
+
+SITE_RESPONSE = {
+    'categories': [
+        {'id': 1, 'name': 'Top One', 'slug': 'top-one'},
+        {'id': 2, 'name': 'Child One', 'slug': 'child-one',
+         'parent_category_id': 1}
+    ]
+}
+
+
+class TestDiscourseUtilsCategories(object):
+    def test_categories_cached_across_runs(self, requests_mock,
+                                           category_cache):
+        requests_mock.get('https://example.com/site.json',
+                          json=SITE_RESPONSE)
+
+        first = discourse_utils.get_category_info_from_discourse(
+            'example.com')
+        # A new run starts with a new cache object, on the same directory
+        with mock.patch.object(discourse_utils, '_category_cache', None):
+            second = discourse_utils.get_category_info_from_discourse(
+                'example.com')
+
+        assert first == second == [{
+            'id': 1, 'name': 'Top One', 'slug': 'top-one',
+            'subcategories': [{'id': 2, 'name': 'Child One',
+                               'slug': 'child-one', 'subcategories': None}]
+        }]
+        assert requests_mock.call_count == 1
+
+    def test_expired_categories_requested_again(self, requests_mock,
+                                                category_cache):
+        requests_mock.get('https://example.com/site.json',
+                          json=SITE_RESPONSE)
+
+        discourse_utils.get_category_info_from_discourse('example.com')
+        with mock.patch.object(discourse_utils, 'CATEGORY_CACHE_TTL', 0.001):
+            time.sleep(0.01)
+            discourse_utils.get_category_info_from_discourse('example.com')
+
+        assert requests_mock.call_count == 2
+
+    @mock.patch.object(discourse_utils, '_refreshed_domains', set())
+    def test_missing_category_requested_again(self, requests_mock,
+                                              category_cache):
+        new_category = {'id': 3, 'name': 'Top Two', 'slug': 'top-two'}
+        requests_mock.get('https://example.com/site.json', [
+            {'json': SITE_RESPONSE},
+            {'json': {'categories': SITE_RESPONSE['categories'] +
+                      [new_category]}}
+        ])
+        discourse_utils.get_category_map.cache_clear()
+
+        assert discourse_utils.get_category(
+            'example.com', slug='top-one')['id'] == 1
+        # Added since the categories were cached
+        assert discourse_utils.get_category(
+            'example.com', slug='top-two')['id'] == 3
+        assert discourse_utils.get_category(
+            'example.com', category_id=3)['slug'] == 'top-two'
+
+        assert requests_mock.call_count == 2
+        # The cache has the new categories
+        assert 'top-two' in discourse_utils.get_category_map(
+            'example.com').by_slug
+
+    @mock.patch.object(discourse_utils, '_refreshed_domains', set())
+    def test_unknown_category_raises(self, requests_mock, category_cache):
+        requests_mock.get('https://example.com/site.json',
+                          json=SITE_RESPONSE)
+        discourse_utils.get_category_map.cache_clear()
+
+        with pytest.raises(ValueError) as e:
+            discourse_utils.get_category('example.com', slug='unknown')
+        with pytest.raises(ValueError):
+            discourse_utils.get_category('example.com', slug='other')
+
+        assert str(e.value) == 'Category "unknown" was not found on ' \
+            'example.com. Check your configuration'
+        # Categories are only requested again once
+        assert requests_mock.call_count == 2
+
+    def test_category_map_indexes(self):
+        category_map = discourse_utils.CategoryMap([{
+            'id': 1, 'name': 'Top One', 'slug': 'top-one',
+            'subcategories': [{'id': 2, 'name': 'Child One',
+                               'slug': 'child-one', 'subcategories': None}]
+        }])
+
+        assert category_map.by_slug['top-one']['id'] == 1
+        assert 'child-one' not in category_map.by_slug
+        assert category_map.by_id[2]['slug'] == 'child-one'
+
+
+@pytest.fixture
+def category_cache(tmpdir):
+    with mock.patch.object(discourse_utils, 'CATEGORY_CACHE_PATH',
+                           str(tmpdir)), \
+            mock.patch.object(discourse_utils, '_category_cache', None):
+        yield
+
+
 @pytest.fixture
 def requests_mock():
     import requests
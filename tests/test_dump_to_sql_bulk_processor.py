@@ -0,0 +1,230 @@
+import os
+import runpy
+import datetime
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+
+import mock
+
+import datapackage_pipelines_measure.processors
+
+import logging
+log = logging.getLogger(__name__)
+
+PROCESSOR_PATH = os.path.join(
+    os.path.dirname(datapackage_pipelines_measure.processors.__file__),
+    'dump_to_sql_bulk.py')
+
+
+class MockResource(object):
+    '''Rows of a resource, with its `spec`, as dumpers expect.'''
+
+    def __init__(self, spec, rows):
+        self.spec = spec
+        self.rows = iter(rows)
+
+    def __iter__(self):
+        return self.rows
+
+    def __next__(self):
+        return next(self.rows)
+
+
+class TestMeasureDumpToSqlBulkProcessor(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        os.remove(self.db_path)
+        self.engine = 'sqlite:///{}'.format(self.db_path)
+
+    def tearDown(self):
+        os.remove(self.db_path)
+
+    def _run_processor(self, rows, batch_size=2,
+                       update_keys=('package', 'source', 'date'),
+                       extra_fields=()):
+        datapackage = {
+            'name': 'my-datapackage',
+            'project': 'my-project',
+            'resources': [{
+                'name': 'code-packaging',
+                'path': 'data/code-packaging.csv',
+                'schema': {
+                    'fields': [
+                        {'name': 'package', 'type': 'string'},
+                        {'name': 'source', 'type': 'string'},
+                        {'name': 'date', 'type': 'date'},
+                        {'name': 'downloads', 'type': 'integer'}
+                    ] + list(extra_fields)
+                }
+            }]
+        }
+        params = {
+            'engine': self.engine,
+            'batch-size': batch_size,
+            'tables': {
+                'codepackaging': {
+                    'resource-name': 'code-packaging',
+                    'mode': 'update',
+                    'update_keys': list(update_keys)
+                }
+            }
+        }
+
+        resource = MockResource(datapackage['resources'][0], rows)
+        # Dumpers import `ingest` and `spew` from `dumper_base`, so mock them
+        # there
+        with mock.patch('datapackage_pipelines.lib.dump.dumper_base.ingest') \
+                as mock_ingest, \
+                mock.patch('datapackage_pipelines.lib.dump.dumper_base.spew') \
+                as mock_spew:
+            mock_ingest.return_value = (params, datapackage,
+                                        iter([resource]))
+            runpy.run_path(PROCESSOR_PATH)
+        spew_args, _ = mock_spew.call_args
+        # Consume the rows, so they are written
+        for resource in spew_args[1]:
+            assert list(resource) == rows
+        return spew_args[2]
+
+    def _get_table_rows(self):
+        engine = create_engine(self.engine)
+        with engine.connect() as connection:
+            return [tuple(row) for row in connection.execute(
+                'SELECT package, source, date, downloads FROM codepackaging '
+                'ORDER BY date')]
+
+    def test_dump_to_sql_bulk_processor(self):
+        '''Rows are inserted in batches, then updated by key.'''
+        day = datetime.date(2017, 5, 14)
+        rows = [{'package': 'my-package', 'source': 'npm',
+                 'date': day + datetime.timedelta(days=i), 'downloads': i}
+                for i in range(3)]
+
+        stats = self._run_processor(rows)
+
+        assert stats['codepackaging: rows written'] == 3
+        assert stats['codepackaging: batches'] == 2
+        assert self._get_table_rows() == [
+            ('my-package', 'npm', '2017-05-14', 0),
+            ('my-package', 'npm', '2017-05-15', 1),
+            ('my-package', 'npm', '2017-05-16', 2)
+        ]
+
+        # Update the last day, and add a new one
+        new_rows = [
+            {'package': 'my-package', 'source': 'npm',
+             'date': datetime.date(2017, 5, 16), 'downloads': 20},
+            {'package': 'my-package', 'source': 'npm',
+             'date': datetime.date(2017, 5, 17), 'downloads': 3}
+        ]
+
+        stats = self._run_processor(new_rows)
+
+        assert stats['codepackaging: rows written'] == 2
+        assert stats['codepackaging: batches'] == 1
+        assert self._get_table_rows() == [
+            ('my-package', 'npm', '2017-05-14', 0),
+            ('my-package', 'npm', '2017-05-15', 1),
+            ('my-package', 'npm', '2017-05-16', 20),
+            ('my-package', 'npm', '2017-05-17', 3)
+        ]
+
+    def test_last_row_for_a_key_upserted(self):
+        '''Existing rows are updated on conflict, with the last of the rows
+        for a key in a batch.'''
+        day = datetime.date(2017, 5, 14)
+        self._run_processor([{'package': 'my-package', 'source': 'npm',
+                              'date': day, 'downloads': 1}])
+
+        stats = self._run_processor([
+            {'package': 'my-package', 'source': 'npm', 'date': day,
+             'downloads': 2},
+            {'package': 'my-package', 'source': 'npm', 'date': day,
+             'downloads': 3}
+        ])
+
+        assert stats['codepackaging: rows written'] == 1
+        assert self._get_table_rows() == [
+            ('my-package', 'npm', '2017-05-14', 3)
+        ]
+
+    def test_nothing_done_on_conflict_without_other_columns(self):
+        '''Rows whose update keys are all their columns are only inserted
+        if missing.'''
+        update_keys = ('package', 'source', 'date', 'downloads')
+        row = {'package': 'my-package', 'source': 'npm',
+               'date': datetime.date(2017, 5, 14), 'downloads': 1}
+        self._run_processor([row], update_keys=update_keys)
+
+        new_row = dict(row, date=datetime.date(2017, 5, 15))
+        self._run_processor([row, new_row], update_keys=update_keys)
+
+        assert self._get_table_rows() == [
+            ('my-package', 'npm', '2017-05-14', 1),
+            ('my-package', 'npm', '2017-05-15', 1)
+        ]
+
+
+class TestMeasureDumpToSqlBulkStageRows(unittest.TestCase):
+
+    def _get_dumper(self, dialect_name):
+        '''Return a dumper with a mocked `dialect_name` engine.'''
+        with mock.patch('datapackage_pipelines.lib.dump.dumper_base.ingest') \
+                as mock_ingest, \
+                mock.patch('datapackage_pipelines.lib.dump.dumper_base.spew'):
+            mock_ingest.return_value = (
+                {'engine': 'sqlite://', 'tables': {}}, {'resources': []},
+                iter([]))
+            dumper = runpy.run_path(PROCESSOR_PATH)['BulkSQLDumper']()
+        dumper.engine = mock.Mock()
+        dumper.engine.dialect.name = dialect_name
+        dumper.engine.dialect.identifier_preparer.quote.side_effect = \
+            lambda name: '"{}"'.format(name)
+        return dumper
+
+    def test_rows_copied_as_csv(self):
+        '''Only None is written as NULL, and objects as JSON.'''
+        dumper = self._get_dumper('postgresql')
+        connection = mock.Mock()
+        copied = {}
+
+        def _copy_expert(sql, buf):
+            copied['sql'] = sql
+            copied['csv'] = buf.read()
+        cursor = connection.connection.cursor.return_value
+        cursor.copy_expert.side_effect = _copy_expert
+
+        columns = ['package', 'date', 'downloads', 'note', 'meta']
+        dumper._stage_rows(connection, 'staging', columns, [
+            {'package': 'my "package"', 'date': datetime.date(2017, 5, 14),
+             'downloads': 1, 'note': '', 'meta': {'tags': ['a', 'b']}},
+            {'package': 'other', 'date': datetime.date(2017, 5, 15),
+             'downloads': None, 'note': 'line\nbreak', 'meta': None}
+        ])
+
+        assert copied['sql'] == \
+            'COPY "staging" ("package", "date", "downloads", "note", ' \
+            '"meta") FROM STDIN WITH CSV'
+        assert copied['csv'] == (
+            '"my ""package""","2017-05-14","1","",'
+            '"{""tags"": [""a"", ""b""]}"\n'
+            '"other","2017-05-15",,"line\nbreak",\n')
+
+    def test_objects_inserted_as_json(self):
+        dumper = self._get_dumper('sqlite')
+        connection = mock.Mock()
+
+        dumper._stage_rows(connection, 'staging', ['package', 'meta'], [
+            {'package': 'my-package', 'meta': {'tags': ['a']}},
+            {'package': 'other', 'meta': None}
+        ])
+
+        _, params = connection.execute.call_args[0]
+        assert params == [
+            {'c0': 'my-package', 'c1': '{"tags": ["a"]}'},
+            {'c0': 'other', 'c1': None}
+        ]
@@ -1,4 +1,5 @@
 import os
+import collections
 import mock
 import dateutil
 import pytest
@@ -50,7 +51,7 @@ class TestMeasureGAProcessor(object):
         assert len(resources) == 1
 
         # rows in resource
-        rows = list(resources)[0]
+        rows = list(resources[0])
         assert len(rows) == 4
         # first row asserts
         assert rows[0] == {
@@ -133,7 +134,7 @@ class TestMeasureGAProcessor(object):
         assert list(resources[0])[0] == next(latest_entries_res())
 
         # rows in resource
-        rows = list(resources)[1]
+        rows = list(resources[1])
         assert len(rows) == 4
         # first row asserts
         assert rows[0] == {
@@ -188,14 +189,101 @@ class TestMeasureGAProcessor(object):
         assert len(resources) == 1
 
         # rows in resource
-        rows = list(resources)[0]
+        rows = list(resources[0])
         assert len(rows) == 0
 
+    def test_add_ga_resource_processor_paged(self, paged_ga_response):
+        '''Rows are collected from all pages of the GA response.'''
+
+        # input arguments used by our mock `ingest`
+        datapackage = {
+            'name': 'my-datapackage',
+            'project': 'my-project',
+            'resources': []
+        }
+        params = {
+            'domain': {
+                'url': 'sub.example.com',
+                'viewid': '123456'
+            }
+        }
+
+        # Path to the processor we want to test
+        processor_dir = \
+            os.path.dirname(datapackage_pipelines_measure.processors.__file__)
+        processor_path = os.path.join(processor_dir, 'add_ga_resource.py')
+
+        # Trigger the processor with our mock `ingest` and capture what it will
+        # returned to `spew`.
+        spew_args, _ = \
+            mock_processor_test(processor_path,
+                                (params, datapackage, iter([])))
+
+        rows = list(list(spew_args[1])[0])
+        assert [row['visitors'] for row in rows] == [1, 3, 13, 55]
+
+        # The month of the rows needed a second page
+        batch_get = paged_ga_response.build_from_document.return_value \
+            .reports.return_value.batchGet
+        page_tokens = [
+            call[1]['body']['reportRequests'][0]['pageToken']
+            for call in batch_get.call_args_list
+            if 'pageToken' in call[1]['body']['reportRequests'][0]]
+        assert page_tokens == ['3']
+
+    def test_add_ga_resource_processor_domains(self, full_ga_response):
+        '''Several domains are collected together, requesting each view
+        once.'''
+
+        # input arguments used by our mock `ingest`
+        datapackage = {
+            'name': 'my-datapackage',
+            'project': 'my-project',
+            'resources': []
+        }
+        params = {
+            'name': 'ga',
+            'domains': [
+                {'url': 'sub.example.com', 'viewid': '123456'},
+                {'url': 'other.example.com', 'viewid': '123456'},
+                {'url': 'example.org', 'viewid': '654321'}
+            ]
+        }
+
+        # Path to the processor we want to test
+        processor_dir = \
+            os.path.dirname(datapackage_pipelines_measure.processors.__file__)
+        processor_path = os.path.join(processor_dir, 'add_ga_resource.py')
+
+        # Trigger the processor with our mock `ingest` and capture what it will
+        # returned to `spew`.
+        spew_args, _ = \
+            mock_processor_test(processor_path,
+                                (params, datapackage, iter([])))
+
+        spew_dp = spew_args[0]
+        assert spew_dp['resources'][0]['name'] == 'ga'
+
+        # The mock returns the same rows for each view
+        rows = list(list(spew_args[1])[0])
+        assert [row['visitors'] for row in rows] == [1, 3, 13, 55] * 2
+
+        batch_get = full_ga_response.build_from_document.return_value \
+            .reports.return_value.batchGet
+        view_ids = collections.Counter(
+            call[1]['body']['reportRequests'][0]['viewId']
+            for call in batch_get.call_args_list)
+        assert set(view_ids) == {'123456', '654321'}
+        assert view_ids['123456'] == view_ids['654321']
 
 
 @pytest.fixture
 def full_ga_response():
-    ga_response = {
+    yield from _mock_google_utils(_full_ga_response())
+
+
+def _full_ga_response():
+    return {
         'reports': [
             {
                 'data': {
@@ -214,7 +302,10 @@ def full_ga_response():
         ]
     }
 
-    yield from _mock_google_utils(ga_response)
+
+@pytest.fixture
+def paged_ga_response():
+    yield from _mock_google_utils(_full_ga_response(), page_size=3)
 
 
 @pytest.fixture
@@ -230,11 +321,35 @@ def empty_ga_response():
     yield from _mock_google_utils(ga_response)
 
 
-def _mock_google_utils(ga_response):
-    with mock.patch('datapackage_pipelines_measure.processors.google_utils.discovery') as mock_discovery:
-       mock_discovery \
-           .build.return_value \
-           .reports.return_value \
-           .batchGet.return_value \
-           .execute.return_value = ga_response
-       yield mock_discovery
+def _mock_google_utils(ga_response, page_size=None):
+    '''Mock the GA api, to respond to each report request with the rows of
+    `ga_response` within its date range, `page_size` rows at a time.'''
+    rows = ga_response['reports'][0]['data'].get('rows', [])
+
+    def _get_report(report_request):
+        date_range = report_request['dateRanges'][0]
+        start_date = date_range['startDate'].replace('-', '')
+        end_date = date_range['endDate'].replace('-', '')
+        report_rows = [row for row in rows
+                       if start_date <= row['dimensions'][0] <= end_date]
+        if not report_rows:
+            return {'data': {}}
+        offset = int(report_request.get('pageToken', 0))
+        page_end = offset + (page_size or len(report_rows))
+        report = {'data': {'rows': report_rows[offset:page_end]}}
+        if page_end < len(report_rows):
+            report['nextPageToken'] = str(page_end)
+        return report
+
+    def _batch_get(body):
+        response = {'reports': [_get_report(report_request)
+                                for report_request in body['reportRequests']]}
+        return mock.Mock(**{'execute.return_value': response})
+
+    with mock.patch('datapackage_pipelines_measure.processors.google_utils.get_discovery_document'), \
+            mock.patch('datapackage_pipelines_measure.processors.google_utils.discovery') as mock_discovery:  # noqa
+        mock_discovery \
+            .build_from_document.return_value \
+            .reports.return_value \
+            .batchGet.side_effect = _batch_get
+        yield mock_discovery
@@ -97,6 +97,132 @@ class TestMeasureGithubProcessor(unittest.TestCase):
                 'closed_issues': 5
             }]
 
+    @freeze_time("2017-10-12")
+    @requests_mock.mock()
+    def test_add_github_resource_processor_repositories(self, mock_request):
+        '''A list of repositories is collected into a single resource, in
+        the order given.'''
+        for repo_name, stars in (('first', 1), ('second', 2)):
+            mock_request.get(
+                'https://api.github.com/repos/org/{}'.format(repo_name),
+                json={
+                    'name': repo_name,
+                    'subscribers_count': 4,
+                    'stargazers_count': stars,
+                    'forks_count': 10,
+                    'full_name': 'org/{}'.format(repo_name)
+                })
+        mock_request.get('https://api.github.com/search/issues',
+                         json={'total_count': 5})
+
+        # input arguments used by our mock `ingest`
+        datapackage = {
+            'name': 'my-datapackage',
+            'project': 'my-project',
+            'resources': []
+        }
+        params = {
+            'name': 'github',
+            'repositories': ['org/first', 'org/second']
+        }
+
+        # Path to the processor we want to test
+        processor_dir = \
+            os.path.dirname(datapackage_pipelines_measure.processors.__file__)
+        processor_path = os.path.join(processor_dir, 'add_github_resource.py')
+
+        # Trigger the processor with our mock `ingest` and capture what it will
+        # returned to `spew`.
+        spew_args, _ = mock_processor_test(processor_path,
+                                           (params, datapackage, []))
+
+        spew_dp = spew_args[0]
+        spew_res_iter = spew_args[1]
+
+        assert len(spew_dp['resources']) == 1
+        assert spew_dp['resources'][0]['name'] == 'github'
+
+        rows = list(list(spew_res_iter)[0])
+        assert [(r['repository'], r['stars']) for r in rows] == \
+            [('first', 1), ('second', 2)]
+        assert rows[1]['closed_issues'] == 5
+
+    @freeze_time("2017-10-12")
+    @requests_mock.mock()
+    def test_add_github_resource_processor_graphql(self, mock_request):
+        '''The graphql backend fetches all repositories in one request, and
+        returns the same row shape as the rest backend.'''
+        def _repo_stats(name, stars):
+            return {
+                'name': name,
+                'watchers': {'totalCount': 4},
+                'stargazers': {'totalCount': stars},
+                'forkCount': 10,
+                'openPrs': {'totalCount': 1},
+                'closedPrs': {'totalCount': 2},
+                'openIssues': {'totalCount': 3},
+                'closedIssues': {'totalCount': 4}
+            }
+        mock_request.post('https://api.github.com/graphql', json={
+            'data': {
+                'repo0': _repo_stats('first', 1),
+                'repo1': _repo_stats('second', 2)
+            }
+        })
+
+        # input arguments used by our mock `ingest`
+        datapackage = {
+            'name': 'my-datapackage',
+            'project': 'my-project',
+            'resources': []
+        }
+        params = {
+            'name': 'github',
+            'repositories': ['org/first', 'org/second'],
+            'backend': 'graphql'
+        }
+
+        # Path to the processor we want to test
+        processor_dir = \
+            os.path.dirname(datapackage_pipelines_measure.processors.__file__)
+        processor_path = os.path.join(processor_dir, 'add_github_resource.py')
+
+        # Trigger the processor with our mock `ingest` and capture what it will
+        # returned to `spew`.
+        spew_args, _ = mock_processor_test(processor_path,
+                                           (params, datapackage, []))
+
+        spew_dp = spew_args[0]
+        spew_res_iter = spew_args[1]
+
+        assert mock_request.call_count == 1
+        request_json = mock_request.last_request.json()
+        assert request_json['variables'] == {
+            'owner0': 'org', 'name0': 'first',
+            'owner1': 'org', 'name1': 'second'
+        }
+
+        field_names = \
+            [field['name'] for field in spew_dp['resources'][0]['schema']
+             ['fields']]
+        assert field_names == ['repository', 'watchers', 'stars', 'forks',
+                               'source', 'date', 'open_prs', 'closed_prs',
+                               'open_issues', 'closed_issues']
+
+        rows = list(list(spew_res_iter)[0])
+        assert rows[1] == {
+            'repository': 'second',
+            'watchers': 4,
+            'stars': 2,
+            'forks': 10,
+            'source': 'github',
+            'date': FakeDate(2017, 10, 12),
+            'open_prs': 1,
+            'closed_prs': 2,
+            'open_issues': 3,
+            'closed_issues': 4
+        }
+
     @requests_mock.mock()
     def test_add_github_resource_processor_notjson(self, mock_request):
         '''Github response isn't json'''
@@ -0,0 +1,83 @@
+import mock
+import requests_mock
+
+from datapackage_pipelines_measure.processors import (
+    github_utils,
+    http_cache,
+    http_utils
+)
+from datapackage_pipelines_measure.processors.github_utils import RateLimiter
+
+
+class TestGithubUtilsRateLimiter(object):
+    def test_unpaced_without_wait_interval(self):
+        limiter = RateLimiter(0)
+
+        with mock.patch('time.sleep') as sleep_mock:
+            for _ in range(5):
+                limiter.acquire()
+
+        sleep_mock.assert_not_called()
+
+    def test_paced_by_wait_interval_before_headers(self):
+        with mock.patch('time.time', return_value=1000), \
+                mock.patch('time.sleep') as sleep_mock:
+            limiter = RateLimiter(3)
+            limiter.acquire()
+            sleep_mock.assert_not_called()
+            # second request waits for the bucket to refill, then continues
+            sleep_mock.side_effect = lambda secs: setattr(
+                limiter, 'tokens', 1)
+            limiter.acquire()
+
+        sleep_mock.assert_called_once_with(3)
+
+    def test_uses_remaining_from_headers(self):
+        with mock.patch('time.time', return_value=1000), \
+                mock.patch('time.sleep') as sleep_mock:
+            limiter = RateLimiter(3)
+            limiter.acquire()
+            limiter.release({'X-RateLimit-Remaining': '2',
+                             'X-RateLimit-Reset': '1060',
+                             'X-RateLimit-Limit': '30'})
+            # Two remaining, so no waiting
+            limiter.acquire()
+            limiter.acquire()
+            sleep_mock.assert_not_called()
+
+            # None remaining, so wait until reset
+            def _reset(secs):
+                limiter.reset_at = 1000
+            sleep_mock.side_effect = _reset
+            limiter.acquire()
+
+        sleep_mock.assert_called_once_with(60)
+        # Refilled to the limit, less the two requests still in flight and
+        # the one just acquired
+        assert limiter.tokens == 27
+        assert limiter.in_flight == 3
+
+
+class TestGithubUtilsMakeRequest(object):
+    def test_cached_responses_not_rate_limited(self, tmpdir):
+        url = 'https://api.github.com/repos/org/repo'
+        limiter = mock.Mock()
+        cache = http_cache.SQLiteCache(str(tmpdir))
+
+        with mock.patch.object(http_utils, '_cache', cache), \
+                mock.patch.dict(github_utils.settings,
+                                {'HTTP_CACHE_TTL_GITHUB': '60'}), \
+                requests_mock.mock() as m:
+            m.get(url, json={'name': 'repo'},
+                  headers={'X-RateLimit-Remaining': '10',
+                           'X-RateLimit-Reset': '1000'})
+            github_utils.make_github_request(url, rate_limiter=limiter)
+            response = github_utils.make_github_request(url,
+                                                        rate_limiter=limiter)
+
+        assert response == {'name': 'repo'}
+        assert m.call_count == 1
+        limiter.acquire.assert_called_once_with()
+        limiter.release.assert_called_once_with(mock.ANY)
+        assert limiter.release.call_args[0][0]['X-RateLimit-Remaining'] == \
+            '10'
@@ -0,0 +1,98 @@
+import time
+
+import mock
+import pytest
+
+from datapackage_pipelines_measure.processors import (
+    google_utils,
+    http_cache
+)
+
+
+@pytest.mark.usefixtures('discovery_cache')
+class TestGoogleUtilsDiscoveryDocument(object):
+    @mock.patch.dict(google_utils._discovery_documents, clear=True)
+    def test_document_requested_once(self, requests_mock):
+        requests_mock.get(
+            'https://www.googleapis.com/discovery/v1/apis/bigquery/v2/rest',
+            text='{"name": "bigquery"}')
+
+        assert google_utils.get_discovery_document('bigquery', 'v2') == \
+            '{"name": "bigquery"}'
+        assert google_utils.get_discovery_document('bigquery', 'v2') == \
+            '{"name": "bigquery"}'
+
+        assert requests_mock.call_count == 1
+
+    @mock.patch.dict(google_utils._discovery_documents, clear=True)
+    def test_falls_back_to_v2_discovery(self, requests_mock):
+        requests_mock.get(
+            'https://www.googleapis.com/discovery/v1/apis/'
+            'analyticsreporting/v4/rest', status_code=404)
+        requests_mock.get(
+            'https://analyticsreporting.googleapis.com/$discovery/rest'
+            '?version=v4', text='{"name": "analyticsreporting"}')
+
+        assert google_utils.get_discovery_document('analyticsreporting',
+                                                   'v4') == \
+            '{"name": "analyticsreporting"}'
+
+
+    @mock.patch.dict(google_utils._discovery_documents, clear=True)
+    def test_document_cached_across_processes(self, requests_mock):
+        requests_mock.get(
+            'https://www.googleapis.com/discovery/v1/apis/bigquery/v2/rest',
+            text='{"name": "bigquery"}')
+
+        google_utils.get_discovery_document('bigquery', 'v2')
+        # A new process starts without in-process caches, on the same
+        # directory
+        google_utils._discovery_documents.clear()
+        with mock.patch.object(google_utils, '_discovery_cache', None):
+            assert google_utils.get_discovery_document('bigquery', 'v2') == \
+                '{"name": "bigquery"}'
+
+        assert requests_mock.call_count == 1
+
+    @mock.patch.dict(google_utils._discovery_documents, clear=True)
+    def test_expired_document_requested_again(self, requests_mock):
+        requests_mock.get(
+            'https://www.googleapis.com/discovery/v1/apis/bigquery/v2/rest',
+            text='{"name": "bigquery"}')
+
+        google_utils.get_discovery_document('bigquery', 'v2')
+        google_utils._discovery_documents.clear()
+        with mock.patch.object(google_utils, 'DISCOVERY_DOCUMENT_TTL',
+                               0.001):
+            time.sleep(0.01)
+            google_utils.get_discovery_document('bigquery', 'v2')
+
+        assert requests_mock.call_count == 2
+
+class TestGoogleUtilsCredentials(object):
+    @mock.patch.dict(google_utils._credentials, clear=True)
+    def test_credentials_reused_for_scopes(self):
+        credentials = google_utils.get_credentials(
+            google_utils.GOOGLE_API_GA_SCOPES)
+
+        assert google_utils.get_credentials(
+            google_utils.GOOGLE_API_GA_SCOPES) is credentials
+        assert google_utils.get_credentials(
+            google_utils.GOOGLE_API_DRIVE_SCOPES) is not credentials
+
+
+@pytest.fixture
+def requests_mock():
+    import requests_mock
+
+    with requests_mock.mock() as m:
+        yield m
+
+
+@pytest.fixture
+def discovery_cache(tmpdir):
+    with mock.patch.object(google_utils, 'DISCOVERY_CACHE_PATH',
+                           str(tmpdir)), \
+            mock.patch.object(google_utils, '_discovery_cache',
+                              http_cache.SQLiteCache(str(tmpdir))):
+        yield
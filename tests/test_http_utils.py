@@ -0,0 +1,226 @@
+import hashlib
+
+import mock
+import pytest
+
+from datapackage_pipelines_measure.processors import (
+    http_cache,
+    http_utils
+)
+
+
+class TestHttpUtilsGetSession(object):
+    def test_reuses_session_for_host(self):
+        session = http_utils.get_session('https://example.com/one')
+
+        assert http_utils.get_session('https://example.com/two') is session
+        assert http_utils.get_session('https://example.org/one') \
+            is not session
+
+    def test_get_uses_default_timeout(self, requests_mock):
+        requests_mock.get('https://example.com/endpoint', json={})
+
+        http_utils.get('https://example.com/endpoint')
+
+        assert requests_mock.last_request.timeout == http_utils.HTTP_TIMEOUT
+        assert 'gzip' in \
+            requests_mock.last_request.headers['Accept-Encoding']
+
+
+class TestHttpUtilsCachedGet(object):
+    def test_not_cached_without_source(self, requests_mock, cache):
+        requests_mock.get('https://example.com/endpoint', json={'foo': 1})
+
+        http_utils.get('https://example.com/endpoint')
+        http_utils.get('https://example.com/endpoint')
+
+        assert requests_mock.call_count == 2
+
+    def test_fresh_response_served_from_cache(self, requests_mock, cache):
+        requests_mock.get('https://example.com/endpoint', json={'foo': 1})
+
+        first = http_utils.get('https://example.com/endpoint',
+                               cache_source='test', cache_ttl=60)
+        response = http_utils.get('https://example.com/endpoint',
+                                  cache_source='test', cache_ttl=60)
+
+        assert requests_mock.call_count == 1
+        assert not first.from_cache
+        assert response.from_cache
+        assert response.status_code == 200
+        assert response.json() == {'foo': 1}
+
+    def test_get_cached_only_returns_fresh_responses(self, requests_mock,
+                                                     cache):
+        requests_mock.get('https://example.com/endpoint', json={'foo': 1})
+
+        assert http_utils.get_cached('https://example.com/endpoint',
+                                     'test', cache_ttl=60) is None
+        http_utils.get('https://example.com/endpoint', cache_source='test')
+
+        response = http_utils.get_cached('https://example.com/endpoint',
+                                         'test', cache_ttl=60)
+        assert response.from_cache
+        assert response.json() == {'foo': 1}
+        assert http_utils.get_cached('https://example.com/endpoint',
+                                     'test', cache_ttl=0) is None
+        assert requests_mock.call_count == 1
+
+    def test_stale_response_revalidated(self, requests_mock, cache):
+        requests_mock.get('https://example.com/endpoint', [
+            {'json': {'foo': 1}, 'headers': {'ETag': '"abc"'}},
+            {'status_code': 304}
+        ])
+
+        http_utils.get('https://example.com/endpoint', cache_source='test')
+        response = http_utils.get('https://example.com/endpoint',
+                                  cache_source='test')
+
+        assert requests_mock.call_count == 2
+        assert requests_mock.last_request.headers['If-None-Match'] == '"abc"'
+        assert not response.from_cache
+        assert response.status_code == 200
+        assert response.json() == {'foo': 1}
+
+    def test_revalidated_response_has_current_headers(self, requests_mock,
+                                                      cache):
+        requests_mock.get('https://example.com/endpoint', [
+            {'json': {'foo': 1},
+             'headers': {'ETag': '"abc"', 'X-RateLimit-Remaining': '10',
+                         'X-RateLimit-Reset': '1000'}},
+            {'status_code': 304,
+             'headers': {'X-RateLimit-Remaining': '9',
+                         'X-RateLimit-Reset': '2000'}},
+            {'status_code': 304}
+        ])
+
+        http_utils.get('https://example.com/endpoint', cache_source='test')
+        response = http_utils.get('https://example.com/endpoint',
+                                  cache_source='test')
+
+        assert response.json() == {'foo': 1}
+        assert response.headers['ETag'] == '"abc"'
+        assert response.headers['X-RateLimit-Remaining'] == '9'
+        assert response.headers['X-RateLimit-Reset'] == '2000'
+
+        # The current headers are stored with the cached response
+        response = http_utils.get('https://example.com/endpoint',
+                                  cache_source='test')
+
+        assert response.headers['X-RateLimit-Remaining'] == '9'
+
+    def test_cached_url_not_stored(self, requests_mock, cache):
+        requests_mock.get('https://example.com/endpoint', json={'foo': 1})
+
+        http_utils.get('https://example.com/endpoint',
+                       params={'api_key': 'secret'}, cache_source='test',
+                       cache_ttl=60)
+        response = http_utils.get('https://example.com/endpoint',
+                                  params={'api_key': 'secret'},
+                                  cache_source='test', cache_ttl=60)
+
+        assert requests_mock.call_count == 1
+        assert response.url == 'https://example.com/endpoint?api_key=secret'
+        key = hashlib.sha256(response.url.encode('utf-8')).hexdigest()
+        entry = cache.get(key)
+        assert entry is not None
+        assert 'secret' not in repr(entry)
+
+    def test_unsuccessful_response_not_cached(self, requests_mock, cache):
+        requests_mock.get('https://example.com/endpoint', [
+            {'status_code': 500},
+            {'json': {'foo': 1}}
+        ])
+
+        http_utils.get('https://example.com/endpoint', cache_source='test',
+                       cache_ttl=http_utils.CACHE_FOREVER)
+        response = http_utils.get('https://example.com/endpoint',
+                                  cache_source='test',
+                                  cache_ttl=http_utils.CACHE_FOREVER)
+
+        assert response.json() == {'foo': 1}
+
+
+@mock.patch.dict(http_utils.stats, clear=True)
+@mock.patch.dict(http_utils._paused_until, clear=True)
+class TestHttpUtilsRetry(object):
+    def test_retries_after_retry_after_seconds(self, requests_mock):
+        requests_mock.get('https://example.com/endpoint', [
+            {'status_code': 429, 'headers': {'Retry-After': '2'}},
+            {'json': {'foo': 1}}
+        ])
+
+        with mock.patch('time.sleep') as sleep_mock:
+            response = http_utils.get('https://example.com/endpoint',
+                                      retry_policy=http_utils.RetryPolicy())
+
+        assert response.json() == {'foo': 1}
+        assert requests_mock.call_count == 2
+        assert 1.9 < sleep_mock.call_args[0][0] <= 2
+        assert http_utils.stats['example.com: rate limited requests'] == 1
+        assert http_utils.stats['example.com: rate limit waits'] == 1
+        assert 1.9 < \
+            http_utils.stats['example.com: rate limit wait seconds'] <= 2
+
+    def test_backoff_is_exponential_and_capped(self):
+        policy = http_utils.RetryPolicy(base_delay=1, max_delay=5)
+        response = mock.Mock(headers={})
+
+        assert 0.5 <= policy.get_delay(1, response) <= 1
+        assert 2 <= policy.get_delay(3, response) <= 4
+        assert policy.get_delay(10, response) == 5
+
+    def test_retry_after_http_date(self):
+        policy = http_utils.RetryPolicy()
+        response = mock.Mock(headers={
+            'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+
+        assert policy.get_delay(1, response) == 0
+
+    def test_attempts_are_capped(self, requests_mock):
+        requests_mock.get('https://example.com/endpoint', status_code=429)
+
+        with mock.patch('time.sleep'):
+            response = http_utils.get(
+                'https://example.com/endpoint',
+                retry_policy=http_utils.RetryPolicy(max_attempts=3))
+
+        assert response.status_code == 429
+        assert requests_mock.call_count == 3
+        assert http_utils.stats['example.com: rate limited requests'] == 2
+
+    def test_not_retried_without_policy(self, requests_mock):
+        requests_mock.get('https://example.com/endpoint', status_code=429)
+
+        response = http_utils.get('https://example.com/endpoint')
+
+        assert response.status_code == 429
+        assert requests_mock.call_count == 1
+        assert http_utils.stats == {}
+
+    def test_rate_limited_host_paused_for_other_requests(self,
+                                                         requests_mock):
+        requests_mock.get('https://example.com/other', json={})
+        requests_mock.get('https://example.org/other', json={})
+        http_utils._pause_host('example.com', 10)
+
+        with mock.patch('time.sleep') as sleep_mock:
+            http_utils.get('https://example.com/other')
+            http_utils.get('https://example.org/other')
+
+        assert sleep_mock.call_count == 1
+        assert 9 < sleep_mock.call_args[0][0] <= 10
+
+
+@pytest.fixture(params=sorted(http_cache.BACKENDS))
+def cache(request, tmpdir):
+    backend = http_cache.BACKENDS[request.param](str(tmpdir))
+    with mock.patch.object(http_utils, '_cache', backend):
+        yield backend
+
+@pytest.fixture
+def requests_mock():
+    import requests_mock
+
+    with requests_mock.mock() as m:
+        yield m
@@ -0,0 +1,91 @@
+import os
+import datetime
+import time
+
+import mock
+import pytest
+
+from datapackage_pipelines.utilities.resource_matcher import ResourceMatcher
+
+from datapackage_pipelines_measure.processors import latest_utils
+
+
+LATEST_ROWS = [
+    {'package': 'my-package', 'source': 'npm',
+     'date': datetime.date(2017, 5, 14)},
+    {'package': 'my-package', 'source': 'pypi',
+     'date': datetime.date(2017, 5, 15)}
+]
+
+
+@pytest.mark.usefixtures('index_path')
+class TestLatestUtilsIndex(object):
+    def test_index_lookup(self):
+        datapackage = {'resources': []}
+        latest_utils.write_latest_index(datapackage, 'latest-project-entries',
+                                        LATEST_ROWS, ['package', 'source'])
+        index_path = datapackage['latest-index']['path']
+
+        latest_row, res_iter = latest_utils.get_latest_row(
+            datapackage, iter([]), source='pypi', package='my-package')
+        assert latest_row == LATEST_ROWS[1]
+        assert list(res_iter) == []
+
+        latest_row, _ = latest_utils.get_latest_row(
+            datapackage, iter([]), source='npm', package='other-package')
+        assert latest_row is None
+
+        latest_utils.remove_latest_index(
+            datapackage, ResourceMatcher('latest-project-entries'))
+        assert 'latest-index' not in datapackage
+        assert not os.path.exists(index_path)
+
+    def test_remove_only_matching_index(self):
+        datapackage = {'resources': []}
+        latest_utils.write_latest_index(datapackage, 'latest-project-entries',
+                                        LATEST_ROWS, ['package', 'source'])
+
+        latest_utils.remove_latest_index(datapackage,
+                                         ResourceMatcher('other-resource'))
+        assert os.path.exists(datapackage['latest-index']['path'])
+
+        latest_utils.remove_latest_index(
+            datapackage, ResourceMatcher('latest-project-entries'))
+
+    def test_stale_indexes_removed(self, index_path):
+        '''Indexes left by failed pipelines are removed once stale.'''
+        stale_path = os.path.join(index_path,
+                                  'measure-latest-project-entries-1.db')
+        recent_path = os.path.join(index_path,
+                                   'measure-latest-project-entries-2.db')
+        for path in (stale_path, recent_path):
+            open(path, 'w').close()
+        stale_time = time.time() - latest_utils.LATEST_INDEX_MAX_AGE - 60
+        os.utime(stale_path, (stale_time, stale_time))
+
+        datapackage = {'resources': []}
+        latest_utils.write_latest_index(datapackage, 'latest-project-entries',
+                                        LATEST_ROWS, ['package', 'source'])
+
+        assert not os.path.exists(stale_path)
+        assert os.path.exists(recent_path)
+        assert os.path.dirname(datapackage['latest-index']['path']) == \
+            index_path
+
+    def test_lookup_from_resource(self):
+        '''Without an index, rows are read from the latest resource, which is
+        passed on.'''
+        datapackage = {'resources': [{'name': 'latest-project-entries'}]}
+
+        latest_row, res_iter = latest_utils.get_latest_row(
+            datapackage, iter([iter(LATEST_ROWS)]), source='npm',
+            package='my-package')
+
+        assert latest_row == LATEST_ROWS[0]
+        assert [list(res) for res in res_iter] == [LATEST_ROWS]
+
+
+@pytest.fixture
+def index_path(tmpdir):
+    with mock.patch.object(latest_utils, 'LATEST_INDEX_PATH', str(tmpdir)):
+        yield str(tmpdir)
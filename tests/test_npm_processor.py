@@ -31,23 +31,24 @@ class TestMeasureNPMProcessor(unittest.TestCase):
                 'created': created
             }
         }
-        mock_api_responses = []
+        mock_api_response = {
+            'downloads': [],
+            'start': (now - datetime.timedelta(days=day_range))
+            .strftime("%Y-%m-%d"),
+            'end': (now - datetime.timedelta(days=1)).strftime("%Y-%m-%d"),
+            'package': 'my_package'
+        }
         for day in reversed(range(1, day_range+1)):
             start = now - datetime.timedelta(days=day)
             start = start.strftime("%Y-%m-%d")
-            mock_api_responses.append({
-                'json': {
-                    'downloads': day,
-                    'start': start,
-                    'end': start,
-                    'package': 'my_package'
-                },
-                'status_code': 200
+            mock_api_response['downloads'].append({
+                'downloads': day,
+                'day': start
             })
         mock_request.get('https://registry.npmjs.org/my_package',
                          json=mock_registry)
-        matcher = re.compile('api.npmjs.org/downloads/point/')
-        mock_request.get(matcher, mock_api_responses)
+        matcher = re.compile('api.npmjs.org/downloads/range/')
+        mock_request.get(matcher, json=mock_api_response)
 
         # input arguments used by our mock `ingest`
         datapackage = {
@@ -107,23 +108,24 @@ class TestMeasureNPMProcessor(unittest.TestCase):
                 'created': created
             }
         }
-        mock_api_responses = []
+        mock_api_response = {
+            'downloads': [],
+            'start': (now - datetime.timedelta(days=day_range))
+            .strftime("%Y-%m-%d"),
+            'end': (now - datetime.timedelta(days=1)).strftime("%Y-%m-%d"),
+            'package': 'my_package'
+        }
         for day in reversed(range(1, day_range+1)):
             start = now - datetime.timedelta(days=day)
             start = start.strftime("%Y-%m-%d")
-            mock_api_responses.append({
-                'json': {
-                    'downloads': day,
-                    'start': start,
-                    'end': start,
-                    'package': 'my_package'
-                },
-                'status_code': 200
+            mock_api_response['downloads'].append({
+                'downloads': day,
+                'day': start
             })
         mock_request.get('https://registry.npmjs.org/my_package',
                          json=mock_registry)
-        matcher = re.compile('api.npmjs.org/downloads/point/')
-        mock_request.get(matcher, mock_api_responses)
+        matcher = re.compile('api.npmjs.org/downloads/range/')
+        mock_request.get(matcher, json=mock_api_response)
 
         # input arguments used by our mock `ingest`
         datapackage = {
@@ -196,23 +198,23 @@ class TestMeasureNPMProcessor(unittest.TestCase):
                 'created': created
             }
         }
-        mock_api_responses = []
+        mock_api_response = {
+            'downloads': [],
+            'start': (now - datetime.timedelta(days=7)).strftime("%Y-%m-%d"),
+            'end': (now - datetime.timedelta(days=1)).strftime("%Y-%m-%d"),
+            'package': 'my_package'
+        }
         for day in reversed(range(1, 8)):
             start = now - datetime.timedelta(days=day)
             start = start.strftime("%Y-%m-%d")
-            mock_api_responses.append({
-                'json': {
-                    'downloads': day,
-                    'start': start,
-                    'end': start,
-                    'package': 'my_package'
-                },
-                'status_code': 200
+            mock_api_response['downloads'].append({
+                'downloads': day,
+                'day': start
             })
         mock_request.get('https://registry.npmjs.org/my_package',
                          json=mock_registry)
-        matcher = re.compile('api.npmjs.org/downloads/point/')
-        mock_request.get(matcher, mock_api_responses)
+        matcher = re.compile('api.npmjs.org/downloads/range/')
+        mock_request.get(matcher, json=mock_api_response)
 
         # input arguments used by our mock `ingest`
         datapackage = {
@@ -352,3 +354,67 @@ class TestMeasureNPMProcessor(unittest.TestCase):
         rows = resources[1]
         # no rows were added
         assert len(rows) == 0
+
+    @requests_mock.mock()
+    def test_add_npm_resource_processor_range_windows(self, mock_request):
+        '''Long periods are requested in range windows, and days missing from
+        the response are zero-filled.'''
+
+        # package created two years ago
+        today = datetime.date.today()
+        created = today - datetime.timedelta(days=730)
+        mock_registry = {
+            'time': {
+                'created': created.strftime("%Y-%m-%d")
+            }
+        }
+        yesterday = today - datetime.timedelta(days=1)
+        mock_api_response = {
+            'downloads': [{
+                'downloads': 3,
+                'day': yesterday.strftime("%Y-%m-%d")
+            }],
+            'package': 'my_package'
+        }
+        mock_request.get('https://registry.npmjs.org/my_package',
+                         json=mock_registry)
+        matcher = re.compile('api.npmjs.org/downloads/range/')
+        mock_request.get(matcher, json=mock_api_response)
+
+        # input arguments used by our mock `ingest`
+        datapackage = {
+            'name': 'my-datapackage',
+            'project': 'my-project',
+            'resources': []  # nothing here
+        }
+        params = {
+            'name': 'hello',
+            'package': 'my_package',
+            'project_id': 'my-project'
+        }
+
+        # Path to the processor we want to test
+        processor_dir = \
+            os.path.dirname(datapackage_pipelines_measure.processors.__file__)
+        processor_path = os.path.join(processor_dir, 'add_npm_resource.py')
+
+        # Trigger the processor with our mock `ingest` and capture what it will
+        # returned to `spew`.
+        spew_args, _ = \
+            mock_processor_test(processor_path,
+                                (params, datapackage, iter([])))
+
+        spew_res_iter = spew_args[1]
+        rows = list(spew_res_iter)[0]
+
+        # two range requests cover 730 days, plus one registry request
+        assert mock_request.call_count == 3
+        assert len(rows) == 730
+        assert rows[0] == {
+            'date': created,
+            'downloads': 0,
+            'package': 'my_package',
+            'source': 'npm'
+        }
+        assert rows[-1]['date'] == yesterday
+        assert rows[-1]['downloads'] == 3
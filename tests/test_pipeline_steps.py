@@ -28,6 +28,25 @@ class TestPipelineSteps(unittest.TestCase):
             sig_args = [a for a in sig.parameters]
             assert sig_args == ['steps', 'pipeline_id', 'project_id', 'config']
 
+    def test_social_media_latest_entries_only_for_backfill(self):
+        '''Latest stored rows are only read for a Twitter backfill.'''
+        def step_names(config):
+            steps = pipeline_steps.social_media.add_steps(
+                [], 'my-project-social-media', 'my-project', config)
+            return [step[0] if isinstance(step, tuple) else step
+                    for step in steps]
+
+        for config in ({'twitter': {'entities': ['#hashtag']}},
+                       {'facebook': {'pages': ['mypage']}}):
+            assert 'measure.datastore_get_latest' not in step_names(config)
+            assert 'measure.remove_resource' not in step_names(config)
+
+        names = step_names({'twitter': {'entities': ['#hashtag'],
+                                        'backfill': True}})
+        assert names[:2] == ['measure.datastore_get_latest',
+                             'measure.add_twitter_resource']
+        assert 'measure.remove_resource' in names
+
 
 class TestPipelineGenerator(unittest.TestCase):
 
@@ -68,3 +87,16 @@ class TestPipelineGenerator(unittest.TestCase):
             gen = list(Generator.generate_pipeline(source))
             self.assertEqual(cm.output, ['WARNING:{}:{}'.format(logger, msg)])
             assert len(gen) is 0
+
+    def test_pipeline_generator_bulk_dump(self):
+        '''Test `dump.to_sql` steps are replaced for bulk dumps.'''
+        dump_params = {'engine': 'sqlite://', 'tables': {}}
+        steps = [('add_metadata', {'foo': 'bar'}),
+                 'measure.add_uuid',
+                 ('dump.to_sql', dump_params)]
+
+        assert Generator._use_bulk_dump(steps) == [
+            ('add_metadata', {'foo': 'bar'}),
+            'measure.add_uuid',
+            ('measure.dump_to_sql_bulk', dump_params)
+        ]
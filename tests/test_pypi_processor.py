@@ -1,5 +1,6 @@
 import os
 import mock
+import datetime
 import dateutil
 import unittest
 
@@ -13,15 +14,70 @@ import logging
 log = logging.getLogger(__name__)
 
 
+def _mock_bigquery_jobs(mock_discovery, job_rows, page_size=None,
+                        polls=1):
+    '''Mock the BigQuery jobs api, so that the n-th inserted job is done
+    after `polls` polls, and its results are the n-th list of `job_rows`, in
+    pages of `page_size` rows. Return the mock jobs resource.'''
+    mock_jobs = mock_discovery.build_from_document.return_value \
+        .jobs.return_value
+    polled = {}
+
+    def insert(projectId, body):
+        job_id = 'job{}'.format(mock_jobs.insert.call_count - 1)
+        job = {
+            'jobReference': {'projectId': projectId, 'jobId': job_id},
+            'status': {'state': 'RUNNING'}
+        }
+        if body['configuration']['dryRun']:
+            job['status']['state'] = 'DONE'
+            job['statistics'] = {'totalBytesProcessed': '1234'}
+        return mock.Mock(**{'execute.return_value': job})
+
+    def get(projectId, jobId):
+        polled[jobId] = polled.get(jobId, 0) + 1
+        state = 'DONE' if polled[jobId] >= polls else 'RUNNING'
+        return mock.Mock(**{'execute.return_value': {
+            'jobReference': {'projectId': projectId, 'jobId': jobId},
+            'status': {'state': state}
+        }})
+
+    def get_query_results(projectId, jobId, maxResults, pageToken=None):
+        assert polled[jobId] == polls
+        rows = job_rows[int(jobId[len('job'):])]
+        start = int(pageToken or 0)
+        end = start + (page_size or len(rows))
+        response = {'jobComplete': True}
+        if rows[start:end]:
+            response['rows'] = rows[start:end]
+        if end < len(rows):
+            response['pageToken'] = str(end)
+        return mock.Mock(**{'execute.return_value': response})
+
+    mock_jobs.insert.side_effect = insert
+    mock_jobs.get.side_effect = get
+    mock_jobs.getQueryResults.side_effect = get_query_results
+    return mock_jobs
+
+
 class TestMeasurePypiProcessor(unittest.TestCase):
 
     '''These test provide quite good code coverage, but don't test the date
     selection logic that well, or how well the sql statement works. The mock
     will always output predictably, as defined by the test.'''
 
+    def setUp(self):
+        # Don't wait between polls of query jobs
+        patcher = mock.patch(
+            'datapackage_pipelines_measure.processors.pypi_utils.time')
+        self.mock_time = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch('datapackage_pipelines_measure.processors.google_utils.get_discovery_document')  # noqa
     @mock.patch(
         'datapackage_pipelines_measure.processors.google_utils.discovery')
-    def test_add_pypi_resource_processor_no_latest(self, mock_discovery):
+    def test_add_pypi_resource_processor_no_latest(self, mock_discovery,
+                                                   mock_document):
         '''No latest in db, so populate from big query request.'''
 
         bq_response = {
@@ -50,11 +106,7 @@ class TestMeasurePypiProcessor(unittest.TestCase):
             ]
         }
 
-        mock_discovery \
-            .build.return_value \
-            .jobs.return_value \
-            .query.return_value \
-            .execute.return_value = bq_response
+        _mock_bigquery_jobs(mock_discovery, [bq_response['rows']])
 
         # input arguments used by our mock `ingest`
         datapackage = {
@@ -101,9 +153,11 @@ class TestMeasurePypiProcessor(unittest.TestCase):
         assert rows[len(rows)-1]['date'] == \
             dateutil.parser.parse('2017-05-16').date()
 
+    @mock.patch('datapackage_pipelines_measure.processors.google_utils.get_discovery_document')  # noqa
     @mock.patch(
         'datapackage_pipelines_measure.processors.google_utils.discovery')
-    def test_add_pypi_resource_processor_latest_week_old(self, mock_discovery):
+    def test_add_pypi_resource_processor_latest_week_old(self, mock_discovery,
+                                                         mock_document):
         '''Latest in db is a week old, so fetch new data.'''
 
         bq_response = {
@@ -132,11 +186,7 @@ class TestMeasurePypiProcessor(unittest.TestCase):
             ]
         }
 
-        mock_discovery \
-            .build.return_value \
-            .jobs.return_value \
-            .query.return_value \
-            .execute.return_value = bq_response
+        _mock_bigquery_jobs(mock_discovery, [bq_response['rows']])
 
         # input arguments used by our mock `ingest`
         datapackage = {
@@ -204,3 +254,122 @@ class TestMeasurePypiProcessor(unittest.TestCase):
         assert rows[len(rows)-1]['downloads'] == 24
         assert rows[len(rows)-1]['date'] == \
             dateutil.parser.parse('2017-05-16').date()
+
+    @mock.patch('datapackage_pipelines_measure.processors.google_utils.get_discovery_document')  # noqa
+    @mock.patch(
+        'datapackage_pipelines_measure.processors.google_utils.discovery')
+    def test_add_pypi_resource_processor_packages(self, mock_discovery,
+                                                  mock_document):
+        '''Several packages are requested with a query job per start date,
+        and split into a resource each.'''
+
+        def bq_row(package, date, downloads):
+            return {'f': [{'v': package}, {'v': date}, {'v': downloads}]}
+
+        mock_jobs = _mock_bigquery_jobs(mock_discovery, [
+            [bq_row('other_package', '2017-05-15', '3')],
+            [bq_row('my_package', '2017-05-15', '12'),
+             bq_row('my_package', '2017-05-14', '6')]
+        ], page_size=1, polls=3)
+
+        # input arguments used by our mock `ingest`
+        datapackage = {
+            'name': 'my-datapackage',
+            'project': 'my-project',
+            'resources': [{
+                'name': 'latest-project-entries',
+                'schema': {
+                    'fields': [
+                        {'name': 'date', 'type': 'date'},
+                        {'name': 'downloads', 'type': 'int'},
+                        {'name': 'package', 'type': 'string'},
+                        {'name': 'source', 'type': 'string'},
+                    ]
+                }
+            }]
+        }
+        params = {
+            'packages': ['my_package', 'other_package', 'empty_package'],
+            'project_id': 'my-project'
+        }
+
+        def latest_entries_res():
+            yield {
+                    'date': dateutil.parser.parse('2017-05-13').date(),
+                    'downloads': 3,
+                    'package': 'my_package',
+                    'source': 'pypi'
+                }
+
+        # Path to the processor we want to test
+        processor_dir = \
+            os.path.dirname(datapackage_pipelines_measure.processors.__file__)
+        processor_path = os.path.join(processor_dir, 'add_pypi_resource.py')
+
+        # Trigger the processor with our mock `ingest` and capture what it will
+        # returned to `spew`.
+        spew_args, _ = \
+            mock_processor_test(processor_path,
+                                (params, datapackage,
+                                 iter([latest_entries_res()])))
+
+        spew_dp = spew_args[0]
+        spew_res_iter = spew_args[1]
+
+        # a resource per package, after the latest entries
+        assert [r['name'] for r in spew_dp['resources']] == \
+            ['latest-project-entries', 'my-package', 'other-package',
+             'empty-package']
+        resources = [list(r) for r in spew_res_iter]
+        assert len(resources) == 4
+
+        assert [(r['package'], r['downloads']) for r in resources[1]] == \
+            [('my_package', 12), ('my_package', 6)]
+        assert [(r['package'], r['downloads']) for r in resources[2]] == \
+            [('other_package', 3)]
+        assert resources[3] == []
+
+        # both jobs are submitted before waiting for either, then polled with
+        # backoff, and their results paged through
+        assert mock_jobs.insert.call_count == 2
+        assert mock_jobs.get.call_count == 6
+        assert [c[0][0] for c in self.mock_time.sleep.call_args_list] == \
+            [1, 2, 4, 1, 2, 4]
+        assert mock_jobs.getQueryResults.call_count == 3
+
+        # a query per start date, with standard SQL, only scanning the
+        # partitions of its period
+        queries = [c[1]['body']['configuration']['query']
+                   for c in mock_jobs.insert.call_args_list]
+        assert all(q['useLegacySql'] is False for q in queries)
+        assert "project IN ('empty_package', 'other_package')" in \
+            queries[0]['query']
+        assert "timestamp >= TIMESTAMP('2016-01-22')\n" in \
+            queries[0]['query']
+        assert "project IN ('my_package')" in queries[1]['query']
+        assert "(project = 'my_package' AND " \
+            "timestamp >= TIMESTAMP('2017-05-13'))" in queries[1]['query']
+        assert "timestamp >= TIMESTAMP('2017-05-13')\n" in \
+            queries[1]['query']
+        assert "AND timestamp < TIMESTAMP('{}')".format(
+            datetime.date.today()) in queries[1]['query']
+
+    @mock.patch('datapackage_pipelines_measure.processors.pypi_utils.DRY_RUN',
+                True)
+    @mock.patch('datapackage_pipelines_measure.processors.google_utils.get_discovery_document')  # noqa
+    @mock.patch(
+        'datapackage_pipelines_measure.processors.google_utils.discovery')
+    def test_pypi_bulk_collector_dry_run(self, mock_discovery,
+                                         mock_document):
+        '''A dry run only requests the bytes the query would process.'''
+        from datapackage_pipelines_measure.processors import pypi_utils
+
+        mock_jobs = _mock_bigquery_jobs(mock_discovery, [])
+
+        collected = pypi_utils.pypi_bulk_collector({'my_package': None})
+
+        assert collected == {'my_package': []}
+        assert mock_jobs.insert.call_count == 1
+        assert mock_jobs.insert.call_args[1]['body']['configuration'][
+            'dryRun'] is True
+        assert mock_jobs.getQueryResults.call_count == 0
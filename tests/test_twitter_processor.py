@@ -1,7 +1,10 @@
 import os
 import datetime
+import time
 import unittest
 import mock
+
+import tweepy
 from collections import namedtuple
 
 from datapackage_pipelines.utilities.lib_test_helpers import (
@@ -9,6 +12,7 @@ from datapackage_pipelines.utilities.lib_test_helpers import (
 )
 
 import datapackage_pipelines_measure.processors
+from datapackage_pipelines_measure.processors import twitter_utils
 
 import logging
 log = logging.getLogger(__name__)
@@ -23,11 +27,18 @@ Status = namedtuple('Status',
                     ])
 
 
+User = namedtuple('User', ['screen_name', 'followers_count'])
+
+
 class MockTwitterAPI():
 
-    def get_user(self, account_name):
-        User = namedtuple('User', 'followers_count')
-        return User(5)
+    def __init__(self):
+        self.lookup_users_calls = []
+
+    def lookup_users(self, screen_names):
+        self.lookup_users_calls.append(screen_names)
+        return [User(screen_name, 5) for screen_name in screen_names
+                if screen_name != 'unknown']
 
     def search(self):
         yesterday = datetime.datetime.now() - datetime.timedelta(days=1)
@@ -67,8 +78,52 @@ def get_cursor_items_iter(items):
     return MockCursorIterable(items)
 
 
+def get_rate_limited_cursor_items_iter(items, rate_limited_times, reset_in):
+    '''Return a cursor iterable that raises a rate limit error the first
+    `rate_limited_times` times it's accessed, with a rate limit that resets
+    in `reset_in` secs.'''
+    cursor_items = get_cursor_items_iter(items)
+    next_item = cursor_items.next
+    errors = [rate_limited_times]
+
+    def next():
+        if errors[0] > 0:
+            errors[0] -= 1
+            response = mock.Mock(headers={
+                'x-rate-limit-remaining': '0',
+                'x-rate-limit-reset': str(int(time.time() + reset_in))
+            })
+            raise tweepy.RateLimitError('Rate limit exceeded', response)
+        return next_item()
+
+    cursor_items.next = next
+    return cursor_items
+
+
+class FakeClock(object):
+    '''Replaces `time.time` and `time.sleep`, so sleeping advances time
+    without waiting.'''
+
+    def __init__(self):
+        self.now = time.time()
+        self.sleep = mock.Mock(side_effect=self._sleep)
+
+    def _sleep(self, secs):
+        self.now += secs
+
+    def time(self):
+        return self.now
+
+
+@mock.patch.dict(twitter_utils.stats, clear=True)
+@mock.patch.dict(twitter_utils._resumes_at, clear=True)
 class TestMeasureTwitterProcessor(unittest.TestCase):
 
+    def setUp(self):
+        # The API handler is shared by all requests, so build it again with
+        # each test's mocks
+        twitter_utils._get_twitter_api_handler.cache_clear()
+
     @mock.patch('tweepy.Cursor')
     @mock.patch('tweepy.auth.AppAuthHandler')
     @mock.patch('tweepy.API')
@@ -127,6 +182,16 @@ class TestMeasureTwitterProcessor(unittest.TestCase):
         assert first_row['interactions'] == 15
         assert first_row['followers'] == 5
 
+        # the timeline is bounded to yesterday by tweet ids
+        _, timeline_args = mock_cursor.call_args_list[1]
+        yesterday = datetime.datetime.combine(
+            datetime.date.today() - datetime.timedelta(days=1),
+            datetime.time()).replace(tzinfo=datetime.timezone.utc)
+        since_ms = (timeline_args['since_id'] + 1 >> 22) + 1288834974657
+        max_ms = (timeline_args['max_id'] + 1 >> 22) + 1288834974657
+        assert since_ms == yesterday.timestamp() * 1000
+        assert max_ms - since_ms == 24 * 60 * 60 * 1000
+
     @mock.patch('tweepy.Cursor')
     @mock.patch('tweepy.auth.AppAuthHandler')
     @mock.patch('tweepy.API')
@@ -197,6 +262,16 @@ class TestMeasureTwitterProcessor(unittest.TestCase):
                 'interactions': 20,
                 'date': datetime.date.today() - datetime.timedelta(days=1)
             }
+        # mentions and interactions are counted in a single search
+        assert mock_cursor.call_count == 1
+        # only recent tweets are searched, without their entities
+        _, search_args = mock_cursor.call_args
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        assert search_args == {
+            'q': '#myhashtag', 'count': 100,
+            'result_type': 'recent', 'include_entities': False,
+            'since': str(yesterday), 'until': str(datetime.date.today())
+        }
 
     @mock.patch('tweepy.Cursor')
     @mock.patch('tweepy.auth.AppAuthHandler')
@@ -301,3 +376,272 @@ class TestMeasureTwitterProcessor(unittest.TestCase):
             mock_processor_test(processor_path, (params, datapackage, []))
 
         self.assertEqual(str(cm.exception), error_msg)
+
+    def _run_hashtag_processor(self):
+        datapackage = {
+            'name': 'my-datapackage',
+            'project': 'my-project',
+            'resources': []
+        }
+        params = {
+            'entity': '#myhashtag',
+            'project_id': 'my-project'
+        }
+        processor_dir = \
+            os.path.dirname(datapackage_pipelines_measure.processors.__file__)
+        processor_path = os.path.join(processor_dir, 'add_twitter_resource.py')
+        spew_args, _ = \
+            mock_processor_test(processor_path,
+                                (params, datapackage, []))
+        # Entities are collected as the resources are consumed
+        return spew_args[0], list(spew_args[1]), spew_args[2]
+
+    @mock.patch('tweepy.Cursor')
+    @mock.patch('tweepy.auth.AppAuthHandler')
+    @mock.patch('tweepy.API')
+    def test_add_twitter_resource_processor_rate_limited(
+            self, mock_api, mock_auth, mock_cursor):
+        '''Rate limited searches wait until the rate limit resets.'''
+        mock_auth.return_value = 'authed'
+        mock_api.return_value = my_mock_api
+        mock_cursor.return_value.items.side_effect = [
+            get_rate_limited_cursor_items_iter(my_mock_api.search(), 1, 60)
+        ]
+
+        clock = FakeClock()
+        with mock.patch('time.time', clock.time), \
+                mock.patch('time.sleep', clock.sleep):
+            spew_args = self._run_hashtag_processor()
+        mock_sleep = clock.sleep
+
+        rows = spew_args[1][0]
+        assert rows[0]['mentions'] == 2
+        assert rows[0]['interactions'] == 16
+        # waited until the reset, rather than a whole rate limit period
+        assert mock_sleep.call_count == 1
+        assert 55 < mock_sleep.call_args[0][0] <= 62
+        stats = spew_args[2]
+        assert stats['twitter: rate limit waits'] == 1
+        assert 55 < stats['twitter: rate limited seconds'] <= 62
+
+    @mock.patch('tweepy.Cursor')
+    @mock.patch('tweepy.auth.AppAuthHandler')
+    @mock.patch('tweepy.API')
+    def test_add_twitter_resource_processor_rate_limit_retries_bounded(
+            self, mock_api, mock_auth, mock_cursor):
+        '''Requests that stay rate limited aren't retried forever.'''
+        mock_auth.return_value = 'authed'
+        mock_api.return_value = my_mock_api
+        mock_cursor.return_value.items.side_effect = [
+            get_rate_limited_cursor_items_iter(my_mock_api.search(), 10, 60)
+        ]
+
+        clock = FakeClock()
+        with mock.patch('time.time', clock.time), \
+                mock.patch('time.sleep', clock.sleep), \
+                self.assertRaises(tweepy.RateLimitError):
+            self._run_hashtag_processor()
+
+        assert clock.sleep.call_count == 3
+
+    def _mock_cursors(self, mock_cursor, search_results, timelines):
+        '''Make cursors return the `search_results` for each search query,
+        and `timelines` for each screen name, whichever order they are
+        requested in.'''
+        def cursor(method, **kwargs):
+            if 'q' in kwargs:
+                items = search_results[kwargs['q']]
+            else:
+                items = timelines[kwargs['screen_name']]
+            return mock.Mock(**{
+                'items.return_value': get_cursor_items_iter(items)})
+        mock_cursor.side_effect = cursor
+
+    @mock.patch('tweepy.Cursor')
+    @mock.patch('tweepy.auth.AppAuthHandler')
+    @mock.patch('tweepy.API')
+    def test_add_twitter_resource_processor_entities(self, mock_api,
+                                                     mock_auth, mock_cursor):
+        '''Entities are collected in one step, authenticating once, and
+        looking up the followers of all accounts together.'''
+        mock_twitter_api = MockTwitterAPI()
+        mock_api.return_value = mock_twitter_api
+        self._mock_cursors(
+            mock_cursor,
+            {'#myhashtag': my_mock_api.search(),
+             '@myuser': my_mock_api.search(),
+             '@otheruser': []},
+            {'@myuser': my_mock_api.user_timeline(),
+             '@otheruser': []})
+
+        datapackage = {
+            'name': 'my-datapackage',
+            'project': 'my-project',
+            'resources': []
+        }
+        params = {
+            'entities': ['#myhashtag', '@myuser', '@otheruser'],
+            'project_id': 'my-project'
+        }
+        processor_dir = \
+            os.path.dirname(datapackage_pipelines_measure.processors.__file__)
+        processor_path = os.path.join(processor_dir, 'add_twitter_resource.py')
+        spew_args, _ = \
+            mock_processor_test(processor_path, (params, datapackage, []))
+
+        assert [r['name'] for r in spew_args[0]['resources']] == \
+            ['hash-myhashtag', 'at-myuser', 'at-otheruser']
+        rows = [resource[0] for resource in spew_args[1]]
+        assert [(r['entity'], r['mentions'], r['interactions'],
+                 r['followers']) for r in rows] == [
+            ('#myhashtag', 2, 16, None),
+            ('@myuser', 2, 15, 5),
+            ('@otheruser', 0, 0, 5)
+        ]
+        assert mock_auth.call_count == 1
+        assert mock_api.call_count == 1
+        assert mock_twitter_api.lookup_users_calls == \
+            [['myuser', 'otheruser']]
+
+    @mock.patch('tweepy.Cursor')
+    @mock.patch('tweepy.auth.AppAuthHandler')
+    @mock.patch('tweepy.API')
+    def test_add_twitter_resource_processor_unknown_account(
+            self, mock_api, mock_auth, mock_cursor):
+        '''Accounts missing from the users lookup raise an informative
+        error.'''
+        mock_api.return_value = MockTwitterAPI()
+
+        datapackage = {
+            'name': 'my-datapackage',
+            'project': 'my-project',
+            'resources': []
+        }
+        params = {
+            'entities': ['@myuser', '@unknown'],
+            'project_id': 'my-project'
+        }
+        processor_dir = \
+            os.path.dirname(datapackage_pipelines_measure.processors.__file__)
+        processor_path = os.path.join(processor_dir, 'add_twitter_resource.py')
+        with self.assertRaises(ValueError) as cm:
+            spew_args, _ = \
+                mock_processor_test(processor_path, (params, datapackage, []))
+            list(spew_args[1])
+
+        self.assertEqual(str(cm.exception),
+                         'User with name, "@unknown", was not found. '
+                         'Check your configuration')
+        assert mock_cursor.call_count == 0
+
+    @mock.patch('tweepy.Cursor')
+    @mock.patch('tweepy.auth.AppAuthHandler')
+    @mock.patch('tweepy.API')
+    def test_add_twitter_resource_processor_backfill(self, mock_api,
+                                                     mock_auth, mock_cursor):
+        '''Days missed since the latest stored rows, within the search index,
+        are collected in one search for each entity.'''
+        mock_api.return_value = MockTwitterAPI()
+        today = datetime.date.today()
+        now = datetime.datetime.now()
+        days_ago = [now - datetime.timedelta(days=i) for i in range(5)]
+        statuses = [
+            Status('okfnlabs', 1, 5, days_ago[1]),
+            Status('anonymous', 3, 0, days_ago[1]),
+            Status('anonymous', 3, 8, days_ago[2]),
+            Status('anonymous', 2, 2, days_ago[3]),
+            # beyond the search index, as returned with an earlier day
+            Status('anonymous', 2, 2, days_ago[4])
+        ]
+        self._mock_cursors(mock_cursor,
+                           {'#myhashtag': statuses, '@myuser': statuses},
+                           {'@myuser': [Status('myuser', 4, 4, days_ago[2])]})
+
+        datapackage = {
+            'name': 'my-datapackage',
+            'project': 'my-project',
+            'resources': [{
+                'name': 'latest-project-entries',
+                'schema': {
+                    'fields': [
+                        {'name': 'entity', 'type': 'string'},
+                        {'name': 'entity_type', 'type': 'string'},
+                        {'name': 'source', 'type': 'string'},
+                        {'name': 'date', 'type': 'date'}
+                    ]
+                }
+            }]
+        }
+        latest_rows = [{'entity': '#myhashtag', 'entity_type': 'hashtag',
+                        'source': 'twitter',
+                        'date': today - datetime.timedelta(days=3)}]
+        params = {
+            'entities': ['#myhashtag', '@myuser'],
+            'project_id': 'my-project',
+            'backfill': True
+        }
+        processor_dir = \
+            os.path.dirname(datapackage_pipelines_measure.processors.__file__)
+        processor_path = os.path.join(processor_dir, 'add_twitter_resource.py')
+        spew_args, _ = \
+            mock_processor_test(processor_path,
+                                (params, datapackage,
+                                 iter([iter(latest_rows)])))
+
+        resources = list(spew_args[1])
+        assert list(resources[0]) == latest_rows
+        # from the day after the latest row
+        assert [(r['date'], r['mentions'], r['interactions'], r['followers'])
+                for r in resources[1]] == [
+            (today - datetime.timedelta(days=2), 1, 11, None),
+            (today - datetime.timedelta(days=1), 2, 9, None)
+        ]
+        # from the start of the search index, without a latest row
+        assert [(r['date'], r['mentions'], r['interactions'], r['followers'])
+                for r in resources[2]] == [
+            (today - datetime.timedelta(days=3), 1, 0, None),
+            (today - datetime.timedelta(days=2), 1, 8, None),
+            (today - datetime.timedelta(days=1), 2, 0, 5)
+        ]
+        # one search, and one timeline, for each entity
+        assert mock_cursor.call_count == 3
+        searches = {kwargs['q']: (kwargs['since'], kwargs['until'])
+                    for _, kwargs in mock_cursor.call_args_list
+                    if 'q' in kwargs}
+        assert searches == {
+            '#myhashtag': (str(today - datetime.timedelta(days=2)),
+                           str(today)),
+            '@myuser': (str(today - datetime.timedelta(days=3)), str(today))
+        }
+
+    @mock.patch('tweepy.Cursor')
+    @mock.patch('tweepy.auth.AppAuthHandler')
+    @mock.patch('tweepy.API')
+    def test_add_twitter_resource_processor_backfill_without_latest(
+            self, mock_api, mock_auth, mock_cursor):
+        '''Without latest stored rows, a backfill collects the whole search
+        index window.'''
+        mock_api.return_value = MockTwitterAPI()
+        self._mock_cursors(mock_cursor, {'#myhashtag': []}, {})
+        today = datetime.date.today()
+
+        datapackage = {
+            'name': 'my-datapackage',
+            'project': 'my-project',
+            'resources': []
+        }
+        params = {
+            'entities': ['#myhashtag'],
+            'project_id': 'my-project',
+            'backfill': True
+        }
+        processor_dir = \
+            os.path.dirname(datapackage_pipelines_measure.processors.__file__)
+        processor_path = os.path.join(processor_dir, 'add_twitter_resource.py')
+        spew_args, _ = \
+            mock_processor_test(processor_path, (params, datapackage, []))
+
+        resources = list(spew_args[1])
+        assert len(resources) == 1
+        assert [r['date'] for r in resources[0]] == \
+            [today - datetime.timedelta(days=i) for i in (3, 2, 1)]